@@ -1,146 +1,381 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
 import httpx
 import json
 import asyncio
-from typing import List, Dict, Optional
+import hashlib
+import time
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 from datetime import datetime
 import structlog
 from config import settings
 from models import SearchResult, AIAnalysisRequest, AIAnalysisResponse
+from singleflight import SingleFlight
+from stale_refresh import StaleRefresher
+from cache_service import RedisCache, MemoryCache, TieredCache
+from cache_codec import CacheCodec
+from llm_scheduler import LLMScheduler, SchedulerQueueFull, DeadlineExceeded
+from prompt_builder import PromptBuilder, BuiltPrompt, PromptTooLong, ANALYSIS_SYSTEM_PROMPT
+from resilience import DependencyPolicy, DependencyUnavailable, NegativeCache
+from model_residency import ModelResidencyManager
+from metrics import (
+    CACHE_LOOKUP_LATENCY, PROMPT_BUILD_LATENCY, LLM_TIME_TO_FIRST_TOKEN, LLM_GENERATION_LATENCY,
+    LLM_REQUESTS_IN_FLIGHT, DEPENDENCY_ERRORS, record_cache_lookup, record_tokens
+)
 
 logger = structlog.get_logger()
 
 class AIAnalysisService:
     """Service for AI-powered analysis of search results"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[RedisCache] = None):
         self.base_url = settings.ollama_base_url
         self.default_model = settings.default_model
         
-        # Initialize OpenAI client for Ollama
-        self.client = OpenAI(
+        # Initialize async OpenAI client for Ollama on a pooled HTTP client
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.ollama_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.ollama_max_connections,
+                max_keepalive_connections=settings.ollama_max_keepalive_connections
+            )
+        )
+        # Retries are left to the budgeted policy below rather than the client's own
+        self.client = AsyncOpenAI(
             base_url=f"{self.base_url}/v1",
             api_key="ollama",  # Ollama doesn't require a real API key
-            timeout=httpx.Timeout(60.0)
+            timeout=httpx.Timeout(settings.ollama_timeout),
+            max_retries=0,
+            http_client=self.http_client
         )
+        
+        # Circuit breaker, budgeted retries and per-model timeouts for Ollama,
+        # learned per generated token and scaled by each prompt's max_tokens,
+        # and fast failure for analyses that just failed
+        self.policy = DependencyPolicy(
+            "ollama",
+            timeout_floor=settings.ollama_timeout_floor,
+            timeout_ceiling=settings.ollama_timeout,
+            is_failure=_is_failure,
+            is_retryable=_is_retryable,
+            is_timeout=lambda e: isinstance(e, (APITimeoutError, httpx.TimeoutException))
+        )
+        self.failures = NegativeCache("ollama", ttl=settings.analysis_negative_cache_ttl)
+        
+        # Per-model cap on concurrent generations; excess requests queue by priority
+        self.scheduler = LLMScheduler()
+        
+        # Keeps the models in use loaded in Ollama, within the machine's memory
+        self.residency = ModelResidencyManager(self.http_client, self.base_url, self.policy.breaker)
+        
+        # Prompts are sized to each model's context window
+        self.prompt_builder = PromptBuilder()
+        
+        # Identical concurrent analyses share one in-flight LLM generation
+        self.in_flight = SingleFlight("analysis")
+        
+        # Expired analyses are served stale while a background-priority job refreshes them
+        self.stale_refresher = StaleRefresher("analysis")
+        
+        # Analysis cache, stored alongside the search cache in Redis with its
+        # own TTL and in-process LRU tier
+        self.cache = TieredCache(
+            cache or RedisCache(),
+            CacheCodec(AIAnalysisResponse),
+            MemoryCache(
+                max_entries=settings.analysis_memory_cache_max_entries,
+                ttl=settings.analysis_cache_timeout
+            )
+        )
+    
+    async def close(self):
+        """Stop residency management and close the pooled HTTP client"""
+        await self.residency.close()
+        await self.client.close()
+    
+    def _get_cache_key(self, request: AIAnalysisRequest) -> str:
+        """Generate cache key from the query, ordered results, context and model"""
+        fingerprint = hashlib.sha256()
+        fingerprint.update(request.query.encode())
+        fingerprint.update(b"\0" + (request.context or "").encode())
+        fingerprint.update(b"\0" + (request.model or self.default_model).encode())
+        for result in request.search_results:
+            fingerprint.update(b"\0" + result.url.encode())
+            fingerprint.update(hashlib.md5(result.content.encode()).digest())
+        return f"analysis:{fingerprint.hexdigest()}"
+    
+    async def _get_cached_analysis(self, cache_key: str,
+                                   request: AIAnalysisRequest) -> Optional[AIAnalysisResponse]:
+        """Get a cached analysis, marked with the cache tier that served it
+        
+        Stale analyses are returned marked stale, and regenerated in the background.
+        """
+        try:
+            with CACHE_LOOKUP_LATENCY.labels(cache="analysis").time():
+                cached_analysis, tier, stale = await self.cache.get(cache_key)
+            record_cache_lookup("analysis", tier)
+            if cached_analysis:
+                logger.info("Cache hit for analysis", cache_key=cache_key, tier=tier, stale=stale)
+                if stale:
+                    refresh_request = request.model_copy(update={"priority": "background"})
+                    self.stale_refresher.refresh(cache_key, lambda: self.in_flight.do(
+                        cache_key,
+                        lambda: self._analyze(refresh_request, cache_key)
+                    ))
+                return cached_analysis.model_copy(update={"cache_tier": tier, "stale": stale})
+        except Exception as e:
+            logger.warning("Analysis cache retrieval failed", error=str(e))
+        
+        return None
+    
+    async def _cache_analysis(self, cache_key: str, analysis: AIAnalysisResponse):
+        """Cache a successful analysis"""
+        try:
+            stored = await self.cache.set(cache_key, analysis, settings.analysis_cache_timeout)
+            if stored:
+                logger.info("Cached analysis", cache_key=cache_key)
+        except Exception as e:
+            logger.warning("Analysis cache storage failed", error=str(e))
+    
+    def check_available(self, cache_key: str):
+        """Raise DependencyUnavailable if Ollama's breaker is open or this analysis just failed"""
+        self.failures.check(cache_key)
+        self.policy.breaker.check()
     
     async def analyze_search_results(self, request: AIAnalysisRequest) -> AIAnalysisResponse:
-        """Analyze search results using local LLM"""
+        """Analyze search results using local LLM
+        
+        Raises DependencyUnavailable instead of queueing while Ollama is
+        failing, and PromptTooLong if the query and context do not fit the
+        model's context window.
+        """
+        cache_key = self._get_cache_key(request)
+        cached_analysis = await self._get_cached_analysis(cache_key, request)
+        if cached_analysis:
+            return cached_analysis
+        
+        self.check_available(cache_key)
+        return await self.in_flight.do(
+            cache_key,
+            lambda: self._analyze(request, cache_key)
+        )
+    
+    async def _analyze(self, request: AIAnalysisRequest, cache_key: str) -> AIAnalysisResponse:
+        """Run the LLM analysis for a request and cache it"""
         start_time = datetime.now()
+        model = request.model or self.default_model
+        
+        # Prepare the analysis prompt (raises PromptTooLong, which is not an Ollama failure)
+        prompt = self._create_analysis_prompt(request, model)
         
         try:
-            # Prepare the analysis prompt
-            prompt = self._create_analysis_prompt(request)
-            
             # Get AI analysis
-            model = request.model or self.default_model
-            
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are an expert research analyst. Your task is to analyze web search results and provide comprehensive, accurate summaries. 
-
-Key requirements:
-1. Provide a clear, concise summary of the main findings
-2. Extract 3-5 key points from the search results
-3. List the most relevant sources
-4. Assign a confidence score (0.0-1.0) based on source quality and consistency
-5. Be objective and factual
-6. If information is conflicting, mention the discrepancies
-7. Format your response as valid JSON with the required fields"""
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,  # Lower temperature for more consistent analysis
-                max_tokens=2000
-            )
+            async with self.scheduler.slot(model, request.priority), self.residency.use(model):
+                with LLM_REQUESTS_IN_FLIGHT.labels(model=model).track_inprogress(), \
+                        LLM_GENERATION_LATENCY.labels(model=model).time():
+                    response = await self.policy.call(
+                        lambda timeout: self.client.chat.completions.create(
+                            model=model,
+                            messages=self._build_messages(prompt.text),
+                            temperature=0.3,  # Lower temperature for more consistent analysis
+                            max_tokens=prompt.max_completion_tokens,
+                            timeout=timeout
+                        ),
+                        key=model,
+                        scale=prompt.max_completion_tokens,
+                        units=lambda response: (
+                            response.usage.completion_tokens if response.usage and response.usage.completion_tokens
+                            else self.prompt_builder.estimate_tokens(response.choices[0].message.content or "")
+                        )
+                    )
             
             # Parse the AI response
             ai_content = response.choices[0].message.content
             
-            # Try to extract structured data from the response
-            analysis_data = self._parse_ai_response(ai_content, request)
-            
-            analysis_time = (datetime.now() - start_time).total_seconds()
+            # Prefer Ollama's reported token usage over our estimates
+            prompt_tokens = prompt.estimated_tokens
+            completion_tokens = None
+            if response.usage:
+                prompt_tokens = response.usage.prompt_tokens or prompt_tokens
+                completion_tokens = response.usage.completion_tokens
             
-            analysis_response = AIAnalysisResponse(
-                query=request.query,
-                summary=analysis_data.get("summary", "Analysis completed"),
-                key_points=analysis_data.get("key_points", []),
-                sources=analysis_data.get("sources", []),
-                confidence_score=analysis_data.get("confidence_score", 0.7),
-                model_used=response.model,
-                analysis_time=analysis_time
+            analysis_response = self._build_analysis_response(
+                request, ai_content, response.model, start_time,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens
             )
             
-            logger.info("AI analysis completed",
-                       query=request.query,
-                       model=response.model,
-                       analysis_time=analysis_time,
-                       confidence=analysis_data.get("confidence_score"))
-            
-            return analysis_response
-            
+        except DependencyUnavailable:
+            raise
+        
         except Exception as e:
-            logger.error("AI analysis failed", 
-                        query=request.query,
-                        model=model,
-                        error=str(e))
+            self._remember_failure(cache_key, e)
+            return self._fallback_analysis_response(request, model, e, start_time)
+        
+        await self._cache_analysis(cache_key, analysis_response)
+        return analysis_response
+    
+    async def stream_analysis(self, request: AIAnalysisRequest) -> AsyncIterator[Tuple[str, Any]]:
+        """Stream an analysis as ("token", text) events, then ("analysis", AIAnalysisResponse)
+        
+        Raises DependencyUnavailable before the first event while Ollama is
+        failing, or PromptTooLong. Streams are not retried once started.
+        """
+        start_time = datetime.now()
+        model = request.model or self.default_model
+        
+        cache_key = self._get_cache_key(request)
+        cached_analysis = await self._get_cached_analysis(cache_key, request)
+        if cached_analysis:
+            yield "analysis", cached_analysis
+            return
+        
+        self.check_available(cache_key)
+        prompt = self._create_analysis_prompt(request, model)
+        
+        try:
+            content_parts = []
+            model_used = model
             
-            # Return fallback analysis
-            return AIAnalysisResponse(
-                query=request.query,
-                summary=f"Analysis failed: {str(e)}",
-                key_points=["Analysis service temporarily unavailable"],
-                sources=[result.url for result in request.search_results[:3]],
-                confidence_score=0.0,
-                model_used=model,
-                analysis_time=(datetime.now() - start_time).total_seconds()
+            async with self.scheduler.slot(model, request.priority), self.residency.use(model), \
+                    self.policy.breaker.guard() as admission:
+                with LLM_REQUESTS_IN_FLIGHT.labels(model=model).track_inprogress():
+                    timeout = self.policy.timeouts.get(model, prompt.max_completion_tokens)
+                    generation_start = time.perf_counter()
+                    try:
+                        stream = await self.client.chat.completions.create(
+                            model=model,
+                            messages=self._build_messages(prompt.text),
+                            temperature=0.3,
+                            max_tokens=prompt.max_completion_tokens,
+                            stream=True,
+                            # Applies to each read, so it bounds the wait for every token
+                            timeout=timeout
+                        )
+                        async for chunk in stream:
+                            model_used = chunk.model or model_used
+                            if not chunk.choices:
+                                continue
+                            token = chunk.choices[0].delta.content
+                            if token:
+                                if not content_parts:
+                                    LLM_TIME_TO_FIRST_TOKEN.labels(model=model).observe(
+                                        time.perf_counter() - generation_start
+                                    )
+                                content_parts.append(token)
+                                yield "token", token
+                    except (APITimeoutError, httpx.TimeoutException) as e:
+                        self.policy.record_timeout(admission, e, model, timeout, prompt.max_completion_tokens)
+                        raise
+                    generation_time = time.perf_counter() - generation_start
+                    LLM_GENERATION_LATENCY.labels(model=model).observe(generation_time)
+                    # Ollama streams about one token per chunk
+                    self.policy.timeouts.observe(model, generation_time, len(content_parts))
+            
+            ai_content = "".join(content_parts)
+            analysis_response = self._build_analysis_response(
+                request, ai_content, model_used, start_time,
+                prompt_tokens=prompt.estimated_tokens,
+                completion_tokens=self.prompt_builder.estimate_tokens(ai_content)
             )
+            await self._cache_analysis(cache_key, analysis_response)
+            
+        except DependencyUnavailable:
+            raise
+        
+        except Exception as e:
+            self._remember_failure(cache_key, e)
+            analysis_response = self._fallback_analysis_response(request, model, e, start_time)
+        
+        yield "analysis", analysis_response
     
-    def _create_analysis_prompt(self, request: AIAnalysisRequest) -> str:
-        """Create analysis prompt for the LLM"""
-        
-        # Prepare search results context
-        results_text = ""
-        for i, result in enumerate(request.search_results[:10], 1):
-            results_text += f"\n--- Result {i} ---\n"
-            results_text += f"Title: {result.title}\n"
-            results_text += f"URL: {result.url}\n"
-            results_text += f"Content: {result.content[:500]}...\n"
-            results_text += f"Engine: {result.engine}\n"
-        
-        context_addition = ""
-        if request.context:
-            context_addition = f"\nAdditional context: {request.context}\n"
-        
-        prompt = f"""
-Please analyze the following search results for the query: "{request.query}"
-{context_addition}
-Search Results:
-{results_text}
-
-Please provide a comprehensive analysis in the following JSON format:
-{{
-    "summary": "A 2-3 sentence summary of the main findings",
-    "key_points": ["Point 1", "Point 2", "Point 3", "Point 4", "Point 5"],
-    "sources": ["URL1", "URL2", "URL3"],
-    "confidence_score": 0.8
-}}
-
-Requirements:
-- Summary should be factual and comprehensive
-- Key points should be the most important insights from the search results
-- Sources should be the 3 most relevant URLs
-- Confidence score should reflect the quality and consistency of information (0.0-1.0)
-- If information is conflicting or unclear, lower the confidence score
-- Only include information that is actually present in the search results
-"""
+    def _build_analysis_response(self, request: AIAnalysisRequest, ai_content: str,
+                                 model_used: str, start_time: datetime,
+                                 prompt_tokens: Optional[int] = None,
+                                 completion_tokens: Optional[int] = None) -> AIAnalysisResponse:
+        """Build the analysis response from raw LLM output"""
+        # Try to extract structured data from the response
+        analysis_data = self._parse_ai_response(ai_content, request)
+        
+        analysis_time = (datetime.now() - start_time).total_seconds()
+        record_tokens(model_used, prompt_tokens, completion_tokens)
+        
+        analysis_response = AIAnalysisResponse(
+            query=request.query,
+            summary=analysis_data.get("summary", "Analysis completed"),
+            key_points=analysis_data.get("key_points", []),
+            sources=analysis_data.get("sources", []),
+            confidence_score=analysis_data.get("confidence_score", 0.7),
+            model_used=model_used,
+            analysis_time=analysis_time,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens
+        )
+        
+        logger.info("AI analysis completed",
+                   query=request.query,
+                   model=model_used,
+                   analysis_time=analysis_time,
+                   prompt_tokens=prompt_tokens,
+                   completion_tokens=completion_tokens,
+                   confidence=analysis_data.get("confidence_score"))
+        
+        return analysis_response
+    
+    def _remember_failure(self, cache_key: str, error: Exception):
+        """Negatively cache an analysis that failed in Ollama
+        
+        Not one that was only queued too long, or cut short by an adaptive
+        timeout (it may well succeed with the longer timeout learned from it).
+        """
+        if not isinstance(error, (SchedulerQueueFull, DeadlineExceeded)) and not self.policy.cut_short(error):
+            self.failures.add(cache_key, error)
+    
+    def _fallback_analysis_response(self, request: AIAnalysisRequest, model: str,
+                                    error: Exception, start_time: datetime) -> AIAnalysisResponse:
+        """Build the fallback response returned when analysis fails"""
+        logger.error("AI analysis failed", 
+                    query=request.query,
+                    model=model,
+                    error=str(error))
+        if isinstance(error, (SchedulerQueueFull, DeadlineExceeded)):
+            DEPENDENCY_ERRORS.labels(dependency="llm_queue").inc()
+        else:
+            DEPENDENCY_ERRORS.labels(dependency="ollama").inc()
+        
+        return AIAnalysisResponse(
+            query=request.query,
+            summary=f"Analysis failed: {str(error)}",
+            key_points=["Analysis service temporarily unavailable"],
+            sources=[result.url for result in request.search_results[:3]],
+            confidence_score=0.0,
+            model_used=model,
+            analysis_time=(datetime.now() - start_time).total_seconds()
+        )
+    
+    def _build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Build the chat messages for an analysis prompt"""
+        return [
+            {
+                "role": "system",
+                "content": ANALYSIS_SYSTEM_PROMPT
+            },
+            {
+                "role": "user", 
+                "content": prompt
+            }
+        ]
+    
+    def _create_analysis_prompt(self, request: AIAnalysisRequest, model: str) -> BuiltPrompt:
+        """Create analysis prompt for the LLM, sized to the model's context window"""
+        with PROMPT_BUILD_LATENCY.time():
+            prompt = self.prompt_builder.build(request, model)
+        
+        logger.debug("Analysis prompt built",
+                    model=model,
+                    estimated_tokens=prompt.estimated_tokens,
+                    context_window=prompt.context_window,
+                    results_included=prompt.results_included,
+                    results_dropped=prompt.results_dropped)
         
         return prompt
     
@@ -200,15 +435,25 @@ Requirements:
         }
     
     async def health_check(self) -> bool:
-        """Check if the AI service is available"""
+        """Check if Ollama is available by listing its models (no generation)"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.default_model,
-                messages=[{"role": "user", "content": "Hello"}],
-                max_tokens=10,
-                temperature=0.1
+            response = await self.http_client.get(
+                f"{self.base_url}/api/tags",
+                timeout=httpx.Timeout(settings.health_probe_timeout)
             )
-            return bool(response.choices[0].message.content)
+            return response.status_code == 200
         except Exception as e:
             logger.error("AI service health check failed", error=str(e))
             return False
+
+def _is_failure(error: Exception) -> bool:
+    """Whether an error counts against Ollama's circuit breaker (4xx other than 429 do not)"""
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return isinstance(error, APIConnectionError)
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether a failed completion is worth retrying (not timeouts: generations are expensive)"""
+    if isinstance(error, APIStatusError):
+        return error.status_code in (502, 503, 504)
+    return isinstance(error, APIConnectionError) and not isinstance(error, APITimeoutError)
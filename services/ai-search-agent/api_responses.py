@@ -0,0 +1,134 @@
+import gzip
+import time
+from typing import Any, List, Optional, Tuple
+import pydantic_core
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from metrics import RESPONSE_SERIALIZATION_LATENCY, RESPONSE_BYTES
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Streams must reach the client as they are produced, so they are never compressed
+STREAMING_MEDIA_TYPES = ("text/event-stream", "application/x-ndjson")
+
+class FastJSONResponse(Response):
+    """JSON response serialized by pydantic-core
+
+    Models are dumped directly by their compiled serializer, so returning
+    one skips FastAPI's response_model re-validation and jsonable_encoder
+    pass. Plain dicts and lists (including nested models and datetimes)
+    take the same path.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        start = time.perf_counter()
+        body = pydantic_core.to_json(content)
+        RESPONSE_SERIALIZATION_LATENCY.observe(time.perf_counter() - start)
+        return body
+
+class CompressionMiddleware:
+    """Compress complete responses above a size threshold with brotli or gzip
+
+    The encoding is negotiated from Accept-Encoding (brotli preferred when
+    the brotli package is installed). Streamed responses - SSE, NDJSON or
+    anything sent in more than one body message - pass through untouched.
+    Bytes sent are counted per content encoding.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else settings.response_compression_min_bytes
+        self.enabled = settings.response_compression_enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._negotiate(Headers(scope=scope).get("accept-encoding", "")) if self.enabled else None
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip()
+                if encoding is None or "content-encoding" in headers or media_type in STREAMING_MEDIA_TYPES:
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Hold the start message until we know whether the body is complete
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if passthrough:
+                RESPONSE_BYTES.labels(encoding="identity").inc(len(body))
+                await send(message)
+                return
+
+            if start_message is not None:
+                pending_start, start_message = start_message, None
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    passthrough = True
+                    RESPONSE_BYTES.labels(encoding="identity").inc(len(body))
+                    await send(pending_start)
+                    await send(message)
+                    return
+
+                compressed = self._compress(body, encoding)
+                headers = MutableHeaders(raw=pending_start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(compressed))
+                headers.add_vary_header("Accept-Encoding")
+                RESPONSE_BYTES.labels(encoding=encoding).inc(len(compressed))
+                await send(pending_start)
+                await send({"type": "http.response.body", "body": compressed, "more_body": False})
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _negotiate(accept_encoding: str) -> Optional[str]:
+        """Pick brotli or gzip from an Accept-Encoding header, honoring q=0"""
+        accepted: List[Tuple[str, float]] = []
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted.append((name.strip().lower(), quality))
+
+        qualities = dict(accepted)
+        wildcard = qualities.get("*", 0.0)
+        if brotli is not None and qualities.get("br", wildcard) > 0:
+            return "br"
+        if qualities.get("gzip", wildcard) > 0:
+            return "gzip"
+        return None
+
+    @staticmethod
+    def _compress(body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=settings.response_brotli_quality)
+        return gzip.compress(body, compresslevel=settings.response_gzip_level, mtime=0)
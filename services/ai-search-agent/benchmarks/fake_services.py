@@ -0,0 +1,343 @@
+"""In-process stand-ins for SearXNG and Ollama used by the benchmarks
+
+Both fakes are small FastAPI apps with configurable latency, token rate and
+failure injection. With a Recording they can also proxy to real upstreams
+and capture their responses (record mode), or serve captured responses
+instead of synthetic ones (replay mode).
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+@dataclass
+class FakeConfig:
+    """Behaviour of the fake upstreams"""
+    searxng_latency_ms: float = 50.0
+    searxng_jitter_ms: float = 10.0
+    searxng_results: int = 20
+    searxng_failure_rate: float = 0.0
+    ollama_first_token_ms: float = 200.0
+    ollama_tokens_per_second: float = 50.0
+    ollama_completion_tokens: int = 120
+    ollama_failure_rate: float = 0.0
+    ollama_models: Tuple[str, ...] = ("deepseek-r1:7b",)
+    ollama_model_size_gb: float = 4.5
+    ollama_load_ms: float = 0.0
+    seed: int = 0
+
+class Recording:
+    """Upstream responses captured in record mode and served in replay mode
+
+    Entries are keyed by a hash of the request; replay falls back to
+    cycling through the other recordings for the same endpoint when a
+    request was never recorded, so a replay can run more distinct queries
+    than were captured.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self._by_endpoint: Dict[str, List[str]] = {}
+        self._cursor: Dict[str, int] = {}
+
+    @staticmethod
+    def key(endpoint: str, payload: Dict) -> str:
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        return f"{endpoint}:{digest}"
+
+    def load(self) -> "Recording":
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.entries = json.load(f)
+        for key in self.entries:
+            self._by_endpoint.setdefault(key.split(":", 1)[0], []).append(key)
+        return self
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+
+    def add(self, endpoint: str, payload: Dict, entry: Dict):
+        key = self.key(endpoint, payload)
+        if key not in self.entries:
+            self._by_endpoint.setdefault(endpoint, []).append(key)
+        self.entries[key] = entry
+
+    def find(self, endpoint: str, payload: Dict) -> Optional[Dict]:
+        entry = self.entries.get(self.key(endpoint, payload))
+        if entry is not None:
+            return entry
+        keys = self._by_endpoint.get(endpoint)
+        if not keys:
+            return None
+        cursor = self._cursor.get(endpoint, 0)
+        self._cursor[endpoint] = cursor + 1
+        return self.entries[keys[cursor % len(keys)]]
+
+@dataclass
+class FakeStats:
+    """Requests served by a fake, per path"""
+    requests: Dict[str, int] = field(default_factory=dict)
+    failures: Dict[str, int] = field(default_factory=dict)
+
+    def count(self, path: str, failed: bool = False):
+        self.requests[path] = self.requests.get(path, 0) + 1
+        if failed:
+            self.failures[path] = self.failures.get(path, 0) + 1
+
+def create_fake_searxng(config: FakeConfig, recording: Optional[Recording] = None,
+                        upstream: Optional[str] = None) -> FastAPI:
+    """Build a fake SearXNG app
+
+    With upstream set, requests are proxied there and captured into the
+    recording; otherwise recorded (or synthetic) results are served.
+    """
+    app = FastAPI()
+    app.state.stats = FakeStats()
+    rng = random.Random(config.seed)
+    proxy = httpx.AsyncClient(base_url=upstream, timeout=30.0) if upstream else None
+
+    @app.get("/search")
+    async def search(request: Request):
+        params = dict(request.query_params)
+
+        if proxy is not None:
+            start = time.perf_counter()
+            response = await proxy.get("/search", params=params)
+            data = response.json()
+            recording.add("searxng", params, {
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "body": data
+            })
+            app.state.stats.count("/search")
+            return JSONResponse(data, status_code=response.status_code)
+
+        latency_ms = max(0.0, rng.gauss(config.searxng_latency_ms, config.searxng_jitter_ms))
+        entry = recording.find("searxng", params) if recording else None
+        if entry is not None:
+            latency_ms = entry["latency_ms"]
+        await asyncio.sleep(latency_ms / 1000)
+
+        if rng.random() < config.searxng_failure_rate:
+            app.state.stats.count("/search", failed=True)
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+
+        app.state.stats.count("/search")
+        if entry is not None:
+            return entry["body"]
+        return {"query": params.get("q", ""), "results": _synthetic_results(params.get("q", ""), config)}
+
+    @app.get("/stats")
+    async def stats():
+        return {"engines": {}}
+
+    @app.get("/healthz")
+    async def healthz():
+        return PlainTextResponse("OK")
+
+    if proxy is not None:
+        app.router.on_shutdown.append(proxy.aclose)
+    return app
+
+def _synthetic_results(query: str, config: FakeConfig) -> List[Dict]:
+    """Deterministic results for a query, with some duplicate URLs like real engines return"""
+    words = query.split() or ["result"]
+    results = []
+    for i in range(config.searxng_results):
+        topic = words[i % len(words)]
+        results.append({
+            "title": f"{query} - {topic} overview part {i}",
+            "url": f"https://site{i % (config.searxng_results // 2 or 1)}.example.com/{topic}/{i}?utm_source=bench",
+            "content": " ".join(
+                f"{query} {topic} detail {i} covers aspect {j} of the subject in depth"
+                for j in range(4)
+            ),
+            "engine": ("google", "bing", "duckduckgo")[i % 3],
+            "engines": [("google", "bing", "duckduckgo")[i % 3]],
+            "score": round(1.0 / (i + 1), 4)
+        })
+    return results
+
+def create_fake_ollama(config: FakeConfig, recording: Optional[Recording] = None,
+                       upstream: Optional[str] = None) -> FastAPI:
+    """Build a fake Ollama app serving the OpenAI-compatible chat API
+
+    Completions take ollama_first_token_ms plus one token per
+    1 / ollama_tokens_per_second, streamed or not as requested, after
+    ollama_load_ms if the model is not loaded; models stay loaded for their
+    keep_alive (5 minutes unless set through /api/generate). With
+    upstream set, completions are proxied there (non-streamed) and captured
+    into the recording; replayed completions keep the configured timing.
+    """
+    app = FastAPI()
+    app.state.stats = FakeStats()
+    rng = random.Random(config.seed + 1)
+    proxy = httpx.AsyncClient(base_url=upstream, timeout=300.0) if upstream else None
+    # model -> unix time it unloads (None: never)
+    loaded: Dict[str, Optional[float]] = {}
+
+    async def load(model: str, keep_alive: float = 300):
+        model = model if ":" in model else f"{model}:latest"
+        expires = loaded.get(model, 0.0)
+        if expires is not None and expires <= time.time():
+            await asyncio.sleep(config.ollama_load_ms / 1000)
+        loaded[model] = None if keep_alive < 0 else time.time() + keep_alive
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        stream = bool(body.get("stream"))
+        recording_payload = {"model": model, "messages": body.get("messages")}
+        await load(model)
+
+        if proxy is not None:
+            upstream_body = dict(body, stream=False)
+            response = await proxy.post("/v1/chat/completions", json=upstream_body)
+            data = response.json()
+            if response.status_code == 200:
+                recording.add("ollama", recording_payload, {
+                    "content": data["choices"][0]["message"]["content"],
+                    "usage": data.get("usage")
+                })
+            content, usage = data["choices"][0]["message"]["content"], data.get("usage")
+        else:
+            entry = recording.find("ollama", recording_payload) if recording else None
+            if entry is not None:
+                content, usage = entry["content"], entry.get("usage")
+            else:
+                content, usage = _synthetic_analysis(config), None
+
+        if proxy is None and rng.random() < config.ollama_failure_rate:
+            await asyncio.sleep(config.ollama_first_token_ms / 1000)
+            app.state.stats.count("/v1/chat/completions", failed=True)
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=500)
+        app.state.stats.count("/v1/chat/completions")
+
+        # Roughly one token per 4 characters, like the prompt builder estimates
+        chunk_size = 4
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        usage = usage or {
+            "prompt_tokens": sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4,
+            "completion_tokens": len(chunks),
+            "total_tokens": 0
+        }
+        token_interval = 1 / config.ollama_tokens_per_second if config.ollama_tokens_per_second > 0 else 0.0
+
+        if stream:
+            async def event_stream():
+                await asyncio.sleep(config.ollama_first_token_ms / 1000)
+                for index, chunk in enumerate(chunks):
+                    if index:
+                        await asyncio.sleep(token_interval)
+                    yield "data: " + json.dumps(_chat_chunk(model, {"content": chunk}, None)) + "\n\n"
+                yield "data: " + json.dumps(_chat_chunk(model, {}, "stop")) + "\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        if proxy is None:
+            await asyncio.sleep(config.ollama_first_token_ms / 1000 + token_interval * max(0, len(chunks) - 1))
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        app.state.stats.count("/v1/embeddings")
+        return {
+            "object": "list",
+            "model": body.get("model", "fake"),
+            "data": [
+                {"object": "embedding", "index": index, "embedding": _fake_embedding(text)}
+                for index, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        }
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        # Only the empty-prompt form, used to load and unload models
+        body = await request.json()
+        model = body.get("model", "fake")
+        keep_alive = float(body.get("keep_alive", 300))
+        app.state.stats.count("/api/generate")
+        if keep_alive == 0:
+            loaded.pop(model if ":" in model else f"{model}:latest", None)
+            return {"model": model, "response": "", "done": True, "done_reason": "unload"}
+        await load(model, keep_alive)
+        return {"model": model, "response": "", "done": True, "done_reason": "load"}
+
+    @app.get("/api/tags")
+    async def tags():
+        size = int(config.ollama_model_size_gb / 1.2 * 1024 ** 3)
+        return {"models": [{"name": model, "model": model, "size": size} for model in config.ollama_models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        now = time.time()
+        size = int(config.ollama_model_size_gb * 1024 ** 3)
+        return {"models": [
+            {
+                "name": model,
+                "model": model,
+                "size": size,
+                "size_vram": 0,
+                "expires_at": datetime.fromtimestamp(expires if expires is not None else now + 10 ** 9,
+                                                     timezone.utc).isoformat()
+            }
+            for model, expires in loaded.items()
+            if expires is None or expires > now
+        ]}
+
+    if proxy is not None:
+        app.router.on_shutdown.append(proxy.aclose)
+    return app
+
+def _synthetic_analysis(config: FakeConfig) -> str:
+    """A valid analysis JSON padded to roughly ollama_completion_tokens tokens"""
+    analysis = {
+        "summary": "",
+        "key_points": ["Point one", "Point two", "Point three"],
+        "sources": ["https://site0.example.com/"],
+        "confidence_score": 0.8
+    }
+    base_length = len(json.dumps(analysis))
+    filler = "benchmark summary text "
+    target_chars = config.ollama_completion_tokens * 4
+    repeats = max(1, (target_chars - base_length) // len(filler))
+    analysis["summary"] = (filler * repeats).strip()
+    return json.dumps(analysis)
+
+def _chat_chunk(model: str, delta: Dict, finish_reason: Optional[str]) -> Dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+
+def _fake_embedding(text: str, dimensions: int = 64) -> List[float]:
+    """Deterministic pseudo-embedding so the semantic cache can be exercised"""
+    rng = random.Random(hashlib.sha256(text.lower().encode()).digest())
+    return [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
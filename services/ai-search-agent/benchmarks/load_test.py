@@ -0,0 +1,254 @@
+"""Load test the AI Search Agent against local fake SearXNG and Ollama servers
+
+Starts the fakes and main.app in-process with uvicorn, drives each endpoint
+at a fixed concurrency and prints latency percentiles and throughput per
+endpoint as JSON, so runs before and after a change can be compared.
+
+    python -m benchmarks.load_test --concurrency 16 --requests 500
+    python -m benchmarks.load_test --record run.json \\
+        --searxng-upstream http://localhost:8080 --ollama-upstream http://localhost:11434
+    python -m benchmarks.load_test --replay run.json
+
+Run from services/ai-search-agent. Redis is used if REDIS_URL points at a
+running server; otherwise the service runs in its degraded (no Redis) mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple
+import httpx
+import numpy as np
+import uvicorn
+
+from benchmarks.fake_services import FakeConfig, Recording, create_fake_ollama, create_fake_searxng
+
+ENDPOINTS = ("search", "search_simple", "search_stream", "search_batch", "health")
+
+class _Server(uvicorn.Server):
+    """uvicorn server that leaves signal handling to the harness"""
+
+    def install_signal_handlers(self):
+        pass
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _start_server(app, port: int) -> Tuple[_Server, asyncio.Task]:
+    server = _Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+async def _stop_server(server: _Server, task: asyncio.Task):
+    server.should_exit = True
+    await task
+
+def _build_request(endpoint: str, query: str, args) -> Dict:
+    """httpx request arguments for one call to an endpoint"""
+    body = {"query": query, "analyze_with_ai": not args.no_analysis}
+    if endpoint == "search":
+        return {"method": "POST", "url": "/search", "json": body}
+    if endpoint == "search_simple":
+        return {"method": "POST", "url": "/search/simple",
+                "params": {"query": query, "analyze": str(not args.no_analysis).lower()}}
+    if endpoint == "search_stream":
+        return {"method": "POST", "url": "/search/stream", "json": body}
+    if endpoint == "search_batch":
+        return {"method": "POST", "url": "/search/batch", "json": {
+            "requests": [dict(body, query=f"{query} {i}") for i in range(args.batch_size)]
+        }}
+    return {"method": "GET", "url": "/health"}
+
+async def _timed_request(client: httpx.AsyncClient, request: Dict) -> Tuple[float, Optional[float], bool]:
+    """Send a request and read the whole body; returns (latency, time to first byte, ok)"""
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream(**request) as response:
+        async for _ in response.aiter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return time.perf_counter() - start, first_byte, response.status_code < 400
+
+async def _run_endpoint(client: httpx.AsyncClient, endpoint: str, queries: Callable[[], str], args) -> Dict:
+    """Drive one endpoint at the configured concurrency"""
+    for _ in range(args.warmup):
+        await _timed_request(client, _build_request(endpoint, queries(), args))
+
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors = 0
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            try:
+                latency, first_byte, ok = await _timed_request(client, _build_request(endpoint, queries(), args))
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(latency)
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    duration = time.perf_counter() - start
+
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(args.requests / duration, 2) if duration else 0.0,
+        **_percentiles("latency", latencies),
+        **_percentiles("first_byte", first_bytes)
+    }
+
+def _percentiles(name: str, values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return {
+        f"{name}_p50_ms": round(float(p50), 2),
+        f"{name}_p95_ms": round(float(p95), 2),
+        f"{name}_p99_ms": round(float(p99), 2),
+        f"{name}_mean_ms": round(float(np.mean(values) * 1000), 2)
+    }
+
+async def run(args) -> Dict:
+    config = FakeConfig(
+        searxng_latency_ms=args.searxng_latency_ms,
+        searxng_jitter_ms=args.searxng_jitter_ms,
+        searxng_results=args.searxng_results,
+        searxng_failure_rate=args.searxng_failure_rate,
+        ollama_first_token_ms=args.ollama_first_token_ms,
+        ollama_tokens_per_second=args.ollama_tokens_per_second,
+        ollama_completion_tokens=args.ollama_completion_tokens,
+        ollama_failure_rate=args.ollama_failure_rate,
+        seed=args.seed
+    )
+
+    recording = None
+    if args.record:
+        recording = Recording(args.record)
+    elif args.replay:
+        recording = Recording(args.replay).load()
+
+    searxng_app = create_fake_searxng(config, recording, args.searxng_upstream if args.record else None)
+    ollama_app = create_fake_ollama(config, recording, args.ollama_upstream if args.record else None)
+    searxng_port, ollama_port, api_port = _free_port(), _free_port(), _free_port()
+
+    servers = [
+        await _start_server(searxng_app, searxng_port),
+        await _start_server(ollama_app, ollama_port)
+    ]
+
+    # Settings are read when config is first imported, so point the service at the fakes first
+    data_dir = tempfile.mkdtemp(prefix="ai-search-bench-")
+    os.environ["SEARXNG_BASE_URL"] = f"http://127.0.0.1:{searxng_port}"
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{ollama_port}"
+    os.environ["HISTORY_DB_PATH"] = os.path.join(data_dir, "search_history.db")
+    # Keep benchmark queries out of the hot queries the real service warms up with
+    os.environ["HOT_QUERIES_PATH"] = os.path.join(data_dir, "hot_queries.json")
+    os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:6379")
+    import main
+
+    servers.append(await _start_server(main.app, api_port))
+
+    rng = random.Random(args.seed)
+    query_pool = [f"benchmark topic {i} performance tuning" for i in range(args.distinct_queries)]
+
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", limits=limits,
+                                     timeout=args.timeout) as client:
+            for endpoint in args.endpoints:
+                results[endpoint] = await _run_endpoint(client, endpoint, lambda: rng.choice(query_pool), args)
+                print(f"{endpoint}: {json.dumps(results[endpoint])}", file=sys.stderr)
+    finally:
+        for server, task in reversed(servers):
+            await _stop_server(server, task)
+        if args.record:
+            recording.save()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "mode": "record" if args.record else "replay" if args.replay else "synthetic",
+        "concurrency": args.concurrency,
+        "distinct_queries": args.distinct_queries,
+        "analysis": not args.no_analysis,
+        "fakes": asdict(config),
+        "upstream_requests": {
+            "searxng": searxng_app.state.stats.requests,
+            "ollama": ollama_app.state.stats.requests
+        },
+        "upstream_failures": {
+            "searxng": searxng_app.state.stats.failures,
+            "ollama": ollama_app.state.stats.failures
+        },
+        "endpoints": results
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=["search", "search_stream", "health"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per endpoint")
+    parser.add_argument("--distinct-queries", type=int, default=50,
+                        help="Size of the query pool; smaller pools mean more cache hits")
+    parser.add_argument("--batch-size", type=int, default=10, help="Items per /search/batch request")
+    parser.add_argument("--no-analysis", action="store_true", help="Search without AI analysis")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+
+    fakes = parser.add_argument_group("fake upstreams")
+    fakes.add_argument("--searxng-latency-ms", type=float, default=50.0)
+    fakes.add_argument("--searxng-jitter-ms", type=float, default=10.0)
+    fakes.add_argument("--searxng-results", type=int, default=20)
+    fakes.add_argument("--searxng-failure-rate", type=float, default=0.0)
+    fakes.add_argument("--ollama-first-token-ms", type=float, default=200.0)
+    fakes.add_argument("--ollama-tokens-per-second", type=float, default=50.0)
+    fakes.add_argument("--ollama-completion-tokens", type=int, default=120)
+    fakes.add_argument("--ollama-failure-rate", type=float, default=0.0)
+
+    modes = parser.add_argument_group("record / replay")
+    mode = modes.add_mutually_exclusive_group()
+    mode.add_argument("--record", metavar="FILE", help="Proxy to real upstreams and save their responses")
+    mode.add_argument("--replay", metavar="FILE", help="Serve previously recorded responses")
+    modes.add_argument("--searxng-upstream", default="http://localhost:8080")
+    modes.add_argument("--ollama-upstream", default="http://localhost:11434")
+
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,115 @@
+"""Measure the per-request cost of logging on the calling thread
+
+Emits the info events a /search request that misses the caches logs
+(the same event names and fields as main.py, searxng_service.py and
+ai_analysis_service.py) through the service's logging setup and reports
+the time spent in the logging calls on the caller - which in the service
+is the event loop - per request, for each pipeline:
+
+  sync     - render and write on the caller (the previous setup)
+  queue    - render and write on the QueueListener thread
+  sampled  - queue, with the per-request events sampled at --sample-rate
+
+    python -m benchmarks.logging_overhead --requests 20000 --rate 1000
+
+Requests are paced at --rate per second (0 for a tight loop) so the
+listener thread can use the gaps, as it would between requests on a
+service that is not saturated by logging alone. Logs are written to a
+temporary file, which is removed afterwards.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict
+import structlog
+
+from config import settings
+from logging_config import configure_logging, dropped_log_records, shutdown_logging
+
+PIPELINES = ("sync", "queue", "sampled")
+
+# Per-request events, in the order a /search that misses the caches logs
+# them; the names are the keys LOG_SAMPLE_RATES would use for them
+REQUEST_EVENTS = ("Request started", "Web search request received", "Collapsed duplicate search results",
+                  "Cached search results", "Search completed successfully", "AI analysis completed",
+                  "Cached analysis", "Web search completed successfully", "Request completed")
+
+def _emit_request(logger, index: int):
+    query = f"query {index}"
+    logger.info("Request started", method="POST", url="http://localhost:8001/search", client_ip="127.0.0.1")
+    logger.info("Web search request received", query=query, analyze_with_ai=True)
+    logger.info("Collapsed duplicate search results", original_count=12, deduplicated_count=10)
+    logger.info("Cached search results", cache_key=f"search:{index:032x}")
+    logger.info("Search completed successfully", query=query, results_count=10, search_time=0.05)
+    logger.info("AI analysis completed", query=query, model=settings.default_model, analysis_time=2.5,
+                prompt_tokens=1024, completion_tokens=320, confidence=0.8)
+    logger.info("Cached analysis", cache_key=f"analysis:{index:064x}")
+    logger.info("Web search completed successfully", query=query, results_count=10,
+                cache_tier=None, has_ai_analysis=True)
+    logger.info("Request completed", status_code=200, process_time="2.563s")
+
+def run_pipeline(pipeline: str, requests: int, rate: float, sample_rate: float, path: str) -> Dict:
+    with open(path, "w", encoding="utf-8") as stream:
+        configure_logging(
+            level="INFO",
+            use_queue=pipeline != "sync",
+            sample_rates={event: sample_rate for event in REQUEST_EVENTS} if pipeline == "sampled" else {},
+            default_sample_rate=1.0,
+            stream=stream
+        )
+        # Loggers are cached on first use, so take a fresh one after each configure
+        logger = structlog.get_logger("benchmark")
+
+        interval = 1 / rate if rate > 0 else 0.0
+        caller_seconds = 0.0
+        start = time.perf_counter()
+        for index in range(requests):
+            emit_start = time.perf_counter()
+            _emit_request(logger, index)
+            emit_end = time.perf_counter()
+            caller_seconds += emit_end - emit_start
+            if interval:
+                time.sleep(max(0.0, start + (index + 1) * interval - emit_end))
+
+        # Drain the queue so throughput includes the writes
+        shutdown_logging()
+        total_seconds = time.perf_counter() - start
+        dropped = dropped_log_records()
+
+    with open(path, "r", encoding="utf-8") as f:
+        written = sum(1 for _ in f)
+
+    return {
+        "caller_us_per_request": caller_seconds / requests * 1e6,
+        "requests_per_second": requests / total_seconds,
+        "records_written": written,
+        "records_dropped": dropped
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="Requests per second (0 for no pacing)")
+    parser.add_argument("--sample-rate", type=float, default=0.1,
+                        help="Sample rate for per-request events in the sampled pipeline")
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    try:
+        report = {
+            pipeline: run_pipeline(pipeline, args.requests, args.rate, args.sample_rate, path)
+            for pipeline in args.pipelines
+        }
+    finally:
+        os.remove(path)
+    print(json.dumps({"requests": args.requests, "rate": args.rate, "events_per_request": len(REQUEST_EVENTS),
+                      "pipelines": report}, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,254 @@
+import json
+import struct
+import typing
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar, Union
+import structlog
+from pydantic import BaseModel
+from config import settings
+
+logger = structlog.get_logger()
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional encoding
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional compression
+    zstandard = None
+
+M = TypeVar("M", bound=BaseModel)
+
+# Header: magic, format version, encoding, compression, uncompressed body length
+HEADER = struct.Struct(">BBBBI")
+MAGIC = 0xAC
+CODEC_VERSION = 1
+
+ENCODINGS = {"json": 1, "msgpack": 2}
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+# Field kinds for the trusted decode path
+_PLAIN, _MODEL, _MODEL_LIST, _DATETIME = range(4)
+_REQUIRED = object()
+
+class CacheCodec:
+    """Encode pydantic models for Redis and decode them back
+
+    Payloads start with a small header (magic byte, format version,
+    encoding, compression and uncompressed length), followed by a JSON or
+    msgpack body that is compressed with zlib or zstd when it is larger
+    than cache_compression_min_bytes. Payloads with an unknown version are
+    treated as cache misses, and headerless payloads are read as the plain
+    JSON written by earlier releases, so old and new instances can share a
+    Redis during a rollout (set CACHE_ENCODING=legacy to keep writing plain
+    JSON until every instance can read the new format).
+
+    Our own cache entries are trusted: by default they are rebuilt without
+    pydantic validation, falling back to full validation if that fails.
+    """
+
+    def __init__(self, model: Type[M], encoding: Optional[str] = None,
+                 compression: Optional[str] = None):
+        self.model = model
+        self.encoding = encoding or settings.cache_encoding
+        self.compression = compression or settings.cache_compression
+        self.min_compress_bytes = settings.cache_compression_min_bytes
+        self.trusted = settings.cache_trusted_decode
+
+        if self.encoding == "msgpack" and msgpack is None:
+            logger.warning("msgpack not installed, falling back to JSON cache encoding")
+            self.encoding = "json"
+        if self.compression == "zstd" and zstandard is None:
+            logger.warning("zstandard not installed, falling back to zlib cache compression")
+            self.compression = "zlib"
+        if self.encoding != "legacy" and self.encoding not in ENCODINGS:
+            raise ValueError(f"Unknown cache encoding: {self.encoding}")
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown cache compression: {self.compression}")
+
+        self._zstd_compressor = zstandard.ZstdCompressor(level=3) if self.compression == "zstd" else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+        self._plans: Dict[type, List[Tuple[str, int, Any, Any]]] = {}
+
+        self.encoded = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.trusted_decodes = 0
+        self.validated_decodes = 0
+        self.legacy_decodes = 0
+        self.version_mismatches = 0
+
+    def encode(self, value: BaseModel) -> bytes:
+        """Encode a model as a versioned, possibly compressed payload"""
+        if self.encoding == "legacy":
+            payload = value.model_dump_json().encode()
+            self._count_encode(len(payload), len(payload), False)
+            return payload
+
+        if self.encoding == "msgpack":
+            body = msgpack.packb(value.model_dump(mode="json"), use_bin_type=True)
+        else:
+            body = value.model_dump_json().encode()
+
+        compression = "none"
+        stored = body
+        if self.compression != "none" and len(body) >= self.min_compress_bytes:
+            compression = self.compression
+            if compression == "zstd":
+                stored = self._zstd_compressor.compress(body)
+            else:
+                stored = zlib.compress(body, 1)
+
+        header = HEADER.pack(MAGIC, CODEC_VERSION, ENCODINGS[self.encoding], COMPRESSIONS[compression], len(body))
+        self._count_encode(len(body), HEADER.size + len(stored), compression != "none")
+        return header + stored
+
+    def _count_encode(self, raw: int, stored: int, compressed: bool):
+        self.encoded += 1
+        self.raw_bytes += raw
+        self.stored_bytes += stored
+        if compressed:
+            self.compressed += 1
+
+    def decode(self, payload: Union[bytes, str]) -> Optional[M]:
+        """Decode a payload, or return None if it was written by an unknown version"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        if not payload or payload[0] != MAGIC:
+            # Plain JSON from before the codec existed
+            self.legacy_decodes += 1
+            return self.model.model_validate_json(payload)
+
+        _, version, encoding, compression, raw_length = HEADER.unpack_from(payload)
+        if version != CODEC_VERSION:
+            self.version_mismatches += 1
+            return None
+
+        body = memoryview(payload)[HEADER.size:]
+        if compression == COMPRESSIONS["zlib"]:
+            body = zlib.decompress(body)
+        elif compression == COMPRESSIONS["zstd"]:
+            if self._zstd_decompressor is None:
+                self.version_mismatches += 1
+                return None
+            body = self._zstd_decompressor.decompress(body, max_output_size=raw_length)
+
+        if encoding == ENCODINGS["msgpack"]:
+            if msgpack is None:
+                self.version_mismatches += 1
+                return None
+            data = msgpack.unpackb(body, raw=False)
+        elif orjson is not None:
+            data = orjson.loads(body)
+        else:
+            data = json.loads(bytes(body))
+
+        if self.trusted:
+            try:
+                value = self._construct(self.model, data)
+                self.trusted_decodes += 1
+                return value
+            except (KeyError, TypeError, ValueError) as e:
+                logger.debug("Trusted cache decode failed, validating", error=str(e))
+
+        self.validated_decodes += 1
+        return self.model.model_validate(data)
+
+    @staticmethod
+    def raw_size(payload: Union[bytes, str]) -> int:
+        """Uncompressed size of a payload, used to size the in-process tier"""
+        if payload and isinstance(payload, bytes) and payload[0] == MAGIC and len(payload) >= HEADER.size:
+            return HEADER.unpack_from(payload)[4]
+        return len(payload)
+
+    def _construct(self, model: type, data: Dict) -> BaseModel:
+        """Build a model from trusted data without validation (nested models and datetimes included)"""
+        plan = self._plans.get(model)
+        if plan is None:
+            plan = self._plans[model] = self._build_plan(model)
+
+        fields_set = set(data)
+        for name, kind, nested, default in plan:
+            if name not in data:
+                if default is _REQUIRED:
+                    raise KeyError(name)
+                data[name] = default()
+                continue
+            value = data[name]
+            if value is None:
+                continue
+            if kind == _MODEL:
+                data[name] = self._construct(nested, value)
+            elif kind == _MODEL_LIST:
+                data[name] = [self._construct(nested, item) for item in value]
+            elif kind == _DATETIME and isinstance(value, str):
+                data[name] = datetime.fromisoformat(value)
+
+        if len(data) != len(plan):
+            # Fields from a newer schema; drop them
+            for name in set(data) - set(model.model_fields):
+                del data[name]
+                fields_set.discard(name)
+
+        instance = object.__new__(model)
+        object.__setattr__(instance, "__dict__", data)
+        object.__setattr__(instance, "__pydantic_fields_set__", fields_set)
+        object.__setattr__(instance, "__pydantic_extra__", None)
+        object.__setattr__(instance, "__pydantic_private__", None)
+        return instance
+
+    @staticmethod
+    def _build_plan(model: type) -> List[Tuple[str, int, Any, Any]]:
+        plan = []
+        for name, field in model.model_fields.items():
+            kind, nested = _PLAIN, None
+            annotation = _unwrap_optional(field.annotation)
+            if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                kind, nested = _MODEL, annotation
+            elif typing.get_origin(annotation) in (list, List):
+                (item,) = typing.get_args(annotation) or (None,)
+                if isinstance(item, type) and issubclass(item, BaseModel):
+                    kind, nested = _MODEL_LIST, item
+            elif annotation is datetime:
+                kind = _DATETIME
+
+            if field.is_required():
+                default = _REQUIRED
+            elif field.default_factory is not None:
+                default = field.default_factory
+            else:
+                default = (lambda value: lambda: value)(field.default)
+            plan.append((name, kind, nested, default))
+        return plan
+
+    def stats(self) -> Dict:
+        """Get encoding and decoding statistics"""
+        return {
+            "encoding": self.encoding,
+            "compression": self.compression,
+            "encoded": self.encoded,
+            "compressed": self.compressed,
+            "compression_ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0,
+            "trusted_decodes": self.trusted_decodes,
+            "validated_decodes": self.validated_decodes,
+            "legacy_decodes": self.legacy_decodes,
+            "version_mismatches": self.version_mismatches
+        }
+
+def _unwrap_optional(annotation: Any) -> Any:
+    """Optional[X] -> X"""
+    if typing.get_origin(annotation) is Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
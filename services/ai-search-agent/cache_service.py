@@ -0,0 +1,291 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import structlog
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from config import settings
+from cache_codec import CacheCodec
+from metrics import DEPENDENCY_ERRORS
+
+logger = structlog.get_logger()
+
+class RedisCache:
+    """Non-blocking Redis cache backed by a shared async connection pool"""
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url or settings.redis_url
+        self.retry_interval = settings.redis_retry_interval
+        self._unavailable_until = 0.0
+
+        try:
+            self.pool = aioredis.ConnectionPool.from_url(
+                self.url,
+                max_connections=settings.redis_max_connections,
+                socket_timeout=settings.redis_socket_timeout,
+                socket_connect_timeout=settings.redis_socket_timeout
+            )
+            self.client = aioredis.Redis(connection_pool=self.pool)
+        except Exception as e:
+            logger.warning("Redis configuration invalid, caching disabled", error=str(e))
+            self.pool = None
+            self.client = None
+
+    @property
+    def available(self) -> bool:
+        """Whether the cache is configured and not in degraded mode"""
+        return self.client is not None and time.monotonic() >= self._unavailable_until
+
+    def _mark_unavailable(self, operation: str, error: Exception):
+        """Enter degraded mode: skip Redis until the retry interval elapses"""
+        self._unavailable_until = time.monotonic() + self.retry_interval
+        DEPENDENCY_ERRORS.labels(dependency="redis").inc()
+        logger.warning("Redis unavailable, serving without cache",
+                      operation=operation,
+                      retry_in=self.retry_interval,
+                      error=str(error))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get a single cached value"""
+        values = await self.get_many([key])
+        return values[0]
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Get several cached values in one pipelined round-trip"""
+        if not keys or not self.available:
+            return [None] * len(keys)
+
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.get(key)
+                return await pipe.execute()
+        except (RedisError, OSError) as e:
+            self._mark_unavailable("get", e)
+            return [None] * len(keys)
+
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], int]:
+        """Get a cached value and its remaining TTL in seconds in one round-trip"""
+        if not self.available:
+            return None, -2
+
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.ttl(key)
+                value, ttl = await pipe.execute()
+            return value, ttl
+        except (RedisError, OSError) as e:
+            self._mark_unavailable("get", e)
+            return None, -2
+
+    async def set(self, key: str, value: bytes, ttl: int) -> bool:
+        """Store a single value with an expiry"""
+        return await self.set_many({key: value}, ttl)
+
+    async def set_many(self, items: Dict[str, bytes], ttl: int) -> bool:
+        """Store several values with an expiry in one pipelined round-trip"""
+        if not items or not self.available:
+            return False
+
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.setex(key, ttl, value)
+                await pipe.execute()
+            return True
+        except (RedisError, OSError) as e:
+            self._mark_unavailable("set", e)
+            return False
+
+    async def ping(self) -> bool:
+        """Check Redis connectivity, leaving degraded mode on success"""
+        if self.client is None:
+            return False
+
+        try:
+            await self.client.ping()
+            self._unavailable_until = 0.0
+            return True
+        except (RedisError, OSError) as e:
+            self._mark_unavailable("ping", e)
+            return False
+
+    async def close(self):
+        """Release all pooled connections"""
+        if self.client is not None:
+            await self.client.aclose()
+            await self.pool.disconnect()
+
+class MemoryCache:
+    """Bounded in-process LRU cache with per-entry TTL
+
+    Expired entries are kept for a further stale_ttl seconds so they can be
+    served stale (see lookup()) while they are refreshed.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[int] = None,
+                 stale_ttl: Optional[int] = None):
+        self.max_entries = max_entries or settings.memory_cache_max_entries
+        self.max_bytes = max_bytes or settings.memory_cache_max_bytes
+        self.ttl = ttl or settings.memory_cache_ttl
+        self.stale_ttl = stale_ttl if stale_ttl is not None else settings.cache_stale_ttl
+
+        # key -> (value, size_bytes, expires_at), least recently used first
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a fresh value, refreshing its LRU position"""
+        value, stale = self.lookup(key)
+        return None if stale else value
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """Get a value and whether it is stale (expired but within stale_ttl)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+
+        value, size, expires_at = entry
+        now = time.monotonic()
+        if now >= expires_at + self.stale_ttl:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        if now >= expires_at:
+            self.stale_hits += 1
+            return value, True
+        self.hits += 1
+        return value, False
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[int] = None):
+        """Store a value, evicting least recently used entries past the limits"""
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = time.monotonic() + min(ttl or self.ttl, self.ttl)
+        self._entries[key] = (value, size, expires_at)
+        self._total_bytes += size
+
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def stats(self) -> Dict:
+        """Get occupancy and hit/eviction statistics"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+class TieredCache:
+    """In-process LRU tier in front of the shared Redis tier
+
+    The memory tier holds decoded values; Redis holds payloads encoded by
+    the codec.
+
+    Redis keys outlive their TTL by stale_ttl seconds; an entry whose
+    remaining Redis TTL is inside that window is expired but may still be
+    served stale while it is refreshed.
+    """
+
+    MEMORY_TIER = "memory"
+    REDIS_TIER = "redis"
+
+    def __init__(self, redis_cache: RedisCache, codec: CacheCodec,
+                 memory_cache: Optional[MemoryCache] = None):
+        self.redis = redis_cache
+        self.codec = codec
+        self.memory = memory_cache if memory_cache is not None else MemoryCache()
+        self.stale_ttl = self.memory.stale_ttl
+        self.redis_hits = 0
+        self.redis_stale_hits = 0
+        self.redis_misses = 0
+
+    async def get(self, key: str) -> Tuple[Optional[Any], Optional[str], bool]:
+        """Get a value, the name of the tier that served it and whether it is stale
+
+        A fresh value from either tier wins over a stale one.
+        """
+        value, stale = self.memory.lookup(key)
+        if value is not None and not stale:
+            return value, self.MEMORY_TIER, False
+
+        payload, ttl = await self.redis.get_with_ttl(key)
+        if payload is None:
+            self.redis_misses += 1
+            if value is not None:
+                return value, self.MEMORY_TIER, True
+            return None, None, False
+
+        fresh_ttl = ttl - self.stale_ttl if ttl >= 0 else None
+        if fresh_ttl is not None and fresh_ttl <= 0:
+            self.redis_stale_hits += 1
+            if value is not None:
+                return value, self.MEMORY_TIER, True
+            stale_value = self.codec.decode(payload)
+            if stale_value is None:
+                return None, None, False
+            return stale_value, self.REDIS_TIER, True
+
+        value = self.codec.decode(payload)
+        if value is None:
+            # Written by an incompatible codec version
+            self.redis_misses += 1
+            return None, None, False
+
+        self.redis_hits += 1
+        self.memory.set(key, value, self.codec.raw_size(payload), fresh_ttl)
+        return value, self.REDIS_TIER, False
+
+    async def set(self, key: str, value: Any, ttl: int) -> bool:
+        """Store a value in memory and its encoded payload in Redis"""
+        payload = self.codec.encode(value)
+        self.memory.set(key, value, self.codec.raw_size(payload), ttl)
+        return await self.redis.set(key, payload, ttl + self.stale_ttl)
+
+    def stats(self) -> Dict:
+        """Get statistics for both tiers"""
+        return {
+            self.MEMORY_TIER: self.memory.stats(),
+            self.REDIS_TIER: {
+                "available": self.redis.available,
+                "hits": self.redis_hits,
+                "stale_hits": self.redis_stale_hits,
+                "misses": self.redis_misses
+            },
+            "codec": self.codec.stats()
+        }
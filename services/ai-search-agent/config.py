@@ -1,14 +1,60 @@
 from pydantic_settings import BaseSettings
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     # SearXNG Configuration
     searxng_base_url: str = "http://localhost:8080"
+    # Several instances to balance across; searxng_base_url is used when empty
+    searxng_base_urls: List[str] = []
     searxng_api_key: Optional[str] = None
-    
+
+    # SearXNG HTTP Connection Pool
+    searxng_max_connections: int = 100
+    searxng_max_keepalive_connections: int = 20
+    searxng_keepalive_expiry: float = 30.0
+    searxng_http2: bool = False
+
+    # SearXNG Load Balancing
+    searxng_ewma_alpha: float = 0.3
+    searxng_eject_consecutive_failures: int = 3
+    searxng_eject_seconds: float = 30.0
+    searxng_eject_max_seconds: float = 300.0
+    searxng_hedge_enabled: bool = False
+    searxng_hedge_percentile: float = 95.0
+    searxng_hedge_min_delay: float = 0.05
+
     # Local LLM Configuration
     ollama_base_url: str = "http://localhost:11434"
     default_model: str = "deepseek-r1:7b"
+    ollama_timeout: float = 60.0
+    ollama_max_connections: int = 20
+    ollama_max_keepalive_connections: int = 10
+    llm_default_concurrency: int = 2
+    llm_queue_timeout: float = 30.0
+    llm_background_queue_timeout: float = 300.0
+    llm_max_queue_depth: int = 100
+    llm_interactive_weight: int = 4
+    llm_batch_window_ms: float = 10.0
+    llm_max_tokens: int = 2000
+    # Must match the Ollama server's OLLAMA_CONTEXT_LENGTH (completions use its default window)
+    llm_default_num_ctx: int = 2048
+    
+    # Model Residency (keep_alive in seconds after last use, < 0 keeps a model loaded)
+    ollama_residency_enabled: bool = True
+    ollama_preload_target: str = "balanced"
+    ollama_keep_alive: float = 600.0
+    default_model_keep_alive: float = -1.0
+    ollama_keep_alive_overrides: Dict[str, float] = {}
+    ollama_memory_headroom_gb: float = 2.0
+    ollama_residency_interval: float = 30.0
+    ollama_load_timeout: float = 300.0
+    ollama_demand_load_timeout: float = 30.0
+    
+    # Analysis Prompt Budget
+    prompt_max_results: int = 10
+    prompt_snippet_chars: int = 500
+    prompt_chars_per_token: int = 4
+    prompt_redundancy_threshold: float = 0.8
     
     # Supabase Configuration
     supabase_url: Optional[str] = None
@@ -16,17 +62,119 @@ class Settings(BaseSettings):
     
     # Redis Configuration
     redis_url: str = "redis://localhost:6379"
+    redis_max_connections: int = 50
+    redis_socket_timeout: float = 2.0
+    redis_retry_interval: float = 30.0
+    
+    # In-process Cache Tier
+    memory_cache_max_entries: int = 1000
+    memory_cache_max_bytes: int = 64 * 1024 * 1024
+    memory_cache_ttl: int = 300
+    
+    # Cache Encoding ("legacy" writes plain JSON readable by older releases)
+    cache_encoding: str = "json"
+    cache_compression: str = "zlib"
+    cache_compression_min_bytes: int = 1024
+    cache_trusted_decode: bool = True
+    
+    # Stale-While-Revalidate
+    cache_stale_ttl: int = 600
+    stale_refresh_rate: float = 1.0
+    stale_refresh_burst: int = 5
+    
+    # AI Analysis Cache
+    analysis_cache_timeout: int = 86400
+    analysis_memory_cache_max_entries: int = 500
+    
+    # Semantic Query Cache
+    semantic_cache_enabled: bool = False
+    semantic_cache_model: str = "nomic-embed-text"
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_max_entries: int = 10000
+    semantic_cache_max_namespaces: int = 1000
+    semantic_cache_embed_timeout: float = 2.0
+    semantic_cache_verify_rate: float = 0.05
+    semantic_cache_verify_min_overlap: float = 0.3
+    
+    # Search History
+    history_enabled: bool = True
+    history_db_path: str = "data/search_history.db"
+    history_flush_interval: float = 1.0
+    history_batch_size: int = 100
+    history_max_buffer: int = 10000
+    
+    # Hot Query Tracking and Cache Warming
+    hot_queries_enabled: bool = True
+    hot_queries_path: str = "data/hot_queries.json"
+    hot_queries_top_k: int = 100
+    hot_queries_sketch_width: int = 4096
+    hot_queries_sketch_depth: int = 4
+    hot_queries_persist_interval: float = 60.0
+    hot_queries_warm_rate: float = 0.5
+    
+    # Circuit Breakers, Adaptive Timeouts and Retries
+    breaker_failure_threshold: float = 0.5
+    breaker_min_calls: int = 10
+    breaker_window_seconds: float = 30.0
+    breaker_open_seconds: float = 30.0
+    breaker_half_open_max_calls: int = 1
+    negative_cache_ttl: float = 15.0
+    analysis_negative_cache_ttl: float = 60.0
+    negative_cache_max_entries: int = 10000
+    adaptive_timeout_percentile: float = 99.0
+    adaptive_timeout_multiplier: float = 2.0
+    adaptive_timeout_min_samples: int = 50
+    searxng_timeout_floor: float = 2.0
+    ollama_timeout_floor: float = 15.0
+    retry_max_attempts: int = 3
+    retry_budget_ratio: float = 0.1
+    retry_budget_min_per_second: float = 1.0
+    retry_backoff_base: float = 0.1
+    retry_backoff_max: float = 2.0
+    
+    # Health Probing
+    health_probe_interval: float = 15.0
+    health_probe_timeout: float = 5.0
     
     # API Configuration
     api_host: str = "0.0.0.0"
     api_port: int = 8001
     log_level: str = "INFO"
+    log_queue_enabled: bool = True
+    log_queue_size: int = 10000
+    log_sample_rates: Dict[str, float] = {}
+    log_default_sample_rate: float = 1.0
     
     # Search Configuration
     max_search_results: int = 10
     cache_timeout: int = 3600
     request_timeout: int = 30
     
+    # Batch Search
+    batch_max_items: int = 1000
+    batch_search_concurrency: int = 8
+    batch_analysis_concurrency: int = 2
+    
+    # Result Deduplication
+    dedup_enabled: bool = True
+    dedup_similarity_threshold: float = 0.7
+    dedup_minhash_permutations: int = 64
+    dedup_min_tokens: int = 8
+    dedup_shingle_size: int = 3
+    
+    # Local Reranking
+    rerank_enabled: bool = True
+    rerank_bm25_weight: float = 0.7
+    rerank_bm25_k1: float = 1.2
+    rerank_bm25_b: float = 0.75
+    rerank_title_weight: int = 2
+    
+    # Response Compression
+    response_compression_enabled: bool = True
+    response_compression_min_bytes: int = 1024
+    response_gzip_level: int = 5
+    response_brotli_quality: int = 4
+    
     # Security
     cors_origins: List[str] = ["http://localhost:3000"]
     api_key_required: bool = False
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+import structlog
+from config import settings
+
+logger = structlog.get_logger()
+
+@dataclass
+class ProbeResult:
+    """Outcome of the latest probe of one dependency"""
+    healthy: bool
+    latency_ms: float
+    checked_at: float
+    error: Optional[str] = None
+
+class HealthProber:
+    """Probe dependencies in the background and cache their status
+
+    Each probe is a cheap async check (a model list, a PING) returning
+    True when the dependency is usable. All probes run concurrently every
+    health_probe_interval seconds, so /health only reads cached results
+    and never waits on, or loads, a dependency itself.
+    """
+
+    def __init__(self, probes: Dict[str, Callable[[], Awaitable[bool]]]):
+        self.probes = probes
+        self.interval = settings.health_probe_interval
+        self.timeout = settings.health_probe_timeout
+        self.results: Dict[str, ProbeResult] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Run a first round of probes, then keep probing in the background"""
+        await self.probe_all()
+        self._task = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error("Health probe round failed", error=str(e))
+
+    async def probe_all(self):
+        """Probe every dependency once, concurrently"""
+        await asyncio.gather(*(self._probe(name, probe) for name, probe in self.probes.items()))
+
+    async def _probe(self, name: str, probe: Callable[[], Awaitable[bool]]):
+        start = time.perf_counter()
+        error = None
+        try:
+            healthy = bool(await asyncio.wait_for(probe(), timeout=self.timeout))
+        except asyncio.TimeoutError:
+            healthy, error = False, f"Probe timed out after {self.timeout}s"
+        except Exception as e:
+            healthy, error = False, str(e)
+
+        previous = self.results.get(name)
+        self.results[name] = ProbeResult(
+            healthy=healthy,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            checked_at=time.time(),
+            error=error
+        )
+
+        if previous is not None and previous.healthy != healthy:
+            log = logger.info if healthy else logger.warning
+            log("Dependency health changed", dependency=name, healthy=healthy, error=error)
+
+    def status(self) -> Dict[str, Dict]:
+        """Get the cached status of each dependency with probe age and latency"""
+        now = time.time()
+        return {
+            name: {
+                "healthy": result.healthy,
+                "latency_ms": round(result.latency_ms, 2),
+                "age_seconds": round(now - result.checked_at, 2),
+                "error": result.error
+            }
+            for name in self.probes
+            if (result := self.results.get(name)) is not None
+        }
+
+    def is_healthy(self, name: str) -> bool:
+        result = self.results.get(name)
+        return result is not None and result.healthy
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
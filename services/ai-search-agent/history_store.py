@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import structlog
+from config import settings
+from models import WebSearchResponse
+
+logger = structlog.get_logger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query TEXT NOT NULL,
+    summary TEXT,
+    key_points TEXT,
+    sources TEXT,
+    results_count INTEGER NOT NULL,
+    cache_tier TEXT,
+    model_used TEXT,
+    confidence_score REAL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_search_history_created_at ON search_history (created_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_history_fts USING fts5(
+    query, summary, content='search_history', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS search_history_ai AFTER INSERT ON search_history BEGIN
+    INSERT INTO search_history_fts (rowid, query, summary) VALUES (new.id, new.query, new.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS search_history_ad AFTER DELETE ON search_history BEGIN
+    INSERT INTO search_history_fts (search_history_fts, rowid, query, summary)
+    VALUES ('delete', old.id, old.query, old.summary);
+END;
+"""
+
+INSERT_SQL = """
+INSERT INTO search_history
+    (query, summary, key_points, sources, results_count, cache_tier, model_used, confidence_score, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SELECT_COLUMNS = """
+h.id, h.query, h.summary, h.key_points, h.sources, h.results_count,
+h.cache_tier, h.model_used, h.confidence_score, h.created_at
+"""
+
+class SearchHistoryStore:
+    """Search history in SQLite (WAL mode) with an FTS5 index
+
+    record() only appends to an in-memory buffer; a background task writes
+    the buffer in batches on a dedicated writer thread, so the request path
+    never waits on disk. Reads use their own connection and thread, which
+    WAL lets run concurrently with writes.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.history_db_path
+        self.enabled = settings.history_enabled
+        self.flush_interval = settings.history_flush_interval
+        self.batch_size = settings.history_batch_size
+        self.max_buffer = settings.history_max_buffer
+
+        self._buffer: List[Tuple] = []
+        self._flush_requested = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-reader")
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    async def start(self):
+        """Open the database and start the write-behind flusher"""
+        if not self.enabled:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._writer, self._open_writer)
+            await loop.run_in_executor(self._reader, self._open_reader)
+        except Exception as e:
+            logger.warning("Search history database unavailable, history disabled",
+                          path=self.path,
+                          error=str(e))
+            self.enabled = False
+            return
+
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("Search history store started", path=self.path)
+
+    def _open_writer(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._write_conn = conn
+
+    def _open_reader(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self._read_conn = conn
+
+    def record(self, response: WebSearchResponse):
+        """Queue a completed search for writing (never blocks)"""
+        if not self.enabled:
+            return
+
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+
+        analysis = response.ai_analysis
+        self._buffer.append((
+            response.query,
+            analysis.summary if analysis else None,
+            json.dumps(analysis.key_points) if analysis else None,
+            json.dumps(analysis.sources if analysis else [r.url for r in response.search_results.results[:3]]),
+            response.search_results.total_results,
+            response.cache_tier,
+            analysis.model_used if analysis else None,
+            analysis.confidence_score if analysis else None,
+            response.timestamp.isoformat()
+        ))
+        self.recorded += 1
+
+        if len(self._buffer) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all buffered records in one transaction"""
+        if not self._buffer or self._write_conn is None:
+            return
+
+        batch, self._buffer = self._buffer, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._writer, self._write_batch, batch)
+            self.written += len(batch)
+            self.flushes += 1
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning("Search history write failed", batch_size=len(batch), error=str(e))
+
+    def _write_batch(self, batch: List[Tuple]):
+        with self._write_conn:
+            self._write_conn.executemany(INSERT_SQL, batch)
+
+    async def list_searches(self, limit: int = 20, offset: int = 0) -> Dict:
+        """Page through history, newest first"""
+        return await self._read(self._list_searches, limit, offset)
+
+    async def search(self, text: str, limit: int = 20, offset: int = 0) -> Dict:
+        """Full-text search past queries and summaries, best matches first"""
+        return await self._read(self._search, text, limit, offset)
+
+    async def _read(self, fn, *args) -> Dict:
+        if not self.enabled or self._read_conn is None:
+            return {"searches": [], "total": 0}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, fn, *args)
+
+    def _list_searches(self, limit: int, offset: int) -> Dict:
+        rows = self._read_conn.execute(
+            f"SELECT {SELECT_COLUMNS} FROM search_history h ORDER BY h.id DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        ).fetchall()
+        total = self._read_conn.execute("SELECT COUNT(*) FROM search_history").fetchone()[0]
+        return {"searches": [self._row_to_dict(row) for row in rows], "total": total}
+
+    def _search(self, text: str, limit: int, offset: int) -> Dict:
+        match = self._fts_query(text)
+        if not match:
+            return self._list_searches(limit, offset)
+
+        rows = self._read_conn.execute(
+            f"""SELECT {SELECT_COLUMNS} FROM search_history_fts f
+                JOIN search_history h ON h.id = f.rowid
+                WHERE search_history_fts MATCH ?
+                ORDER BY bm25(search_history_fts) LIMIT ? OFFSET ?""",
+            (match, limit, offset)
+        ).fetchall()
+        total = self._read_conn.execute(
+            "SELECT COUNT(*) FROM search_history_fts WHERE search_history_fts MATCH ?",
+            (match,)
+        ).fetchone()[0]
+        return {"searches": [self._row_to_dict(row) for row in rows], "total": total}
+
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """Quote each term so user input can't inject FTS5 query syntax; prefix-match the last one"""
+        terms = [term.replace('"', '""') for term in text.split()]
+        if not terms:
+            return ""
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        return " ".join(quoted)
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        return {
+            "id": row["id"],
+            "query": row["query"],
+            "summary": row["summary"],
+            "key_points": json.loads(row["key_points"]) if row["key_points"] else [],
+            "sources": json.loads(row["sources"]) if row["sources"] else [],
+            "results_count": row["results_count"],
+            "cache_tier": row["cache_tier"],
+            "model_used": row["model_used"],
+            "confidence_score": row["confidence_score"],
+            "timestamp": datetime.fromisoformat(row["created_at"])
+        }
+
+    def stats(self) -> Dict:
+        """Get write-behind buffer statistics"""
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes
+        }
+
+    async def close(self):
+        """Flush remaining records and close the database"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+        loop = asyncio.get_running_loop()
+        if self._write_conn is not None:
+            await loop.run_in_executor(self._writer, self._write_conn.close)
+        if self._read_conn is not None:
+            await loop.run_in_executor(self._reader, self._read_conn.close)
+        self._writer.shutdown(wait=True)
+        self._reader.shutdown(wait=True)
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+import numpy as np
+import structlog
+from config import settings
+from models import WebSearchRequest
+
+logger = structlog.get_logger()
+
+class CountMinSketch:
+    """Approximate frequency counts in fixed memory (never undercounts)"""
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self._counts = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+
+    def _columns(self, key: str) -> np.ndarray:
+        # One 64-bit hash per row from a single digest, stable across restarts
+        digest = hashlib.blake2b(key.encode(), digest_size=8 * self.depth).digest()
+        return np.frombuffer(digest, dtype=np.uint64) % np.uint64(self.width)
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Count key and return its new estimated frequency"""
+        columns = self._columns(key)
+        self._counts[self._rows, columns] += count
+        return int(self._counts[self._rows, columns].min())
+
+    def estimate(self, key: str) -> int:
+        return int(self._counts[self._rows, self._columns(key)].min())
+
+class HotQueryTracker:
+    """Track the most frequent searches and warm the caches with them after a restart
+
+    Every search is counted in a count-min sketch; the top_k searches by
+    estimated count are kept with their full request so they can be
+    replayed exactly (same options, same cache keys). The top-k list is
+    written to hot_queries_path periodically and on shutdown.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.hot_queries_path
+        self.enabled = settings.hot_queries_enabled
+        self.top_k = settings.hot_queries_top_k
+        self.persist_interval = settings.hot_queries_persist_interval
+        self.warm_rate = settings.hot_queries_warm_rate
+
+        self.sketch = CountMinSketch(settings.hot_queries_sketch_width, settings.hot_queries_sketch_depth)
+        # request key -> (estimated count, request)
+        self._top: Dict[str, List] = {}
+        self._min_count = 0
+        self._dirty = False
+        self._persist_task: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.warmed = 0
+        self.warm_failures = 0
+
+    @staticmethod
+    def _key(request: WebSearchRequest) -> str:
+        # Priority only affects scheduling, not what gets cached
+        return request.model_dump_json(exclude={"priority"})
+
+    def record(self, request: WebSearchRequest):
+        """Count one search"""
+        if not self.enabled:
+            return
+
+        self.recorded += 1
+        key = self._key(request)
+        count = self.sketch.add(key)
+
+        entry = self._top.get(key)
+        if entry is not None:
+            entry[0] = count
+        elif len(self._top) < self.top_k:
+            self._top[key] = [count, request]
+            self._min_count = min(self._min_count, count) if len(self._top) > 1 else count
+        elif count > self._min_count:
+            # _min_count is a lower bound (tracked counts only grow); check the real minimum
+            coldest = min(self._top, key=lambda k: self._top[k][0])
+            if self._top[coldest][0] < count:
+                del self._top[coldest]
+                self._top[key] = [count, request]
+            self._min_count = min(entry[0] for entry in self._top.values())
+        else:
+            return
+        self._dirty = True
+
+    def top(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get the hottest searches, most frequent first"""
+        ranked = sorted(self._top.values(), key=lambda entry: -entry[0])[:limit]
+        return [{"count": count, "request": request.model_dump(mode="json")} for count, request in ranked]
+
+    async def start(self):
+        """Start persisting the top-k periodically"""
+        if self.enabled:
+            self._persist_task = asyncio.create_task(self._persist_loop())
+
+    async def _persist_loop(self):
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            await self.persist()
+
+    async def persist(self):
+        """Write the top-k to disk if it changed"""
+        if not self.enabled or not self._dirty:
+            return
+        self._dirty = False
+        snapshot = self.top()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, snapshot)
+        except Exception as e:
+            logger.warning("Failed to persist hot queries", path=self.path, error=str(e))
+
+    def _write(self, snapshot: List[Dict]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, self.path)
+
+    def load(self) -> List[WebSearchRequest]:
+        """Read the persisted top-k, hottest first"""
+        if not self.enabled or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            return [WebSearchRequest.model_validate(entry["request"]) for entry in snapshot]
+        except Exception as e:
+            logger.warning("Failed to load hot queries", path=self.path, error=str(e))
+            return []
+
+    async def warm(self, requests: List[WebSearchRequest],
+                   run: Callable[[WebSearchRequest], Awaitable[object]]):
+        """Replay requests one at a time at no more than warm_rate per second"""
+        if not requests:
+            return
+
+        logger.info("Warming caches with hot queries", count=len(requests))
+        interval = 1 / self.warm_rate if self.warm_rate > 0 else 0.0
+        loop = asyncio.get_running_loop()
+        for request in requests:
+            started = loop.time()
+            try:
+                await run(request)
+                self.warmed += 1
+            except Exception as e:
+                self.warm_failures += 1
+                logger.warning("Cache warming query failed", query=request.query, error=str(e))
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+
+        logger.info("Cache warming complete", warmed=self.warmed, failed=self.warm_failures)
+
+    def stats(self) -> Dict:
+        """Get tracking and warming statistics"""
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "tracked": len(self._top),
+            "top_k": self.top_k,
+            "min_tracked_count": self._min_count,
+            "warmed": self.warmed,
+            "warm_failures": self.warm_failures
+        }
+
+    async def close(self):
+        """Stop the persist loop and write the final top-k"""
+        if self._persist_task:
+            self._persist_task.cancel()
+            try:
+                await self._persist_task
+            except asyncio.CancelledError:
+                pass
+        await self.persist()
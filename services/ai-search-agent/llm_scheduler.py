@@ -0,0 +1,237 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, List, Optional
+import structlog
+from config import settings
+from model_optimizer import ModelOptimizer
+
+logger = structlog.get_logger()
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+class SchedulerQueueFull(Exception):
+    """Raised when a model's queue is at its depth limit"""
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before it gets a model slot"""
+
+@dataclass
+class _Ticket:
+    """A queued request waiting for a generation slot"""
+    priority: str
+    future: asyncio.Future
+    enqueued_at: float
+    deadline: float
+
+@dataclass
+class _ModelQueue:
+    """Per-model slots, priority queues and statistics"""
+    model: str
+    limit: int
+    active: int = 0
+    waiting: Dict[str, Deque[_Ticket]] = field(default_factory=lambda: {p: deque() for p in PRIORITIES})
+    interactive_streak: int = 0
+    dispatch_handle: Optional[asyncio.Handle] = None
+
+    granted: int = 0
+    completed: int = 0
+    rejected: int = 0
+    expired: int = 0
+    batches: int = 0
+    wait_times: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+    completion_times: Deque[float] = field(default_factory=lambda: deque(maxlen=10000))
+
+    @property
+    def depth(self) -> int:
+        return sum(len(tickets) for tickets in self.waiting.values())
+
+class LLMScheduler:
+    """Priority-aware admission control in front of Ollama
+
+    Each model gets as many concurrent generation slots as its
+    recommended batch size. Waiting requests are served by weighted fair
+    queuing between the interactive and background classes, so background
+    jobs cannot starve interactive users (and vice versa). Ollama has no
+    batch completion API, so micro-batching means arrivals within
+    llm_batch_window_ms are released together and land in Ollama's parallel
+    slots (OLLAMA_NUM_PARALLEL) at the same time.
+    """
+
+    def __init__(self):
+        self.max_queue_depth = settings.llm_max_queue_depth
+        self.batch_window = settings.llm_batch_window_ms / 1000
+        self.interactive_weight = settings.llm_interactive_weight
+        self.timeouts = {
+            INTERACTIVE: settings.llm_queue_timeout,
+            BACKGROUND: settings.llm_background_queue_timeout
+        }
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def get_limit(self, model: str) -> int:
+        """Get the concurrency limit for a model from its recommended batch size"""
+        model_config = ModelOptimizer.get_model_config(model)
+        if model_config:
+            return model_config.recommended_batch_size
+        return settings.llm_default_concurrency
+
+    def _get_queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = _ModelQueue(model=model, limit=self.get_limit(model))
+            self._queues[model] = queue
+        return queue
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str = INTERACTIVE,
+                   timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold one generation slot for a model for the duration of the block
+
+        Raises SchedulerQueueFull if the model's queue is full and
+        DeadlineExceeded if no slot frees up within the timeout (by default
+        the queue timeout for the priority class).
+        """
+        if priority not in PRIORITIES:
+            priority = INTERACTIVE
+
+        queue = self._get_queue(model)
+        if queue.depth >= self.max_queue_depth:
+            queue.rejected += 1
+            logger.warning("LLM queue full, rejecting request",
+                          model=model,
+                          priority=priority,
+                          depth=queue.depth)
+            raise SchedulerQueueFull(f"Queue for model {model} is full")
+
+        now = time.monotonic()
+        timeout = timeout if timeout is not None else self.timeouts[priority]
+        ticket = _Ticket(
+            priority=priority,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued_at=now,
+            deadline=now + timeout
+        )
+        queue.waiting[priority].append(ticket)
+        self._schedule_dispatch(queue)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                # The slot was granted just as we stopped waiting; hand it back
+                self._release(queue, completed=False)
+            else:
+                ticket.future.cancel()
+                self._discard(queue, ticket)
+
+            if isinstance(e, asyncio.TimeoutError):
+                queue.expired += 1
+                logger.warning("LLM request deadline exceeded in queue",
+                              model=model,
+                              priority=priority,
+                              timeout=timeout)
+                raise DeadlineExceeded(f"No slot for model {model} within {timeout}s")
+            raise
+
+        queue.wait_times.append(time.monotonic() - ticket.enqueued_at)
+        try:
+            yield
+        finally:
+            self._release(queue, completed=True)
+
+    @staticmethod
+    def _discard(queue: _ModelQueue, ticket: _Ticket):
+        """Drop a ticket that stopped waiting so it no longer counts towards the depth"""
+        try:
+            queue.waiting[ticket.priority].remove(ticket)
+        except ValueError:
+            # Already popped by the dispatcher (e.g. expired while queued)
+            pass
+
+    def _schedule_dispatch(self, queue: _ModelQueue):
+        """Dispatch after the batch window so near-simultaneous arrivals start together"""
+        if queue.dispatch_handle is None and queue.active < queue.limit:
+            loop = asyncio.get_running_loop()
+            queue.dispatch_handle = loop.call_later(self.batch_window, self._dispatch, queue)
+
+    def _dispatch(self, queue: _ModelQueue):
+        """Grant free slots to waiting tickets as one micro-batch"""
+        queue.dispatch_handle = None
+        now = time.monotonic()
+        batch_size = 0
+
+        while queue.active < queue.limit:
+            ticket = self._next_ticket(queue, now)
+            if ticket is None:
+                break
+            queue.active += 1
+            queue.granted += 1
+            ticket.future.set_result(None)
+            batch_size += 1
+
+        if batch_size:
+            queue.batches += 1
+
+    def _next_ticket(self, queue: _ModelQueue, now: float) -> Optional[_Ticket]:
+        """Pick the next live ticket by weighted fair queuing between priority classes"""
+        for tickets in queue.waiting.values():
+            while tickets and (tickets[0].future.done() or tickets[0].deadline <= now):
+                ticket = tickets.popleft()
+                if not ticket.future.done():
+                    queue.expired += 1
+                    ticket.future.set_exception(DeadlineExceeded("Deadline passed while queued"))
+
+        interactive = queue.waiting[INTERACTIVE]
+        background = queue.waiting[BACKGROUND]
+
+        if interactive and (not background or queue.interactive_streak < self.interactive_weight):
+            queue.interactive_streak += 1
+            return interactive.popleft()
+        if background:
+            queue.interactive_streak = 0
+            return background.popleft()
+        return None
+
+    def _release(self, queue: _ModelQueue, completed: bool):
+        queue.active -= 1
+        if completed:
+            queue.completed += 1
+            queue.completion_times.append(time.monotonic())
+        if queue.depth:
+            self._dispatch(queue)
+
+    @staticmethod
+    def _percentile(values: List[float], percentile: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict:
+        """Get per-model queue depth, wait times, batching and throughput"""
+        now = time.monotonic()
+        stats = {}
+        for model, queue in self._queues.items():
+            wait_times = list(queue.wait_times)
+            recent_completions = sum(1 for t in queue.completion_times if now - t <= 60)
+            stats[model] = {
+                "limit": queue.limit,
+                "active": queue.active,
+                "waiting": {priority: len(tickets) for priority, tickets in queue.waiting.items()},
+                "granted": queue.granted,
+                "completed": queue.completed,
+                "rejected": queue.rejected,
+                "expired": queue.expired,
+                "batches": queue.batches,
+                "avg_batch_size": queue.granted / queue.batches if queue.batches else 0.0,
+                "queue_wait_p50": self._percentile(wait_times, 50),
+                "queue_wait_p95": self._percentile(wait_times, 95),
+                "queue_wait_max": max(wait_times) if wait_times else 0.0,
+                "throughput_per_min": recent_completions
+            }
+        return stats
@@ -0,0 +1,151 @@
+import atexit
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, TextIO
+import structlog
+from config import settings
+
+_listener: Optional[QueueListener] = None
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock prepare() renders the message on the calling thread (the
+    event loop); records only cross threads here, never processes, so they
+    can be queued as they are. When the queue is full records are dropped
+    and counted rather than blocking the loop.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _DrainingQueueListener(QueueListener):
+    """QueueListener whose stop() waits for room in a full queue
+
+    The stock listener enqueues its stop sentinel with put_nowait, which
+    fails when the queue is saturated.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+class EventSampler:
+    """structlog processor that keeps a fraction of high-volume debug/info events
+
+    Rates are per event name (the log message), with default_rate for
+    everything else. Warnings and errors are always kept. Sampled events
+    carry their sample_rate so counts can be scaled back up.
+    """
+
+    SAMPLED_LEVELS = {"debug", "info"}
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default_rate: float = 1.0):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self._random = random.random
+
+    def __call__(self, logger, method_name: str, event_dict: Dict) -> Dict:
+        if method_name not in self.SAMPLED_LEVELS:
+            return event_dict
+        rate = self.rates.get(event_dict.get("event"), self.default_rate)
+        if rate >= 1.0:
+            return event_dict
+        if rate <= 0.0 or self._random() >= rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
+def configure_logging(level: Optional[str] = None,
+                      sample_rates: Optional[Dict[str, float]] = None,
+                      default_sample_rate: Optional[float] = None,
+                      use_queue: Optional[bool] = None,
+                      stream: Optional[TextIO] = None):
+    """Configure structlog JSON logging through stdlib, rendered off the event loop
+
+    Event dicts are built on the calling thread (cheap) and handed to a
+    QueueHandler; a QueueListener thread renders them to JSON and writes
+    them to stream (stderr by default, keeping stdout free for output of
+    tools that import the app, like the load test's report). Other
+    arguments default to the log_* settings.
+    """
+    global _listener
+    shutdown_logging()
+
+    level = (level or settings.log_level).upper()
+    use_queue = settings.log_queue_enabled if use_queue is None else use_queue
+    sampler = EventSampler(
+        settings.log_sample_rates if sample_rates is None else sample_rates,
+        settings.log_default_sample_rate if default_sample_rate is None else default_sample_rate
+    )
+
+    timestamper = structlog.processors.TimeStamper(fmt="iso")
+    structlog.configure(
+        processors=[
+            structlog.stdlib.filter_by_level,
+            sampler,
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            timestamper,
+            # Tracebacks must be captured on the thread that handled the exception
+            structlog.processors.format_exc_info,
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter
+        ],
+        context_class=dict,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.stdlib.BoundLogger,
+        cache_logger_on_first_use=True,
+    )
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(structlog.stdlib.ProcessorFormatter(
+        processor=structlog.processors.JSONRenderer(),
+        # Records from plain stdlib loggers (libraries) get the same fields
+        foreign_pre_chain=[structlog.stdlib.add_logger_name, structlog.stdlib.add_log_level, timestamper]
+    ))
+
+    # The JSON output has no source location or thread/process fields; skip
+    # the per-record stack walk and lookups that would fill them in
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if use_queue:
+        log_queue: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        _listener = _DrainingQueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(output)
+
+def dropped_log_records() -> int:
+    """Records dropped because the log queue was full"""
+    return sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+
+def shutdown_logging():
+    """Stop the listener thread after writing any queued records"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown_logging)
@@ -1,67 +1,104 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import structlog
 import time
 import asyncio
+import json
+import math
 from datetime import datetime
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, nullcontext, suppress
+from typing import Optional
 
 from config import settings
 from models import (
-    WebSearchRequest, WebSearchResponse, SearchQuery, SearchResponse,
+    WebSearchRequest, WebSearchResponse, BatchSearchRequest, SearchQuery, SearchResponse,
     AIAnalysisRequest, HealthResponse, ErrorResponse
 )
 from searxng_service import SearXNGService
+from cache_service import RedisCache
 from ai_analysis_service import AIAnalysisService
+from prompt_builder import PromptTooLong
+from semantic_cache import SemanticCache
+from history_store import SearchHistoryStore
+from health_prober import HealthProber
+from hot_queries import HotQueryTracker
+from resilience import DependencyUnavailable
 from model_optimizer import ModelOptimizer, get_performance_recommendations
+from logging_config import configure_logging, dropped_log_records
+from metrics import HTTP_REQUESTS_IN_FLIGHT, LOG_RECORDS_DROPPED
+from api_responses import FastJSONResponse, CompressionMiddleware
 
-# Configure structured logging
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.JSONRenderer()
-    ],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    cache_logger_on_first_use=True,
-)
+# Configure structured logging (rendered on a background thread)
+configure_logging()
+LOG_RECORDS_DROPPED.set_function(dropped_log_records)
 
 logger = structlog.get_logger()
 
 # Global service instances
+redis_cache = None
 searxng_service = None
 ai_service = None
+semantic_cache = None
+history_store = None
+health_prober = None
+hot_queries = None
+cache_warming_task = None
 app_start_time = time.time()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan management"""
-    global searxng_service, ai_service
+    global redis_cache, searxng_service, ai_service, semantic_cache, history_store, health_prober
+    global hot_queries, cache_warming_task
     
     # Startup
     logger.info("Starting AI Search Agent", version="1.0.0")
     
     # Initialize services
-    searxng_service = SearXNGService()
-    ai_service = AIAnalysisService()
+    redis_cache = RedisCache()
+    searxng_service = SearXNGService(cache=redis_cache)
+    ai_service = AIAnalysisService(cache=redis_cache)
+    semantic_cache = SemanticCache(ai_service.client, ai_service.policy.breaker)
+    history_store = SearchHistoryStore()
+    await history_store.start()
+    
+    # Health checks, repeated in the background for /health
+    health_prober = HealthProber({
+        "searxng": searxng_service.health_check,
+        "ai_analysis": ai_service.health_check,
+        "redis": redis_cache.ping
+    })
+    await health_prober.start()
     
-    # Health checks
-    searxng_healthy = await searxng_service.health_check()
-    ai_healthy = await ai_service.health_check()
+    # Preload the default and recommended models in the background
+    await ai_service.residency.start()
     
     logger.info("Service initialization complete",
-               searxng_healthy=searxng_healthy,
-               ai_healthy=ai_healthy)
+               searxng_healthy=health_prober.is_healthy("searxng"),
+               ai_healthy=health_prober.is_healthy("ai_analysis"),
+               redis_healthy=health_prober.is_healthy("redis"))
+    
+    # Replay the queries that were hottest before the restart, in the background
+    hot_queries = HotQueryTracker()
+    await hot_queries.start()
+    cache_warming_task = asyncio.create_task(hot_queries.warm(hot_queries.load(), _warm_query))
     
     yield
     
     # Shutdown
     logger.info("Shutting down AI Search Agent")
+    await health_prober.close()
+    cache_warming_task.cancel()
+    with suppress(asyncio.CancelledError):
+        # Let warming queries unwind before the services they use are closed
+        await cache_warming_task
+    await hot_queries.close()
+    await searxng_service.close()
+    await ai_service.close()
+    await history_store.close()
+    await redis_cache.close()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -69,6 +106,7 @@ app = FastAPI(
     description="Privacy-focused web search with AI-powered analysis using SearXNG and local LLMs",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc"
 )
@@ -82,6 +120,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large, non-streamed responses (gzip, or brotli when installed)
+app.add_middleware(CompressionMiddleware)
+
 # Middleware for request logging
 @app.middleware("http")
 async def log_requests(request, call_next):
@@ -93,7 +134,8 @@ async def log_requests(request, call_next):
                url=str(request.url),
                client_ip=request.client.host)
     
-    response = await call_next(request)
+    with HTTP_REQUESTS_IN_FLIGHT.track_inprogress():
+        response = await call_next(request)
     
     process_time = time.time() - start_time
     logger.info("Request completed",
@@ -114,23 +156,17 @@ async def root():
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (serves the latest background probe results)"""
     try:
-        # Check all services
-        searxng_healthy = await searxng_service.health_check()
-        ai_healthy = await ai_service.health_check()
-        
-        services = {
-            "searxng": searxng_healthy,
-            "ai_analysis": ai_healthy,
-            "redis": searxng_service.redis_client is not None
-        }
+        probes = health_prober.status()
+        services = {name: probe["healthy"] for name, probe in probes.items()}
         
         overall_status = "healthy" if all(services.values()) else "degraded"
         
         return HealthResponse(
             status=overall_status,
             services=services,
+            probes=probes,
             version="1.0.0",
             uptime=time.time() - app_start_time
         )
@@ -139,58 +175,147 @@ async def health_check():
         logger.error("Health check failed", error=str(e))
         raise HTTPException(status_code=500, detail="Health check failed")
 
-@app.post("/search", response_model=WebSearchResponse)
-async def web_search(request: WebSearchRequest, background_tasks: BackgroundTasks):
-    """Perform web search with optional AI analysis"""
-    try:
-        start_time = datetime.now()
-        
-        logger.info("Web search request received",
-                   query=request.query,
-                   analyze_with_ai=request.analyze_with_ai)
-        
-        # Prepare search query
-        search_params = request.search_params or SearchQuery(query=request.query)
-        if search_params.query != request.query:
-            search_params.query = request.query
-        
-        # Perform search
-        search_results = await searxng_service.search(search_params)
-        
-        # Initialize response
-        response = WebSearchResponse(
+def _prepare_search_params(request: WebSearchRequest) -> SearchQuery:
+    """Build the SearXNG query for a web search request"""
+    search_params = request.search_params or SearchQuery(query=request.query)
+    if search_params.query != request.query:
+        search_params.query = request.query
+    return search_params
+
+def _semantic_namespace(request: WebSearchRequest) -> str:
+    """Get the semantic cache namespace: every request option except the query and priority"""
+    return request.model_dump_json(exclude={"query": True, "priority": True, "search_params": {"query"}})
+
+async def _warm_query(request: WebSearchRequest):
+    """Run a search and its analysis only to populate the caches"""
+    search_params = _prepare_search_params(request)
+    search_results = await searxng_service.search(search_params)
+    if request.analyze_with_ai and search_results.results:
+        await ai_service.analyze_search_results(AIAnalysisRequest(
             query=request.query,
-            search_results=search_results,
-            ai_analysis=None,
-            cached=False,  # TODO: Implement proper cache detection
-            timestamp=start_time
-        )
-        
-        # Perform AI analysis if requested
-        if request.analyze_with_ai and search_results.results:
-            try:
-                ai_request = AIAnalysisRequest(
-                    query=request.query,
-                    search_results=search_results.results,
-                    context=request.ai_context,
-                    model=request.model
+            search_results=search_results.results,
+            context=request.ai_context,
+            model=request.model,
+            priority="background"
+        ))
+
+async def _run_web_search(request: WebSearchRequest,
+                          search_slots: Optional[asyncio.Semaphore] = None,
+                          analysis_slots: Optional[asyncio.Semaphore] = None) -> WebSearchResponse:
+    """Perform web search with optional AI analysis
+    
+    search_slots and analysis_slots optionally cap how many callers sharing
+    them (e.g. the items of one batch) hit the search backends (SearXNG and
+    the embedding model) and the LLM at once.
+    """
+    start_time = datetime.now()
+    
+    logger.info("Web search request received",
+               query=request.query,
+               analyze_with_ai=request.analyze_with_ai)
+    hot_queries.record(request)
+    
+    # Prepare search query
+    search_params = _prepare_search_params(request)
+    
+    # Exact-match cache tiers first, then the response of a semantically
+    # similar earlier query (which costs an embedding), then SearXNG
+    query_vector = None
+    async with search_slots or nullcontext():
+        search_results, cache_tier = await searxng_service.cached_search(search_params)
+        if search_results is None:
+            semantic_namespace = _semantic_namespace(request)
+            similar_response, query_vector = await semantic_cache.lookup(request.query, semantic_namespace)
+            if similar_response:
+                semantic_cache.verify_in_background(
+                    request.query,
+                    similar_response.search_results,
+                    lambda: searxng_service.search(search_params)
                 )
-                
+                response = similar_response.model_copy(update={
+                    "query": request.query,
+                    "cached": True,
+                    "cache_tier": SemanticCache.TIER,
+                    "timestamp": start_time
+                })
+                history_store.record(response)
+                return response
+            
+            search_results = await searxng_service.fetch(search_params)
+    
+    # Initialize response
+    response = WebSearchResponse(
+        query=request.query,
+        search_results=search_results,
+        ai_analysis=None,
+        cached=cache_tier is not None,
+        cache_tier=cache_tier,
+        stale=search_results.stale,
+        timestamp=start_time
+    )
+    
+    # Perform AI analysis if requested
+    if request.analyze_with_ai and search_results.results:
+        try:
+            ai_request = AIAnalysisRequest(
+                query=request.query,
+                search_results=search_results.results,
+                context=request.ai_context,
+                model=request.model,
+                priority=request.priority
+            )
+            
+            async with analysis_slots or nullcontext():
                 ai_analysis = await ai_service.analyze_search_results(ai_request)
-                response.ai_analysis = ai_analysis
-                
-            except Exception as e:
-                logger.warning("AI analysis failed, returning search results only",
-                              error=str(e))
-                # Continue without AI analysis
-        
-        logger.info("Web search completed successfully",
-                   query=request.query,
-                   results_count=len(search_results.results),
-                   has_ai_analysis=response.ai_analysis is not None)
+            response.ai_analysis = ai_analysis
+            response.stale = response.stale or ai_analysis.stale
+            response.degraded = ai_analysis.confidence_score == 0
+            
+        except DependencyUnavailable as e:
+            logger.warning("AI analysis unavailable, returning search results only",
+                          error=str(e))
+            response.degraded = True
         
-        return response
+        except Exception as e:
+            logger.warning("AI analysis failed, returning search results only",
+                          error=str(e))
+            # Continue without AI analysis
+            response.degraded = True
+    
+    logger.info("Web search completed successfully",
+               query=request.query,
+               results_count=len(search_results.results),
+               cache_tier=cache_tier,
+               has_ai_analysis=response.ai_analysis is not None)
+    
+    # Degraded responses (no analysis, or a zero confidence fallback) and
+    # stale responses are about to be replaced; don't reuse those
+    if query_vector is not None and not response.stale and not response.degraded:
+        semantic_cache.store(query_vector, request.query, semantic_namespace, response)
+    
+    history_store.record(response)
+    return response
+
+def _unavailable(e: DependencyUnavailable) -> HTTPException:
+    """503 telling the client when the failing dependency is worth trying again"""
+    return HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}",
+                         headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+@app.post("/search", response_model=WebSearchResponse)
+async def web_search(request: WebSearchRequest, background_tasks: BackgroundTasks):
+    """Perform web search with optional AI analysis
+    
+    Fails fast with 503 while SearXNG is failing, and returns search
+    results only (degraded) while the LLM is.
+    """
+    try:
+        # Already validated; serialize directly instead of re-validating against response_model
+        return FastJSONResponse(await _run_web_search(request))
         
+    except DependencyUnavailable as e:
+        logger.warning("Web search unavailable", query=request.query, error=str(e))
+        raise _unavailable(e)
+    
     except Exception as e:
         logger.error("Web search failed", query=request.query, error=str(e))
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -205,29 +330,172 @@ async def simple_search(query: str, analyze: bool = True, model: str = None):
             model=model
         )
         
-        result = await web_search(request, BackgroundTasks())
+        result = await _run_web_search(request)
         
         # Return simplified response
-        return {
+        return FastJSONResponse({
             "query": result.query,
             "summary": result.ai_analysis.summary if result.ai_analysis else "Search completed",
             "key_points": result.ai_analysis.key_points if result.ai_analysis else [],
             "sources": result.ai_analysis.sources if result.ai_analysis else [r.url for r in result.search_results.results[:3]],
             "results_count": result.search_results.total_results,
             "confidence": result.ai_analysis.confidence_score if result.ai_analysis else None
-        }
+        })
         
+    except DependencyUnavailable as e:
+        logger.warning("Simple search unavailable", query=query, error=str(e))
+        raise _unavailable(e)
+    
     except Exception as e:
         logger.error("Simple search failed", query=query, error=str(e))
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+def _sse_event(event: str, data) -> str:
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/search/stream")
+async def stream_search(request: WebSearchRequest):
+    """Perform web search, streaming results and AI analysis tokens as Server-Sent Events
+    
+    Events: "search" (SearchResponse), "token" (analysis text chunk),
+    "analysis" (AIAnalysisResponse), "error" and a final "done".
+    """
+    logger.info("Streaming search request received",
+               query=request.query,
+               analyze_with_ai=request.analyze_with_ai)
+    hot_queries.record(request)
+    
+    async def event_stream():
+        try:
+            search_params = _prepare_search_params(request)
+            search_results, cache_tier = await searxng_service.search_with_cache_info(search_params)
+            
+            yield _sse_event("search", {
+                "search_results": search_results.model_dump(mode="json"),
+                "cached": cache_tier is not None,
+                "cache_tier": cache_tier
+            })
+            
+            if request.analyze_with_ai and search_results.results:
+                ai_request = AIAnalysisRequest(
+                    query=request.query,
+                    search_results=search_results.results,
+                    context=request.ai_context,
+                    model=request.model,
+                    priority=request.priority
+                )
+                
+                try:
+                    async for kind, payload in ai_service.stream_analysis(ai_request):
+                        if kind == "token":
+                            yield _sse_event("token", {"text": payload})
+                        else:
+                            yield _sse_event("analysis", payload.model_dump(mode="json"))
+                except DependencyUnavailable as e:
+                    # Degrade to the search results already sent
+                    logger.warning("AI analysis unavailable, streaming search results only",
+                                  error=str(e))
+                except PromptTooLong as e:
+                    logger.warning("AI analysis skipped", query=request.query, error=str(e))
+                    yield _sse_event("error", {"error": str(e)})
+            
+        except Exception as e:
+            logger.error("Streaming search failed", query=request.query, error=str(e))
+            yield _sse_event("error", {"error": f"Search failed: {str(e)}"})
+        
+        yield _sse_event("done", {"query": request.query})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering (nginx)
+        }
+    )
+
+@app.post("/search/batch")
+async def batch_search(request: BatchSearchRequest):
+    """Run many web searches concurrently, streaming each result as NDJSON
+    
+    Each line is {"index", "status": "ok", "result"} or {"index",
+    "status": "error", "error"}, written as soon as that search completes.
+    Identical requests in the batch run once and share their result.
+    """
+    if len(request.requests) > settings.batch_max_items:
+        raise HTTPException(status_code=400,
+                            detail=f"Batch exceeds {settings.batch_max_items} requests")
+    
+    # Group duplicate items; items without an explicit priority run as background work
+    groups = {}
+    for index, item in enumerate(request.requests):
+        if "priority" not in item.model_fields_set:
+            item = item.model_copy(update={"priority": "background"})
+        groups.setdefault(item.model_dump_json(), (item, []))[1].append(index)
+    
+    # Clients may lower the configured concurrency, not raise it
+    search_slots = asyncio.Semaphore(
+        min(request.max_search_concurrency or settings.batch_search_concurrency, settings.batch_search_concurrency)
+    )
+    analysis_slots = asyncio.Semaphore(
+        min(request.max_analysis_concurrency or settings.batch_analysis_concurrency, settings.batch_analysis_concurrency)
+    )
+    
+    logger.info("Batch search request received",
+               items=len(request.requests),
+               unique_items=len(groups))
+    
+    async def run(item: WebSearchRequest, indices):
+        try:
+            result = await _run_web_search(item, search_slots, analysis_slots)
+            return indices, {"status": "ok", "result": result.model_dump(mode="json")}
+        except Exception as e:
+            logger.warning("Batch search item failed", query=item.query, error=str(e))
+            return indices, {"status": "error", "error": f"Search failed: {str(e)}"}
+    
+    async def result_stream():
+        tasks = [asyncio.create_task(run(item, indices)) for item, indices in groups.values()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indices, outcome = await next_done
+                for index in indices:
+                    yield json.dumps({"index": index, **outcome}) + "\n"
+        finally:
+            # Client went away: stop searches nobody will read
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
 @app.get("/search/history")
-async def search_history():
-    """Get search history (placeholder for future implementation)"""
-    return {
-        "message": "Search history endpoint - to be implemented",
-        "searches": []
-    }
+async def search_history(
+    q: str = Query(default=None, description="Full-text search over past queries and summaries"),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0)
+):
+    """Get search history, newest first, or full-text search it with q"""
+    try:
+        if q:
+            history = await history_store.search(q, limit=limit, offset=offset)
+        else:
+            history = await history_store.list_searches(limit=limit, offset=offset)
+        
+        return {
+            "searches": history["searches"],
+            "total": history["total"],
+            "query": q,
+            "limit": limit,
+            "offset": offset
+        }
+        
+    except Exception as e:
+        logger.error("Search history lookup failed", q=q, error=str(e))
+        raise HTTPException(status_code=500, detail=f"History lookup failed: {str(e)}")
 
 @app.post("/analyze")
 async def analyze_results(request: AIAnalysisRequest):
@@ -241,12 +509,100 @@ async def analyze_results(request: AIAnalysisRequest):
                    query=request.query,
                    confidence=analysis.confidence_score)
         
-        return analysis
+        return FastJSONResponse(analysis)
         
+    except DependencyUnavailable as e:
+        logger.warning("Analysis unavailable", query=request.query, error=str(e))
+        raise _unavailable(e)
+    
+    except PromptTooLong as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
     except Exception as e:
         logger.error("Analysis failed", query=request.query, error=str(e))
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/performance/cache")
+async def get_cache_stats():
+    """Get search cache statistics for each cache tier"""
+    return {
+        "search_cache": {
+            **searxng_service.cache.stats(),
+            "stale_refresh": searxng_service.stale_refresher.stats()
+        },
+        "analysis_cache": {
+            **ai_service.cache.stats(),
+            "stale_refresh": ai_service.stale_refresher.stats()
+        },
+        "semantic_cache": semantic_cache.stats(),
+        "search_history": history_store.stats(),
+        "timestamp": datetime.now()
+    }
+
+@app.get("/performance/hot-queries")
+async def get_hot_queries(limit: int = Query(default=20, ge=1, le=1000)):
+    """Get the most frequent searches tracked for cache warming"""
+    return {
+        "hot_queries": hot_queries.top(limit),
+        "stats": hot_queries.stats(),
+        "timestamp": datetime.now()
+    }
+
+@app.get("/performance/coalescing")
+async def get_coalescing_stats():
+    """Get request coalescing statistics for searches and analyses"""
+    return {
+        "search": searxng_service.in_flight.stats(),
+        "analysis": ai_service.in_flight.stats(),
+        "timestamp": datetime.now()
+    }
+
+@app.get("/performance/resilience")
+async def get_resilience_stats():
+    """Get circuit breaker, adaptive timeout, retry and negative cache statistics"""
+    return {
+        "searxng": {
+            **searxng_service.policy.stats(),
+            "negative_cache": searxng_service.failures.stats()
+        },
+        "ollama": {
+            **ai_service.policy.stats(),
+            "negative_cache": ai_service.failures.stats()
+        },
+        "timestamp": datetime.now()
+    }
+
+@app.get("/performance/searxng")
+async def get_searxng_pool_stats():
+    """Get per-instance SearXNG load balancing, ejection and hedging statistics"""
+    return {
+        **searxng_service.pool.stats(),
+        "timestamp": datetime.now()
+    }
+
+@app.get("/performance/llm")
+async def get_llm_scheduler_stats():
+    """Get per-model LLM slots, queue depth, wait times and throughput"""
+    return {
+        "models": ai_service.scheduler.stats(),
+        "queue_timeouts": ai_service.scheduler.timeouts,
+        "max_queue_depth": ai_service.scheduler.max_queue_depth,
+        "timestamp": datetime.now()
+    }
+
+@app.get("/performance/models/resident")
+async def get_resident_models():
+    """Get the models loaded in Ollama, the memory budget and load/eviction counts"""
+    return {
+        **ai_service.residency.stats(),
+        "timestamp": datetime.now()
+    }
+
 @app.get("/performance/recommendations")
 async def get_model_recommendations(target: str = "balanced"):
     """Get AI model recommendations based on system specs"""
@@ -326,13 +682,14 @@ async def http_exception_handler(request, exc: HTTPException):
                 status_code=exc.status_code,
                 detail=exc.detail)
     
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=exc.status_code,
         content=ErrorResponse(
             error=f"HTTP {exc.status_code}",
             detail=exc.detail,
             timestamp=datetime.now()
-        ).model_dump()
+        ),
+        headers=exc.headers
     )
 
 @app.exception_handler(Exception)
@@ -343,13 +700,13 @@ async def general_exception_handler(request, exc: Exception):
                 error=str(exc),
                 exc_info=True)
     
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content=ErrorResponse(
             error="Internal Server Error",
             detail="An unexpected error occurred",
             timestamp=datetime.now()
-        ).model_dump()
+        )
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+from typing import Optional
+from prometheus_client import Counter, Gauge, Histogram
+
+# Sub-millisecond for the memory tier, a few milliseconds for Redis
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Local LLM generations take seconds to minutes
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+SEARXNG_LATENCY = Histogram(
+    "searxng_request_duration_seconds",
+    "Latency of SearXNG search requests"
+)
+
+SEARXNG_BACKEND_REQUESTS = Counter(
+    "searxng_backend_requests_total",
+    "Requests sent to each SearXNG backend, by outcome",
+    ["backend", "outcome"]
+)
+
+SEARXNG_HEDGES = Counter(
+    "searxng_hedged_requests_total",
+    "Hedged SearXNG requests sent, and those that beat the original",
+    ["outcome"]
+)
+
+CACHE_LOOKUP_LATENCY = Histogram(
+    "cache_lookup_duration_seconds",
+    "Latency of cache lookups across all tiers",
+    ["cache"],
+    buckets=FAST_BUCKETS
+)
+
+CACHE_HITS = Counter(
+    "cache_hits_total",
+    "Cache hits by cache and the tier that served them",
+    ["cache", "tier"]
+)
+
+CACHE_MISSES = Counter(
+    "cache_misses_total",
+    "Cache lookups that missed every tier",
+    ["cache"]
+)
+
+PROMPT_BUILD_LATENCY = Histogram(
+    "prompt_build_duration_seconds",
+    "Time to build an analysis prompt within the token budget",
+    buckets=FAST_BUCKETS
+)
+
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending a streamed completion request to its first token",
+    ["model"],
+    buckets=LLM_BUCKETS
+)
+
+LLM_GENERATION_LATENCY = Histogram(
+    "llm_generation_duration_seconds",
+    "Total duration of LLM completions (excluding queueing)",
+    ["model"],
+    buckets=LLM_BUCKETS
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Prompt and completion tokens by model",
+    ["model", "kind"]
+)
+
+LLM_REQUESTS_IN_FLIGHT = Gauge(
+    "llm_requests_in_flight",
+    "LLM completions currently generating",
+    ["model"]
+)
+
+DEPENDENCY_ERRORS = Counter(
+    "dependency_errors_total",
+    "Failed calls to external dependencies",
+    ["dependency"]
+)
+
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)",
+    ["dependency"]
+)
+
+DEPENDENCY_REJECTIONS = Counter(
+    "dependency_rejections_total",
+    "Calls failed fast without reaching a dependency",
+    ["dependency", "reason"]
+)
+
+DEPENDENCY_RETRIES = Counter(
+    "dependency_retries_total",
+    "Retries of failed dependency calls, and retries denied by the retry budget",
+    ["dependency", "outcome"]
+)
+
+RESPONSE_SERIALIZATION_LATENCY = Histogram(
+    "response_serialization_duration_seconds",
+    "Time to serialize JSON response bodies",
+    buckets=FAST_BUCKETS
+)
+
+RESPONSE_BYTES = Counter(
+    "http_response_bytes_total",
+    "Response body bytes sent, by content encoding",
+    ["encoding"]
+)
+
+LOG_RECORDS_DROPPED = Gauge(
+    "log_records_dropped",
+    "Log records dropped because the logging queue was full"
+)
+
+OLLAMA_MODEL_LOADS = Counter(
+    "ollama_model_loads_total",
+    "Models loaded into Ollama by the residency manager, by reason (preload or demand)",
+    ["model", "reason"]
+)
+
+OLLAMA_MODEL_EVICTIONS = Counter(
+    "ollama_model_evictions_total",
+    "Models unloaded from Ollama, to make room (memory) or after their keep_alive (keep_alive)",
+    ["model", "reason"]
+)
+
+OLLAMA_RESIDENT_MEMORY = Gauge(
+    "ollama_resident_model_bytes",
+    "Memory used by the models Ollama has loaded, in RAM or VRAM",
+    ["kind"]
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled"
+)
+
+def record_cache_lookup(cache: str, tier: Optional[str]):
+    """Count a cache lookup as a hit on tier, or a miss if tier is None"""
+    if tier is None:
+        CACHE_MISSES.labels(cache=cache).inc()
+    else:
+        CACHE_HITS.labels(cache=cache, tier=tier).inc()
+
+def record_tokens(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    """Add an analysis' token usage to the per-model counters"""
+    if prompt_tokens:
+        LLM_TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from dataclasses import dataclass
 import psutil
 import structlog
@@ -67,6 +67,18 @@ class ModelOptimizer:
         )
     }
     
+    @classmethod
+    def get_model_config(cls, model_name: str) -> Optional[ModelConfig]:
+        """Look up a model by exact name, or by its unquantized base name"""
+        if model_name in cls.MODELS:
+            return cls.MODELS[model_name]
+        
+        for name, config in cls.MODELS.items():
+            if name.startswith(f"{model_name}-"):
+                return config
+        
+        return None
+    
     @classmethod
     def get_system_specs(cls) -> Dict:
         """Get current system specifications"""
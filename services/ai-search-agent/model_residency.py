@@ -0,0 +1,378 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
+import structlog
+from config import settings
+from model_optimizer import ModelOptimizer
+from resilience import CLOSED, CircuitBreaker
+from singleflight import SingleFlight
+from metrics import OLLAMA_MODEL_LOADS, OLLAMA_MODEL_EVICTIONS, OLLAMA_RESIDENT_MEMORY
+
+logger = structlog.get_logger()
+
+GB = 1024 ** 3
+
+# Loaded models take more than their weights on disk (KV cache, runtime buffers)
+LOAD_OVERHEAD = 1.2
+
+# Ollama reports keep_alive < 0 ("forever") as an expiry centuries away
+PINNED_HORIZON = 365 * 86400
+
+@dataclass
+class ResidentModel:
+    """A model Ollama currently has loaded, as reported by /api/ps"""
+    name: str
+    size: int
+    size_vram: int
+    expires_at: Optional[float] = None
+
+class ModelResidencyManager:
+    """Keep the models we use loaded in Ollama without overcommitting memory
+
+    At startup the default model and the pulled models among
+    ModelOptimizer.recommend_models(ollama_preload_target) are loaded, as
+    far as they fit. Generations run inside use(model), which loads a model
+    that is not resident first, evicting the least recently used idle
+    models if its estimated footprint would not fit in RAM (after
+    ollama_memory_headroom_gb) plus VRAM, as found by get_system_specs().
+    Each model gets its own keep_alive (seconds after its last use, < 0 to
+    keep it loaded); since completions through the OpenAI-compatible API
+    reset it to Ollama's default, it is re-applied every
+    ollama_residency_interval.
+
+    Demand loads run inside a request, so they get the shorter
+    ollama_demand_load_timeout and are skipped while Ollama's breaker is
+    not closed; the memory lock is only held to make room, not while a
+    model loads.
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient, base_url: Optional[str] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.http_client = http_client
+        self.base_url = base_url or settings.ollama_base_url
+        self.breaker = breaker
+        self.enabled = settings.ollama_residency_enabled
+        self.preload_target = settings.ollama_preload_target
+        self.interval = settings.ollama_residency_interval
+        self.load_timeout = settings.ollama_load_timeout
+        self.demand_load_timeout = settings.ollama_demand_load_timeout
+        self.headroom = settings.ollama_memory_headroom_gb * GB
+
+        self.ram_bytes = 0
+        self.vram_bytes = 0
+        self.resident: Dict[str, ResidentModel] = {}
+        # Weights on disk per pulled model, from /api/tags
+        self.pulled: Dict[str, int] = {}
+        # Loaded footprint per model, as last seen in /api/ps
+        self.observed_sizes: Dict[str, int] = {}
+        self.last_used: Dict[str, float] = {}
+        self.in_use: Dict[str, int] = {}
+        # Estimated footprint of loads in progress, not yet in /api/ps
+        self.pending_loads: Dict[str, int] = {}
+
+        self._lock = asyncio.Lock()
+        self._loading = SingleFlight("model_load")
+        self._task: Optional[asyncio.Task] = None
+
+        self.preloaded: List[str] = []
+        self.loads = 0
+        self.load_failures = 0
+        self.demand_loads_skipped = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _normalize(model: str) -> str:
+        # Ollama lists untagged models under :latest
+        return model if ":" in model else f"{model}:latest"
+
+    def keep_alive_for(self, model: str) -> float:
+        """Seconds to keep a model loaded after its last use (< 0: indefinitely)"""
+        model = self._normalize(model)
+        for name, keep_alive in settings.ollama_keep_alive_overrides.items():
+            if self._normalize(name) == model:
+                return keep_alive
+        if model == self._normalize(settings.default_model):
+            return settings.default_model_keep_alive
+        return settings.ollama_keep_alive
+
+    async def start(self):
+        """Read the memory budget and start preloading and the maintenance loop"""
+        if not self.enabled:
+            return
+        specs = await asyncio.get_running_loop().run_in_executor(None, ModelOptimizer.get_system_specs)
+        self.ram_bytes = int(specs["ram_gb"] * GB)
+        self.vram_bytes = int(sum(gpu["memory_gb"] for gpu in specs["gpus"]) * GB)
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            await self.preload()
+        except Exception as e:
+            logger.warning("Model preloading failed", error=str(e))
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.warning("Model residency refresh failed", error=str(e))
+
+    async def preload(self):
+        """Load the default model, then the recommended models that fit without evicting"""
+        await self.refresh_pulled()
+        candidates = [(self._normalize(settings.default_model), True)]
+        if self.preload_target:
+            loop = asyncio.get_running_loop()
+            recommended = await loop.run_in_executor(None, ModelOptimizer.recommend_models, self.preload_target)
+            for config in recommended:
+                # Recommendations name quantizations; match the pulled tags they describe
+                for name in self.pulled:
+                    if name not in dict(candidates) and ModelOptimizer.get_model_config(name) is config:
+                        candidates.append((name, False))
+
+        for model, evict in candidates:
+            if model not in self.pulled:
+                logger.info("Skipping preload of model that is not pulled", model=model)
+                continue
+            if await self._load(model, "preload", evict=evict):
+                self.preloaded.append(model)
+
+    @asynccontextmanager
+    async def use(self, model: str) -> AsyncIterator[None]:
+        """Make sure model is loaded for a generation, and protect it from eviction meanwhile
+
+        Loading problems are logged, not raised: the generation itself will
+        load the model (or fail) as it would without residency management.
+        """
+        model = self._normalize(model)
+        self.in_use[model] = self.in_use.get(model, 0) + 1
+        try:
+            if self.enabled and model not in self.resident:
+                if self.breaker is not None and self.breaker.state != CLOSED:
+                    # Ollama is failing; leave it to the generation, which the breaker guards
+                    self.demand_loads_skipped += 1
+                else:
+                    try:
+                        await self._loading.do(
+                            model, lambda: self._load(model, "demand", timeout=self.demand_load_timeout)
+                        )
+                    except Exception as e:
+                        logger.warning("Model load failed", model=model, error=str(e))
+            yield
+        finally:
+            self.in_use[model] -= 1
+            if not self.in_use[model]:
+                del self.in_use[model]
+            self.last_used[model] = time.monotonic()
+
+    async def _load(self, model: str, reason: str, evict: bool = True,
+                    timeout: Optional[float] = None) -> bool:
+        """Load model with its keep_alive, first making room for it
+
+        Returns False if it was not loaded because it would not fit and
+        evict is False. Only making room holds the lock; while the model
+        loads its estimated footprint is reserved in pending_loads.
+        """
+        async with self._lock:
+            await self.refresh()
+            if model in self.resident:
+                return True
+            if model not in self.pulled:
+                await self.refresh_pulled()
+
+            needed = self._estimate(model)
+            if not await self._make_room(model, needed, evict):
+                if not evict:
+                    logger.info("Not preloading model that does not fit in memory",
+                               model=model, needed_gb=needed / GB)
+                    return False
+                logger.warning("Loading model that may not fit in memory",
+                              model=model, needed_gb=needed / GB)
+            self.pending_loads[model] = needed
+
+        start = time.perf_counter()
+        try:
+            await self._generate(model, self.keep_alive_for(model), timeout or self.load_timeout)
+        except Exception:
+            self.load_failures += 1
+            raise
+        finally:
+            self.pending_loads.pop(model, None)
+        self.loads += 1
+        self.last_used[model] = time.monotonic()
+        OLLAMA_MODEL_LOADS.labels(model=model, reason=reason).inc()
+
+        async with self._lock:
+            await self.refresh()
+        if model in self.resident:
+            self.observed_sizes[model] = self.resident[model].size
+        logger.info("Loaded model", model=model, reason=reason,
+                   load_time=time.perf_counter() - start,
+                   size_gb=self.observed_sizes.get(model, needed) / GB)
+        return True
+
+    def _estimate(self, model: str) -> int:
+        """Estimated loaded footprint of model in bytes (0 if unknown)"""
+        if model in self.observed_sizes:
+            return self.observed_sizes[model]
+        if model in self.pulled:
+            return int(self.pulled[model] * LOAD_OVERHEAD)
+        config = ModelOptimizer.get_model_config(model.removesuffix(":latest"))
+        return int(config.size_gb * GB * LOAD_OVERHEAD) if config else 0
+
+    def _fits(self, needed: int) -> bool:
+        """Whether needed more bytes fit, in free VRAM first and then RAM, without swapping"""
+        needed += sum(self.pending_loads.values())
+        used_vram = sum(m.size_vram for m in self.resident.values())
+        used_ram = sum(m.size - m.size_vram for m in self.resident.values())
+        ram_needed = needed - max(0, min(needed, self.vram_bytes - used_vram))
+        return used_ram + ram_needed <= self.ram_bytes - self.headroom
+
+    async def _make_room(self, model: str, needed: int, evict: bool) -> bool:
+        """Evict least recently used idle models until needed bytes fit
+
+        Models kept loaded indefinitely go last. Returns whether it fits.
+        """
+        while not self._fits(needed):
+            idle = [name for name in self.resident if name != model and not self.in_use.get(name)]
+            if not evict or not idle:
+                return False
+            victim = min(idle, key=lambda name: (self.keep_alive_for(name) < 0, self.last_used.get(name, 0.0)))
+            await self._unload(victim)
+            self.evictions += 1
+            OLLAMA_MODEL_EVICTIONS.labels(model=victim, reason="memory").inc()
+            logger.info("Evicted model to make room", model=victim, for_model=model)
+        return True
+
+    async def _unload(self, model: str):
+        await self._generate(model, 0, settings.health_probe_timeout)
+        self.resident.pop(model, None)
+
+    async def _generate(self, model: str, keep_alive: float, timeout: float):
+        """An empty generate request: loads model (or unloads it with keep_alive 0) and sets its keep_alive"""
+        response = await self.http_client.post(
+            f"{self.base_url}/api/generate",
+            # Whole seconds, rounded up so a short remaining keep_alive does not become 0 (unload)
+            json={"model": model, "keep_alive": math.ceil(keep_alive)},
+            timeout=httpx.Timeout(timeout)
+        )
+        response.raise_for_status()
+
+    async def refresh(self):
+        """Re-read which models Ollama has loaded"""
+        response = await self.http_client.get(
+            f"{self.base_url}/api/ps",
+            timeout=httpx.Timeout(settings.health_probe_timeout)
+        )
+        response.raise_for_status()
+        resident = {}
+        for entry in response.json().get("models", []):
+            name = entry.get("name") or entry.get("model")
+            resident[name] = ResidentModel(
+                name=name,
+                size=entry.get("size", 0),
+                size_vram=entry.get("size_vram", 0),
+                expires_at=_parse_time(entry.get("expires_at"))
+            )
+        self.resident = resident
+        OLLAMA_RESIDENT_MEMORY.labels(kind="vram").set(sum(m.size_vram for m in resident.values()))
+        OLLAMA_RESIDENT_MEMORY.labels(kind="ram").set(sum(m.size - m.size_vram for m in resident.values()))
+
+    async def refresh_pulled(self):
+        """Re-read which models are pulled, and their size on disk"""
+        response = await self.http_client.get(
+            f"{self.base_url}/api/tags",
+            timeout=httpx.Timeout(settings.health_probe_timeout)
+        )
+        response.raise_for_status()
+        self.pulled = {
+            entry.get("name") or entry.get("model"): entry.get("size", 0)
+            for entry in response.json().get("models", [])
+        }
+
+    async def maintain(self):
+        """Re-apply each model's keep_alive, unloading models idle for longer than it
+
+        Only models this manager loaded or saw used are managed; anything
+        else loaded in Ollama is left to Ollama's own keep_alive.
+        """
+        async with self._lock:
+            await self.refresh()
+            now, wall_now = time.monotonic(), time.time()
+            for name, model in list(self.resident.items()):
+                if name not in self.last_used or self.in_use.get(name):
+                    continue
+                keep_alive = self.keep_alive_for(name)
+                if keep_alive < 0:
+                    if model.expires_at is not None and model.expires_at - wall_now < PINNED_HORIZON:
+                        await self._generate(name, keep_alive, settings.health_probe_timeout)
+                    continue
+
+                remaining = self.last_used[name] + keep_alive - now
+                if remaining <= 0:
+                    await self._unload(name)
+                    self.expirations += 1
+                    OLLAMA_MODEL_EVICTIONS.labels(model=name, reason="keep_alive").inc()
+                    logger.info("Unloaded idle model", model=name, keep_alive=keep_alive)
+                elif model.expires_at is None or abs(model.expires_at - (wall_now + remaining)) > self.interval:
+                    await self._generate(name, remaining, settings.health_probe_timeout)
+
+    def stats(self) -> Dict:
+        """Get resident models, the memory budget and load/eviction counts"""
+        now, wall_now = time.monotonic(), time.time()
+        return {
+            "enabled": self.enabled,
+            "models": [
+                {
+                    "name": model.name,
+                    "size_gb": model.size / GB,
+                    "vram_gb": model.size_vram / GB,
+                    "expires_in": max(0.0, model.expires_at - wall_now) if model.expires_at is not None else None,
+                    "idle_seconds": now - self.last_used[model.name] if model.name in self.last_used else None,
+                    "in_use": self.in_use.get(model.name, 0),
+                    "keep_alive": self.keep_alive_for(model.name)
+                }
+                for model in self.resident.values()
+            ],
+            "memory": {
+                "ram_gb": self.ram_bytes / GB,
+                "vram_gb": self.vram_bytes / GB,
+                "headroom_gb": self.headroom / GB,
+                "resident_ram_gb": sum(m.size - m.size_vram for m in self.resident.values()) / GB,
+                "resident_vram_gb": sum(m.size_vram for m in self.resident.values()) / GB
+            },
+            "preloaded": self.preloaded,
+            "loads": self.loads,
+            "load_failures": self.load_failures,
+            "pending_loads": list(self.pending_loads),
+            "demand_loads_skipped": self.demand_loads_skipped,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    async def close(self):
+        """Stop preloading and the maintenance loop (loaded models stay loaded)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Parse an Ollama timestamp (RFC 3339, possibly with nanoseconds) to a Unix time"""
+    if not value:
+        return None
+    try:
+        head, dot, rest = value.partition(".")
+        if dot:
+            digits = len(rest) - len(rest.lstrip("0123456789"))
+            value = f"{head}.{rest[:min(digits, 6)]}{rest[digits:]}"
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from datetime import datetime
 
 class SearchQuery(BaseModel):
@@ -15,7 +15,9 @@ class SearchResult(BaseModel):
     url: str
     content: str
     engine: str
+    engines: List[str] = Field(default_factory=list, description="All engines that returned this result")
     score: Optional[float] = None
+    relevance_score: Optional[float] = Field(default=None, description="Local rerank score blending BM25 and engine score")
     published_date: Optional[datetime] = None
 
 class SearchResponse(BaseModel):
@@ -24,12 +26,14 @@ class SearchResponse(BaseModel):
     total_results: int
     search_time: float
     engines_used: List[str]
+    stale: bool = Field(default=False, description="Served from an expired cache entry while it is refreshed")
 
 class AIAnalysisRequest(BaseModel):
     query: str
     search_results: List[SearchResult]
     context: Optional[str] = None
     model: Optional[str] = None
+    priority: Literal["interactive", "background"] = Field(default="interactive", description="LLM scheduling priority class")
 
 class AIAnalysisResponse(BaseModel):
     query: str
@@ -39,6 +43,10 @@ class AIAnalysisResponse(BaseModel):
     confidence_score: float
     model_used: str
     analysis_time: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cache_tier: Optional[str] = None
+    stale: bool = Field(default=False, description="Served from an expired cache entry while it is refreshed")
 
 class WebSearchRequest(BaseModel):
     query: str
@@ -46,17 +54,33 @@ class WebSearchRequest(BaseModel):
     search_params: Optional[SearchQuery] = None
     ai_context: Optional[str] = None
     model: Optional[str] = None
+    priority: Literal["interactive", "background"] = Field(default="interactive", description="LLM scheduling priority class")
+
+class BatchSearchRequest(BaseModel):
+    requests: List[WebSearchRequest] = Field(..., min_length=1, description="Searches to run; identical entries run once")
+    max_search_concurrency: Optional[int] = Field(default=None, ge=1, description="Concurrent searches for this batch, at most batch_search_concurrency")
+    max_analysis_concurrency: Optional[int] = Field(default=None, ge=1, description="Concurrent AI analyses for this batch, at most batch_analysis_concurrency")
 
 class WebSearchResponse(BaseModel):
     query: str
     search_results: SearchResponse
     ai_analysis: Optional[AIAnalysisResponse] = None
     cached: bool = False
+    cache_tier: Optional[str] = None
+    stale: bool = False
+    degraded: bool = Field(default=False, description="AI analysis was requested but skipped or failed")
     timestamp: datetime
 
+class ProbeStatus(BaseModel):
+    healthy: bool
+    latency_ms: float = Field(..., description="Duration of the latest probe")
+    age_seconds: float = Field(..., description="Time since the latest probe")
+    error: Optional[str] = None
+
 class HealthResponse(BaseModel):
     status: str
     services: Dict[str, bool]
+    probes: Dict[str, ProbeStatus] = Field(default_factory=dict)
     version: str
     uptime: float
 
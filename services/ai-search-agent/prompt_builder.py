@@ -0,0 +1,197 @@
+import math
+import re
+from dataclasses import dataclass
+from typing import List, Set
+import structlog
+from config import settings
+from models import AIAnalysisRequest, SearchResult
+from model_optimizer import ModelOptimizer
+
+logger = structlog.get_logger()
+
+ANALYSIS_SYSTEM_PROMPT = """You are an expert research analyst. Your task is to analyze web search results and provide comprehensive, accurate summaries.
+
+Key requirements:
+1. Provide a clear, concise summary of the main findings
+2. Extract 3-5 key points from the search results
+3. List the most relevant sources
+4. Assign a confidence score (0.0-1.0) based on source quality and consistency
+5. Be objective and factual
+6. If information is conflicting, mention the discrepancies
+7. Format your response as valid JSON with the required fields"""
+
+PROMPT_HEADER = """
+Please analyze the following search results for the query: "{query}"
+{context_addition}
+Search Results:
+"""
+
+PROMPT_FOOTER = """
+
+Please provide a comprehensive analysis in the following JSON format:
+{
+    "summary": "A 2-3 sentence summary of the main findings",
+    "key_points": ["Point 1", "Point 2", "Point 3", "Point 4", "Point 5"],
+    "sources": ["URL1", "URL2", "URL3"],
+    "confidence_score": 0.8
+}
+
+Requirements:
+- Summary should be factual and comprehensive
+- Key points should be the most important insights from the search results
+- Sources should be the 3 most relevant URLs
+- Confidence score should reflect the quality and consistency of information (0.0-1.0)
+- If information is conflicting or unclear, lower the confidence score
+- Only include information that is actually present in the search results
+"""
+
+# Tokens reserved for chat template overhead and estimation error
+TOKEN_SAFETY_MARGIN = 64
+
+# Smallest useful result block (title, URL and a little content)
+MIN_RESULT_TOKENS = 48
+
+# Smallest completion that can hold the analysis JSON
+MIN_COMPLETION_TOKENS = 256
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+@dataclass
+class BuiltPrompt:
+    """An analysis prompt sized to a model's context window"""
+    text: str
+    estimated_tokens: int
+    max_completion_tokens: int
+    context_window: int
+    results_included: int
+    results_dropped: int
+
+class PromptTooLong(ValueError):
+    """The query and context alone do not fit the model's context window"""
+
+class PromptBuilder:
+    """Build analysis prompts that fit a per-model token budget
+
+    Results are added in relevance order until the budget left after the
+    system prompt, template and reserved completion tokens is used up.
+    Snippets that mostly repeat an already included one are skipped.
+    """
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Estimate the token count of text (about 4 characters per token)"""
+        return math.ceil(len(text) / settings.prompt_chars_per_token)
+
+    def get_context_window(self, model: str) -> int:
+        """Get the context window Ollama runs a model with
+
+        Completions go through the OpenAI-compatible API, which cannot set
+        num_ctx, so Ollama uses its server default (OLLAMA_CONTEXT_LENGTH,
+        mirrored by llm_default_num_ctx), capped by what the model supports.
+        """
+        model_config = ModelOptimizer.get_model_config(model)
+        if model_config:
+            return min(model_config.max_context, settings.llm_default_num_ctx)
+        return settings.llm_default_num_ctx
+
+    def build(self, request: AIAnalysisRequest, model: str) -> BuiltPrompt:
+        """Build the analysis prompt for a request within the model's budget
+
+        Raises PromptTooLong if the query and context leave no room for a
+        completion plus at least one result; the completion is shortened if
+        they only leave room for a shorter one.
+        """
+        context_window = self.get_context_window(model)
+
+        context_addition = ""
+        if request.context:
+            context_addition = f"\nAdditional context: {request.context}\n"
+        header = PROMPT_HEADER.format(query=request.query, context_addition=context_addition)
+
+        fixed_tokens = (
+            self.estimate_tokens(ANALYSIS_SYSTEM_PROMPT)
+            + self.estimate_tokens(header)
+            + self.estimate_tokens(PROMPT_FOOTER)
+            + TOKEN_SAFETY_MARGIN
+        )
+        available = context_window - fixed_tokens
+        # The completion may not eat the room needed for at least one result
+        completion_room = available - MIN_RESULT_TOKENS
+        if completion_room < MIN_COMPLETION_TOKENS:
+            raise PromptTooLong(
+                f"Query and context need about {fixed_tokens} tokens, too many for "
+                f"the {context_window}-token context window of {model}"
+            )
+        max_completion_tokens = min(settings.llm_max_tokens, context_window // 2, completion_room)
+        budget = available - max_completion_tokens
+
+        blocks: List[str] = []
+        seen_terms: List[Set[str]] = []
+        used_tokens = 0
+        candidates = self._order_by_relevance(request.search_results)[:settings.prompt_max_results]
+
+        for result in candidates:
+            remaining = budget - used_tokens
+            if remaining < MIN_RESULT_TOKENS:
+                break
+
+            terms = set(_WORD_PATTERN.findall(result.content.lower()))
+            if self._is_redundant(terms, seen_terms):
+                continue
+
+            block = self._format_result(len(blocks) + 1, result, settings.prompt_snippet_chars)
+            block_tokens = self.estimate_tokens(block)
+            if block_tokens > remaining:
+                # Shrink the snippet to whatever budget is left
+                overflow_chars = (block_tokens - remaining) * settings.prompt_chars_per_token
+                snippet_chars = min(len(result.content), settings.prompt_snippet_chars) - overflow_chars
+                if snippet_chars <= 0:
+                    break
+                block = self._format_result(len(blocks) + 1, result, snippet_chars)
+                block_tokens = self.estimate_tokens(block)
+
+            blocks.append(block)
+            seen_terms.append(terms)
+            used_tokens += block_tokens
+
+        text = header + "".join(blocks) + PROMPT_FOOTER
+        estimated_tokens = self.estimate_tokens(ANALYSIS_SYSTEM_PROMPT) + self.estimate_tokens(text)
+
+        return BuiltPrompt(
+            text=text,
+            estimated_tokens=estimated_tokens,
+            max_completion_tokens=max_completion_tokens,
+            context_window=context_window,
+            results_included=len(blocks),
+            results_dropped=len(request.search_results) - len(blocks)
+        )
+
+    @staticmethod
+    def _order_by_relevance(results: List[SearchResult]) -> List[SearchResult]:
+        """Order results by rerank score, else engine score, keeping the original order for ties"""
+        if any(result.relevance_score is not None for result in results):
+            return sorted(results, key=lambda result: -(result.relevance_score or 0.0))
+        if any(result.score is not None for result in results):
+            return sorted(results, key=lambda result: -(result.score or 0.0))
+        return list(results)
+
+    @staticmethod
+    def _is_redundant(terms: Set[str], seen_terms: List[Set[str]]) -> bool:
+        """Whether a snippet's terms mostly overlap an already included snippet"""
+        if not terms:
+            return False
+        for seen in seen_terms:
+            union = len(terms | seen)
+            if union and len(terms & seen) / union >= settings.prompt_redundancy_threshold:
+                return True
+        return False
+
+    @staticmethod
+    def _format_result(index: int, result: SearchResult, snippet_chars: int) -> str:
+        return (
+            f"\n--- Result {index} ---\n"
+            f"Title: {result.title}\n"
+            f"URL: {result.url}\n"
+            f"Content: {result.content[:snippet_chars]}...\n"
+            f"Engine: {result.engine}\n"
+        )
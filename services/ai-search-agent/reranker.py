@@ -0,0 +1,82 @@
+import re
+from collections import Counter
+from typing import List
+import numpy as np
+import structlog
+from config import settings
+from models import SearchResult
+
+logger = structlog.get_logger()
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+class BM25Reranker:
+    """Rerank search results locally with BM25 over title and snippet
+
+    Token counts and document lengths are computed once per result set;
+    scoring is a handful of vectorized NumPy operations over a
+    (documents x query terms) frequency matrix. The normalized BM25 score is
+    blended with the normalized engine score from SearXNG.
+    """
+
+    def __init__(self):
+        self.k1 = settings.rerank_bm25_k1
+        self.b = settings.rerank_bm25_b
+        self.bm25_weight = settings.rerank_bm25_weight
+        self.title_weight = settings.rerank_title_weight
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return _WORD_PATTERN.findall(text.lower())
+
+    def score(self, query: str, results: List[SearchResult]) -> np.ndarray:
+        """BM25 score of each result for the query"""
+        query_terms = list(dict.fromkeys(self.tokenize(query)))
+        if not query_terms or not results:
+            return np.zeros(len(results))
+
+        # Precompute per-document token statistics (title tokens weighted up)
+        term_frequencies = np.zeros((len(results), len(query_terms)), dtype=np.float64)
+        doc_lengths = np.zeros(len(results), dtype=np.float64)
+        for row, result in enumerate(results):
+            counts = Counter(self.tokenize(result.content))
+            title_tokens = self.tokenize(result.title)
+            for token in title_tokens:
+                counts[token] += self.title_weight
+            doc_lengths[row] = sum(counts.values())
+            term_frequencies[row] = [counts.get(term, 0) for term in query_terms]
+
+        doc_count = len(results)
+        document_frequency = (term_frequencies > 0).sum(axis=0)
+        idf = np.log1p((doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        avg_length = doc_lengths.mean() or 1.0
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+        saturated = term_frequencies * (self.k1 + 1) / (term_frequencies + length_norm[:, None])
+
+        return saturated @ idf
+
+    def rerank(self, query: str, results: List[SearchResult]) -> List[SearchResult]:
+        """Return results ordered by blended BM25 and engine relevance"""
+        if len(results) < 2:
+            return results
+
+        bm25 = self.score(query, results)
+        engine_scores = np.array([result.score or 0.0 for result in results], dtype=np.float64)
+
+        blended = (
+            self.bm25_weight * self._normalize(bm25)
+            + (1 - self.bm25_weight) * self._normalize(engine_scores)
+        )
+
+        # Stable sort keeps SearXNG's order among equally relevant results
+        order = np.argsort(-blended, kind="stable")
+        return [
+            results[index].model_copy(update={"relevance_score": round(float(blended[index]), 4)})
+            for index in order
+        ]
+
+    @staticmethod
+    def _normalize(scores: np.ndarray) -> np.ndarray:
+        top = scores.max()
+        return scores / top if top > 0 else np.zeros_like(scores)
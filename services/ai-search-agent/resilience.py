@@ -0,0 +1,407 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+import numpy as np
+import structlog
+from config import settings
+from metrics import CIRCUIT_BREAKER_STATE, DEPENDENCY_REJECTIONS, DEPENDENCY_RETRIES
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class DependencyUnavailable(Exception):
+    """Raised instead of calling a dependency that is known to be failing"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpen(DependencyUnavailable):
+    """Raised when a dependency's circuit breaker rejects a call"""
+
+class Admission:
+    """A call let through by CircuitBreaker.guard()
+
+    Set counted to False to leave the call's outcome out of the breaker's
+    statistics, e.g. when the caller itself cut the call short.
+    """
+    __slots__ = ("counted",)
+
+    def __init__(self):
+        self.counted = True
+
+class CircuitBreaker:
+    """Stop calling a dependency while most recent calls to it fail
+
+    The breaker opens when at least breaker_failure_threshold of the calls
+    made in the last breaker_window_seconds failed (once there have been
+    breaker_min_calls of them).
+    While open every call is rejected with CircuitOpen. After
+    breaker_open_seconds it lets breaker_half_open_max_calls calls through
+    as probes: a successful probe closes it, a failed one reopens it.
+    """
+
+    def __init__(self, name: str, is_failure: Callable[[Exception], bool] = lambda e: True):
+        self.name = name
+        self.is_failure = is_failure
+        self.failure_threshold = settings.breaker_failure_threshold
+        self.min_calls = settings.breaker_min_calls
+        self.open_seconds = settings.breaker_open_seconds
+        self.half_open_max_calls = settings.breaker_half_open_max_calls
+
+        self.window = settings.breaker_window_seconds
+        # Per-second [second, calls, failures] buckets covering the window
+        self._buckets: Deque[List[int]] = deque()
+        self._calls = 0
+        self._failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+
+        self.opened = 0
+        self.rejected = 0
+        CIRCUIT_BREAKER_STATE.labels(dependency=name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        logger.warning("Circuit breaker state changed", dependency=self.name,
+                       old_state=self._state, new_state=state)
+        self._state = state
+        self._probes = 0
+        if state == OPEN:
+            self.opened += 1
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._buckets.clear()
+            self._calls = 0
+            self._failures = 0
+        CIRCUIT_BREAKER_STATE.labels(dependency=self.name).set(STATE_VALUES[state])
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker next lets a probe through"""
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through (does not admit one)"""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_max_calls)
+
+    def check(self):
+        """Raise CircuitOpen if a call would currently be rejected"""
+        if not self.available():
+            self.rejected += 1
+            DEPENDENCY_REJECTIONS.labels(dependency=self.name, reason="circuit_open").inc()
+            raise CircuitOpen(f"{self.name} circuit breaker is open",
+                              retry_after=self.retry_after() or self.open_seconds)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[Admission]:
+        """Admit one call and record its outcome
+
+        Exceptions for which is_failure returns False (e.g. 4xx responses)
+        count as successes: the dependency answered. Cancelled calls, and
+        failed calls whose Admission was marked not counted, are not
+        counted at all.
+        """
+        self.check()
+        probe = self._state == HALF_OPEN
+        if probe:
+            self._probes += 1
+        admission = Admission()
+        try:
+            yield admission
+        except Exception as e:
+            if admission.counted:
+                self._record(not self.is_failure(e), probe)
+            elif probe:
+                self._probes = max(0, self._probes - 1)
+            raise
+        except BaseException:
+            if probe:
+                self._probes = max(0, self._probes - 1)
+            raise
+        else:
+            self._record(True, probe)
+
+    def _record(self, success: bool, probe: bool):
+        if probe:
+            self._probes = max(0, self._probes - 1)
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED if success else OPEN)
+            return
+        if self._state != CLOSED:
+            # Admitted before the breaker opened; only probes decide now
+            return
+
+        now = self._prune()
+        if not self._buckets or self._buckets[-1][0] != now:
+            self._buckets.append([now, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        self._calls += 1
+        if not success:
+            bucket[2] += 1
+            self._failures += 1
+            if self._calls >= self.min_calls and self._failures / self._calls >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def _prune(self) -> int:
+        """Drop buckets that fell out of the window and return the current second"""
+        now = int(time.monotonic())
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            _, calls, failures = self._buckets.popleft()
+            self._calls -= calls
+            self._failures -= failures
+        return now
+
+    def stats(self) -> Dict:
+        """Get breaker state and counts"""
+        self._prune()
+        return {
+            "state": self.state,
+            "recent_calls": self._calls,
+            "recent_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after()
+        }
+
+class AdaptiveTimeout:
+    """Per-key timeouts derived from recently observed latencies
+
+    Latencies are recorded per unit of work (e.g. per generated token), and
+    a call expected to do scale units gets adaptive_timeout_multiplier times
+    the adaptive_timeout_percentile of the recent per-unit latencies for
+    its key, times scale, clamped to [floor, ceiling]. Until
+    adaptive_timeout_min_samples latencies have been seen, the ceiling (the
+    configured static timeout) is used.
+    """
+
+    RECOMPUTE_EVERY = 20
+
+    def __init__(self, floor: float, ceiling: float, percentile: Optional[float] = None,
+                 multiplier: Optional[float] = None):
+        self.floor = min(floor, ceiling)
+        self.ceiling = ceiling
+        self.percentile = percentile if percentile is not None else settings.adaptive_timeout_percentile
+        self.multiplier = multiplier if multiplier is not None else settings.adaptive_timeout_multiplier
+        self.min_samples = settings.adaptive_timeout_min_samples
+        # key -> (per-unit latencies, timeout per unit or None, observations since recompute)
+        self._keys: Dict[str, list] = {}
+
+    def get(self, key: str = "", scale: float = 1.0) -> float:
+        entry = self._keys.get(key)
+        if entry is None or entry[1] is None:
+            return self.ceiling
+        return min(self.ceiling, max(self.floor, entry[1] * scale))
+
+    def observe(self, key: str, seconds: float, units: float = 1.0):
+        """Record the latency of a call that did units of work
+
+        Timed out calls can be recorded with their timeout, a lower bound
+        of their latency, so timeouts that are too short correct themselves.
+        """
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [deque(maxlen=500), None, 0]
+        latencies = entry[0]
+        latencies.append(seconds / max(units, 1.0))
+        entry[2] += 1
+        if len(latencies) >= self.min_samples and entry[2] >= self.RECOMPUTE_EVERY:
+            entry[2] = 0
+            entry[1] = float(np.percentile(latencies, self.percentile)) * self.multiplier
+
+    def stats(self) -> Dict:
+        """Get the current timeout per unit of work and sample count per key"""
+        return {
+            key or "default": {"timeout_per_unit": entry[1], "samples": len(entry[0])}
+            for key, entry in self._keys.items()
+        }
+
+class RetryBudget:
+    """Limit retries to a fraction of recent calls
+
+    Each call deposits retry_budget_ratio tokens and each retry spends a
+    whole one, so retries can add at most that fraction of extra load to a
+    struggling dependency. retry_budget_min_per_second tokens also trickle
+    in so retries still work at low traffic. The balance is capped to
+    bound retry bursts.
+    """
+
+    def __init__(self):
+        self.ratio = settings.retry_budget_ratio
+        self.min_per_second = settings.retry_budget_min_per_second
+        self.cap = max(1.0, 10 * self.min_per_second)
+        self._tokens = self.cap
+        self._last_refill = time.monotonic()
+
+    def deposit(self):
+        self._refill()
+        self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.cap, self._tokens + (now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+
+class NegativeCache:
+    """Remember recently failed requests so repeats fail fast
+
+    A key that failed is rejected with DependencyUnavailable for
+    negative_cache_ttl seconds instead of being sent to the dependency
+    again. Least recently stored keys are dropped beyond max_entries.
+    """
+
+    def __init__(self, name: str, ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl if ttl is not None else settings.negative_cache_ttl
+        self.max_entries = settings.negative_cache_max_entries
+        # key -> (expires at, error message)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self.stored = 0
+        self.hits = 0
+
+    def add(self, key: str, error: Exception):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, str(error))
+        self._entries.move_to_end(key)
+        self.stored += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def check(self, key: str):
+        """Raise DependencyUnavailable if key failed within the TTL"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        remaining = entry[0] - time.monotonic()
+        if remaining <= 0:
+            del self._entries[key]
+            return
+        self.hits += 1
+        DEPENDENCY_REJECTIONS.labels(dependency=self.name, reason="negative_cache").inc()
+        raise DependencyUnavailable(f"Recently failed: {entry[1]}", retry_after=remaining)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "stored": self.stored, "hits": self.hits, "ttl": self.ttl}
+
+class DependencyPolicy:
+    """Circuit breaker, adaptive timeouts and budgeted retries for one dependency
+
+    call() runs fn(timeout) through the breaker. Failures for which
+    is_retryable returns True are retried up to retry_max_attempts times
+    with full-jitter exponential backoff, as long as the retry budget
+    allows it; the breaker sees the outcome after retries. A timeout
+    (is_timeout) shorter than the ceiling was chosen by the adaptive
+    timeout, not by the dependency failing, so it is not held against the
+    breaker; such errors are marked, see cut_short().
+    """
+
+    def __init__(self, name: str, timeout_floor: float, timeout_ceiling: float,
+                 is_failure: Callable[[Exception], bool] = lambda e: True,
+                 is_retryable: Callable[[Exception], bool] = lambda e: False,
+                 is_timeout: Callable[[Exception], bool] = lambda e: False):
+        self.name = name
+        self.breaker = CircuitBreaker(name, is_failure)
+        self.timeouts = AdaptiveTimeout(timeout_floor, timeout_ceiling)
+        self.budget = RetryBudget()
+        self.is_retryable = is_retryable
+        self.is_timeout = is_timeout
+        self.max_attempts = settings.retry_max_attempts
+        self.backoff_base = settings.retry_backoff_base
+        self.backoff_max = settings.retry_backoff_max
+
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.timeouts_cut_short = 0
+
+    async def call(self, fn: Callable[[float], Awaitable[T]], key: str = "", scale: float = 1.0,
+                   units: Optional[Callable[[T], float]] = None) -> T:
+        """Call fn(timeout) with retries, for a call expected to do scale units of work
+
+        units(result) gives the work a successful call actually did
+        (default: scale), which the adaptive timeout learns from.
+        """
+        self.budget.deposit()
+        async with self.breaker.guard() as admission:
+            attempt = 1
+            while True:
+                timeout = self.timeouts.get(key, scale)
+                admission.counted = True
+                start = time.perf_counter()
+                try:
+                    result = await fn(timeout)
+                except Exception as e:
+                    if self.is_timeout(e):
+                        self.record_timeout(admission, e, key, timeout, scale)
+                    if attempt >= self.max_attempts or not self.is_retryable(e):
+                        raise
+                    if not self.budget.try_spend():
+                        self.budget_exhausted += 1
+                        DEPENDENCY_RETRIES.labels(dependency=self.name, outcome="budget_exhausted").inc()
+                        raise
+                    self.retries += 1
+                    DEPENDENCY_RETRIES.labels(dependency=self.name, outcome="retried").inc()
+                    backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                    logger.info("Retrying dependency call", dependency=self.name, attempt=attempt,
+                                backoff=round(backoff, 3), error=str(e))
+                    await asyncio.sleep(backoff)
+                    attempt += 1
+                    continue
+
+                self.timeouts.observe(key, time.perf_counter() - start, units(result) if units else scale)
+                return result
+
+    def record_timeout(self, admission: Admission, error: Exception, key: str, timeout: float, scale: float):
+        """Learn from a call that timed out after timeout seconds
+
+        If the adaptive timeout was below the ceiling, the call is left out
+        of the breaker and error is marked as cut short.
+        """
+        self.timeouts.observe(key, timeout, scale)
+        if timeout < self.timeouts.ceiling:
+            admission.counted = False
+            error.cut_short = True
+            self.timeouts_cut_short += 1
+
+    @staticmethod
+    def cut_short(error: Exception) -> bool:
+        """Whether error is a timeout chosen by the adaptive timeout rather than the ceiling"""
+        return getattr(error, "cut_short", False)
+
+    def stats(self) -> Dict:
+        """Get breaker, timeout and retry statistics"""
+        return {
+            "breaker": self.breaker.stats(),
+            "timeouts": self.timeouts.stats(),
+            "timeouts_cut_short": self.timeouts_cut_short,
+            "retries": self.retries,
+            "retry_budget_exhausted": self.budget_exhausted
+        }
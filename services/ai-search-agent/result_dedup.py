@@ -0,0 +1,187 @@
+import re
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import numpy as np
+import structlog
+from config import settings
+from models import SearchResult
+
+logger = structlog.get_logger()
+
+# Query parameters that only track the click and never change the page
+# (not "ref", which selects e.g. a branch on GitHub)
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "ref_src", "ref_url", "referrer", "_ga", "_gl", "spm", "cmpid", "icid"
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "hsa_", "oly_")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+_UINT32_MASK = (1 << 32) - 1
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+class ResultDeduplicator:
+    """Collapse duplicate and near-duplicate search results
+
+    Results are grouped first by canonical URL (tracking parameters, www.,
+    default ports, fragments and trailing slashes removed), then by MinHash
+    estimates of the Jaccard similarity of their content shingles, so
+    syndicated copies of the same article collapse too. (MinHash rather
+    than SimHash: snippets are only a few dozen words, too few features
+    for SimHash bit distances to be stable.) The best-ranked result of
+    each group is kept, with the engines and scores of the collapsed
+    results merged into it; canonical URLs are only used to group, the
+    kept result's URL is left as is.
+    """
+
+    def __init__(self):
+        self.similarity_threshold = settings.dedup_similarity_threshold
+        self.min_tokens = settings.dedup_min_tokens
+        self.shingle_size = settings.dedup_shingle_size
+
+        # Universal hash functions (a * x + b) mod p, one per signature slot;
+        # a < 2^31 and 32-bit shingle hashes keep a * x + b within uint64
+        rng = np.random.default_rng(0x5EED)
+        permutations = settings.dedup_minhash_permutations
+        self._hash_a = rng.integers(1, 1 << 31, size=permutations, dtype=np.uint64)
+        self._hash_b = rng.integers(0, 1 << 31, size=permutations, dtype=np.uint64)
+
+    @staticmethod
+    def canonicalize_url(url: str) -> str:
+        """Normalize a URL so trivially different variants compare equal"""
+        try:
+            parts = urlsplit(url.strip())
+        except ValueError:
+            return url
+
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return url
+        host = (parts.hostname or "").lower()
+        if host.startswith("www."):
+            host = host[4:]
+        netloc = host
+        if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{host}:{parts.port}"
+
+        query = sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+        )
+
+        path = parts.path or "/"
+        if len(path) > 1 and path.endswith("/"):
+            path = path.rstrip("/")
+
+        return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+    def deduplicate(self, results: List[SearchResult]) -> List[SearchResult]:
+        """Return results with duplicates collapsed into the best-ranked copy, in rank order"""
+        if len(results) < 2:
+            return results
+
+        # Group by canonical URL, ignoring the scheme
+        parent = list(range(len(results)))
+        canonical_urls = [self.canonicalize_url(result.url) for result in results]
+        first_by_url: Dict[str, int] = {}
+        for index, canonical_url in enumerate(canonical_urls):
+            url_key = canonical_url.split("://", 1)[-1]
+            if url_key in first_by_url:
+                parent[index] = first_by_url[url_key]
+            else:
+                first_by_url[url_key] = index
+
+        self._group_near_duplicates(results, parent)
+
+        groups: Dict[int, List[int]] = {}
+        for index in range(len(results)):
+            groups.setdefault(self._find(parent, index), []).append(index)
+
+        deduplicated = [
+            self._merge([results[i] for i in members])
+            for root, members in sorted(groups.items())
+        ]
+
+        if len(deduplicated) < len(results):
+            logger.info("Collapsed duplicate search results",
+                       original_count=len(results),
+                       deduplicated_count=len(deduplicated))
+
+        return deduplicated
+
+    def _group_near_duplicates(self, results: List[SearchResult], parent: List[int]):
+        """Union results whose estimated content similarity reaches the threshold"""
+        candidates = []
+        signatures = []
+        for index, result in enumerate(results):
+            signature = self._minhash(result.content)
+            if signature is not None:
+                candidates.append(index)
+                signatures.append(signature)
+
+        if len(candidates) < 2:
+            return
+
+        # Fraction of matching signature slots estimates the Jaccard similarity
+        matrix = np.stack(signatures)
+        similarity = (matrix[:, None, :] == matrix[None, :, :]).mean(axis=2)
+
+        rows, cols = np.nonzero(np.triu(similarity >= self.similarity_threshold, k=1))
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            self._union(parent, candidates[row], candidates[col])
+
+    def _minhash(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature over word shingles, or None if the text is too short"""
+        tokens = _WORD_PATTERN.findall(text.lower())
+        if len(tokens) < self.min_tokens:
+            return None
+
+        size = min(self.shingle_size, len(tokens))
+        shingles = {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+        # Signatures are only compared within one call, so the process-salted
+        # built-in hash is stable enough and much cheaper than a digest
+        hashes = np.fromiter((hash(s) & _UINT32_MASK for s in shingles), dtype=np.uint64, count=len(shingles))
+
+        permuted = (hashes[:, None] * self._hash_a + self._hash_b) % _MERSENNE_PRIME
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def _find(parent: List[int], index: int) -> int:
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def _union(self, parent: List[int], a: int, b: int):
+        root_a, root_b = self._find(parent, a), self._find(parent, b)
+        if root_a != root_b:
+            # Keep the better-ranked (earlier) result as the group root
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    @staticmethod
+    def _merge(members: List[SearchResult]) -> SearchResult:
+        """Merge a group into its best-ranked member, keeping that member's URL"""
+        best = members[0]
+        if len(members) == 1:
+            return best.model_copy(update={"engines": best.engines or [best.engine]})
+
+        engines = []
+        for member in members:
+            for engine in member.engines or [member.engine]:
+                if engine not in engines:
+                    engines.append(engine)
+
+        # Like SearXNG, a hit found by more engines/copies ranks higher
+        scores = [member.score for member in members if member.score is not None]
+
+        return best.model_copy(update={
+            "engines": engines,
+            "score": sum(scores) if scores else None,
+            "published_date": best.published_date or next(
+                (member.published_date for member in members if member.published_date), None
+            )
+        })
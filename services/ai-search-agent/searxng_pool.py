@@ -0,0 +1,225 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+import httpx
+import structlog
+from config import settings
+from resilience import AdaptiveTimeout
+from metrics import SEARXNG_BACKEND_REQUESTS, SEARXNG_HEDGES
+
+logger = structlog.get_logger()
+
+@dataclass
+class Backend:
+    """One SearXNG instance and its routing state"""
+    url: str
+    client: httpx.AsyncClient
+    outstanding: int = 0
+    ewma: Optional[float] = None
+    consecutive_failures: int = 0
+    ejection_streak: int = 0
+    ejected_until: float = 0.0
+
+    requests: int = 0
+    failures: int = 0
+    ejections: int = 0
+
+    @property
+    def ejected(self) -> bool:
+        return time.monotonic() < self.ejected_until
+
+class SearXNGPool:
+    """Route SearXNG requests across several instances
+
+    Each request goes to the backend with the lowest EWMA latency weighted
+    by its outstanding requests, so slow or busy instances get less
+    traffic. A backend that fails searxng_eject_consecutive_failures times
+    in a row (transport errors, 5xx or 429, e.g. after its engines were
+    banned) is ejected for searxng_eject_seconds, longer each time it is
+    ejected again without a success in between; if every backend is
+    ejected they are all used anyway. With hedging enabled, a request that
+    takes longer than the pool's searxng_hedge_percentile latency is also
+    sent to a second backend and the first good response wins.
+    """
+
+    def __init__(self, urls: List[str], client_factory: Callable[[str], httpx.AsyncClient]):
+        self.backends = [Backend(url=url, client=client_factory(url)) for url in dict.fromkeys(urls)]
+        self.alpha = settings.searxng_ewma_alpha
+        self.eject_failures = settings.searxng_eject_consecutive_failures
+        self.eject_seconds = settings.searxng_eject_seconds
+        self.eject_max_seconds = settings.searxng_eject_max_seconds
+
+        self.hedge_enabled = settings.searxng_hedge_enabled and len(self.backends) > 1
+        # Until enough latencies are seen the delay is the request timeout, i.e. no hedging
+        self.hedge_delay = AdaptiveTimeout(
+            settings.searxng_hedge_min_delay,
+            settings.request_timeout,
+            percentile=settings.searxng_hedge_percentile,
+            multiplier=1.0
+        )
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def _pick(self, exclude: Optional[Backend] = None) -> Optional[Backend]:
+        now = time.monotonic()
+        for backend in self.backends:
+            if backend.ejected_until and now >= backend.ejected_until:
+                # Back from ejection with a clean slate
+                backend.ejected_until = 0.0
+                backend.ewma = None
+        candidates = [b for b in self.backends if b is not exclude]
+        available = [b for b in candidates if not b.ejected] or candidates
+        if not available:
+            return None
+
+        # Backends without a latency sample yet are assumed to be average
+        known = [b.ewma for b in self.backends if b.ewma is not None]
+        default = sum(known) / len(known) if known else 1.0
+
+        best_score, best = None, []
+        for backend in available:
+            score = (backend.ewma if backend.ewma is not None else default) * (backend.outstanding + 1)
+            if best_score is None or score < best_score:
+                best_score, best = score, [backend]
+            elif score == best_score:
+                best.append(backend)
+        return random.choice(best)
+
+    async def get(self, path: str, params: Optional[Dict] = None, timeout: Optional[float] = None) -> httpx.Response:
+        """GET path from the best backend, hedging to a second one if it is slow
+
+        Returns the response (error statuses included) like httpx; raises
+        the transport error if every attempted backend failed.
+        """
+        timeout = timeout if timeout is not None else settings.request_timeout
+        primary = self._pick()
+        first = self._launch(primary, path, params, timeout)
+        tasks = [first]
+        try:
+            delay = self.hedge_delay.get()
+            if not self.hedge_enabled or delay >= timeout:
+                return await first
+
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            secondary = None if done else self._pick(exclude=primary)
+            if secondary is None:
+                return await first
+
+            self.hedges += 1
+            SEARXNG_HEDGES.labels(outcome="sent").inc()
+            tasks.append(self._launch(secondary, path, params, timeout))
+
+            fallback = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and not self._is_failure(task.result()):
+                        if task is not first:
+                            self.hedges_won += 1
+                            SEARXNG_HEDGES.labels(outcome="won").inc()
+                        return task.result()
+                    fallback = fallback or task
+            return fallback.result()
+        finally:
+            # Stop the losing (or abandoned) request
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _launch(self, backend: Backend, path: str, params: Optional[Dict], timeout: float) -> asyncio.Future:
+        # Counted before the task starts so concurrent picks see it
+        backend.outstanding += 1
+        backend.requests += 1
+        task = asyncio.ensure_future(self._send(backend, path, params, timeout))
+        # Also runs if the task is cancelled before it starts
+        task.add_done_callback(lambda _: self._finish(backend))
+        return task
+
+    @staticmethod
+    def _finish(backend: Backend):
+        backend.outstanding -= 1
+
+    async def _send(self, backend: Backend, path: str, params: Optional[Dict], timeout: float) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await backend.client.get(path, params=params, timeout=timeout)
+        except httpx.HTTPError:
+            self._record(backend, time.perf_counter() - start, False)
+            raise
+
+        elapsed = time.perf_counter() - start
+        if self._is_failure(response):
+            self._record(backend, elapsed, False)
+        else:
+            self._record(backend, elapsed, True)
+            self.hedge_delay.observe("", elapsed)
+        return response
+
+    @staticmethod
+    def _is_failure(response: httpx.Response) -> bool:
+        return response.status_code >= 500 or response.status_code == 429
+
+    def _record(self, backend: Backend, latency: float, success: bool):
+        if not success:
+            # Fast failures must not look fast: count at least double the current average
+            latency = max(latency, 2 * (backend.ewma or latency))
+        backend.ewma = latency if backend.ewma is None else self.alpha * latency + (1 - self.alpha) * backend.ewma
+        SEARXNG_BACKEND_REQUESTS.labels(backend=backend.url, outcome="ok" if success else "error").inc()
+        if success:
+            backend.consecutive_failures = 0
+            backend.ejection_streak = 0
+            return
+
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.eject_failures and not backend.ejected:
+            backend.consecutive_failures = 0
+            backend.ejection_streak += 1
+            backend.ejections += 1
+            duration = min(self.eject_max_seconds, self.eject_seconds * backend.ejection_streak)
+            backend.ejected_until = time.monotonic() + duration
+            logger.warning("Ejected failing SearXNG backend", backend=backend.url, seconds=duration)
+
+    async def health_check(self, timeout: float) -> bool:
+        """Probe every backend's /healthz; healthy if any backend is"""
+        async def probe(backend: Backend) -> bool:
+            try:
+                response = await backend.client.get("/healthz", timeout=httpx.Timeout(timeout))
+                return response.status_code == 200
+            except Exception as e:
+                logger.error("SearXNG health check failed", backend=backend.url, error=str(e))
+                return False
+
+        return any(await asyncio.gather(*(probe(backend) for backend in self.backends)))
+
+    def stats(self) -> Dict:
+        """Get per-backend routing state and hedging counts"""
+        now = time.monotonic()
+        return {
+            "backends": [
+                {
+                    "url": backend.url,
+                    "outstanding": backend.outstanding,
+                    "ewma_ms": backend.ewma * 1000 if backend.ewma is not None else None,
+                    "ejected": backend.ejected,
+                    "ejected_for": max(0.0, backend.ejected_until - now),
+                    "requests": backend.requests,
+                    "failures": backend.failures,
+                    "ejections": backend.ejections
+                }
+                for backend in self.backends
+            ],
+            "hedging": {
+                "enabled": self.hedge_enabled,
+                "delay_ms": self.hedge_delay.get() * 1000,
+                "sent": self.hedges,
+                "won": self.hedges_won
+            }
+        }
+
+    async def close(self):
+        """Close every backend's HTTP client"""
+        await asyncio.gather(*(backend.client.aclose() for backend in self.backends))
@@ -1,73 +1,172 @@
 import httpx
 import json
 import asyncio
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 import structlog
 from bs4 import BeautifulSoup
-import redis
 import hashlib
 from config import settings
 from models import SearchQuery, SearchResult, SearchResponse
+from cache_service import RedisCache, TieredCache
+from cache_codec import CacheCodec
+from singleflight import SingleFlight
+from stale_refresh import StaleRefresher
+from result_dedup import ResultDeduplicator
+from reranker import BM25Reranker
+from searxng_pool import SearXNGPool
+from resilience import DependencyPolicy, DependencyUnavailable, NegativeCache
+from metrics import CACHE_LOOKUP_LATENCY, SEARXNG_LATENCY, DEPENDENCY_ERRORS, record_cache_lookup
 
 logger = structlog.get_logger()
 
 class SearXNGService:
     """Service for interacting with SearXNG search engine"""
     
-    def __init__(self):
-        self.base_url = settings.searxng_base_url
+    def __init__(self, cache: Optional[RedisCache] = None):
+        self.base_urls = settings.searxng_base_urls or [settings.searxng_base_url]
         self.api_key = settings.searxng_api_key
         self.timeout = httpx.Timeout(settings.request_timeout)
         
-        # Initialize Redis for caching
+        # Long-lived pooled HTTP client per SearXNG instance, closed via
+        # close() at shutdown; requests are balanced across the instances
+        self.pool = SearXNGPool(self.base_urls, self._create_http_client)
+        
+        # In-process LRU tier in front of async Redis (which degrades to
+        # no caching when Redis is down)
+        self.cache = TieredCache(cache or RedisCache(), CacheCodec(SearchResponse))
+        
+        # Identical concurrent searches share one in-flight SearXNG request
+        self.in_flight = SingleFlight("search")
+        
+        # Expired entries are served stale while one rate-limited task refreshes them
+        self.stale_refresher = StaleRefresher("search")
+        
+        # Collapses URL variants and syndicated copies before truncation
+        self.deduplicator = ResultDeduplicator()
+        
+        # Orders results by local BM25 relevance so the best ones are kept
+        self.reranker = BM25Reranker()
+        
+        # Circuit breaker, latency-derived timeouts and budgeted retries for
+        # SearXNG, and fast failure for queries that just failed
+        self.policy = DependencyPolicy(
+            "searxng",
+            timeout_floor=settings.searxng_timeout_floor,
+            timeout_ceiling=settings.request_timeout,
+            is_failure=_is_failure,
+            is_retryable=_is_retryable,
+            is_timeout=lambda e: isinstance(e, httpx.TimeoutException)
+        )
+        self.failures = NegativeCache("searxng")
+    
+    def _create_http_client(self, base_url: str) -> httpx.AsyncClient:
+        """Create the pooled HTTP client used for all requests to one SearXNG instance"""
+        limits = httpx.Limits(
+            max_connections=settings.searxng_max_connections,
+            max_keepalive_connections=settings.searxng_max_keepalive_connections,
+            keepalive_expiry=settings.searxng_keepalive_expiry
+        )
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        
         try:
-            self.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
-        except Exception as e:
-            logger.warning("Redis connection failed, caching disabled", error=str(e))
-            self.redis_client = None
+            return httpx.AsyncClient(
+                base_url=base_url,
+                timeout=self.timeout,
+                limits=limits,
+                headers=headers,
+                http2=settings.searxng_http2
+            )
+        except ImportError:
+            # HTTP/2 requires the optional h2 package (httpx[http2])
+            logger.warning("HTTP/2 support not installed, falling back to HTTP/1.1")
+            return httpx.AsyncClient(
+                base_url=base_url,
+                timeout=self.timeout,
+                limits=limits,
+                headers=headers
+            )
+    
+    async def close(self):
+        """Close the pooled HTTP clients"""
+        await self.pool.close()
     
     def _get_cache_key(self, query: str, params: Dict) -> str:
         """Generate cache key for search query"""
         cache_data = f"{query}:{json.dumps(params, sort_keys=True)}"
         return f"search:{hashlib.md5(cache_data.encode()).hexdigest()}"
     
-    async def _get_cached_results(self, cache_key: str) -> Optional[SearchResponse]:
-        """Get cached search results"""
-        if not self.redis_client:
-            return None
+    async def _get_cached_results(self, cache_key: str, search_query: SearchQuery,
+                                  params: Dict) -> Tuple[Optional[SearchResponse], Optional[str]]:
+        """Get cached search results and the cache tier that served them
         
+        Stale results are returned marked stale, and refreshed in the background.
+        """
         try:
-            cached_data = self.redis_client.get(cache_key)
-            if cached_data:
-                data = json.loads(cached_data)
-                logger.info("Cache hit for search query", cache_key=cache_key)
-                return SearchResponse(**data)
+            with CACHE_LOOKUP_LATENCY.labels(cache="search").time():
+                cached_results, tier, stale = await self.cache.get(cache_key)
+            record_cache_lookup("search", tier)
+            if cached_results:
+                logger.info("Cache hit for search query", cache_key=cache_key, tier=tier, stale=stale)
+                if stale:
+                    self.stale_refresher.refresh(cache_key, lambda: self.in_flight.do(
+                        cache_key,
+                        lambda: self._fetch_results(search_query, params, cache_key, datetime.now())
+                    ))
+                    cached_results = cached_results.model_copy(update={"stale": True})
+                return cached_results, tier
         except Exception as e:
             logger.warning("Cache retrieval failed", error=str(e))
         
-        return None
+        return None, None
     
     async def _cache_results(self, cache_key: str, results: SearchResponse):
         """Cache search results"""
-        if not self.redis_client:
-            return
-        
         try:
-            self.redis_client.setex(
-                cache_key,
-                settings.cache_timeout,
-                results.model_dump_json()
-            )
-            logger.info("Cached search results", cache_key=cache_key)
+            stored = await self.cache.set(cache_key, results, settings.cache_timeout)
+            if stored:
+                logger.info("Cached search results", cache_key=cache_key)
         except Exception as e:
             logger.warning("Cache storage failed", error=str(e))
     
     async def search(self, search_query: SearchQuery) -> SearchResponse:
         """Perform search using SearXNG"""
+        search_response, _ = await self.search_with_cache_info(search_query)
+        return search_response
+    
+    async def search_with_cache_info(self, search_query: SearchQuery) -> Tuple[SearchResponse, Optional[str]]:
+        """Perform search, also returning the cache tier that served it (None if fetched)"""
+        cached_results, cache_tier = await self.cached_search(search_query)
+        if cached_results:
+            return cached_results, cache_tier
+        
+        return await self.fetch(search_query), None
+    
+    async def cached_search(self, search_query: SearchQuery) -> Tuple[Optional[SearchResponse], Optional[str]]:
+        """Get a search from the cache tiers only, with the tier that served it (None, None on a miss)"""
+        params = self._build_params(search_query)
+        cache_key = self._get_cache_key(search_query.query, params)
+        return await self._get_cached_results(cache_key, search_query, params)
+    
+    async def fetch(self, search_query: SearchQuery) -> SearchResponse:
+        """Perform search against SearXNG without checking the cache, and cache the results"""
         start_time = datetime.now()
+        params = self._build_params(search_query)
+        cache_key = self._get_cache_key(search_query.query, params)
+        
+        # Queries that just failed fail fast instead of hitting SearXNG again
+        self.failures.check(cache_key)
         
-        # Prepare search parameters
+        # Coalesce identical concurrent searches into one SearXNG request
+        return await self.in_flight.do(
+            cache_key,
+            lambda: self._fetch_results(search_query, params, cache_key, start_time)
+        )
+    
+    def _build_params(self, search_query: SearchQuery) -> Dict:
+        """Build the SearXNG request parameters for a search"""
         params = {
             "q": search_query.query,
             "format": "json",
@@ -84,82 +183,95 @@ class SearXNGService:
         if search_query.time_range:
             params["time_range"] = search_query.time_range
         
-        # Check cache first
-        cache_key = self._get_cache_key(search_query.query, params)
-        cached_results = await self._get_cached_results(cache_key)
-        if cached_results:
-            return cached_results
-        
-        # Perform the search
+        return params
+    
+    async def _fetch_results(self, search_query: SearchQuery, params: Dict,
+                             cache_key: str, start_time: datetime) -> SearchResponse:
+        """Fetch results from SearXNG and cache them"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                headers = {}
-                if self.api_key:
-                    headers["Authorization"] = f"Bearer {self.api_key}"
-                
-                response = await client.get(
-                    f"{self.base_url}/search",
-                    params=params,
-                    headers=headers
-                )
-                response.raise_for_status()
-                
-                search_data = response.json()
-                
-                # Parse results
-                results = []
-                engines_used = set()
-                
-                for result in search_data.get("results", []):
-                    search_result = SearchResult(
-                        title=result.get("title", ""),
-                        url=result.get("url", ""),
-                        content=result.get("content", ""),
-                        engine=result.get("engine", "unknown"),
-                        score=result.get("score"),
-                        published_date=self._parse_date(result.get("publishedDate"))
-                    )
-                    results.append(search_result)
-                    engines_used.add(result.get("engine", "unknown"))
-                
-                # Limit results
-                if len(results) > settings.max_search_results:
-                    results = results[:settings.max_search_results]
-                
-                search_time = (datetime.now() - start_time).total_seconds()
-                
-                search_response = SearchResponse(
-                    query=search_query.query,
-                    results=results,
-                    total_results=len(results),
-                    search_time=search_time,
-                    engines_used=list(engines_used)
+            response = await self.policy.call(lambda timeout: self._get_search(params, timeout))
+            search_data = response.json()
+            
+            # Parse results
+            results = []
+            engines_used = set()
+            
+            for result in search_data.get("results", []):
+                engine = result.get("engine", "unknown")
+                search_result = SearchResult(
+                    title=result.get("title", ""),
+                    url=result.get("url", ""),
+                    content=result.get("content", ""),
+                    engine=engine,
+                    engines=result.get("engines") or [engine],
+                    score=result.get("score"),
+                    published_date=self._parse_date(result.get("publishedDate"))
                 )
-                
-                # Cache the results
-                await self._cache_results(cache_key, search_response)
-                
-                logger.info("Search completed successfully",
-                           query=search_query.query,
-                           results_count=len(results),
-                           search_time=search_time)
-                
-                return search_response
-                
+                results.append(search_result)
+                engines_used.add(engine)
+            
+            # Collapse duplicates so they don't use up result slots
+            if settings.dedup_enabled:
+                results = self.deduplicator.deduplicate(results)
+            
+            # Rerank locally so truncation keeps the most relevant results
+            if settings.rerank_enabled:
+                results = self.reranker.rerank(search_query.query, results)
+            
+            # Limit results
+            if len(results) > settings.max_search_results:
+                results = results[:settings.max_search_results]
+            
+            search_time = (datetime.now() - start_time).total_seconds()
+            
+            search_response = SearchResponse(
+                query=search_query.query,
+                results=results,
+                total_results=len(results),
+                search_time=search_time,
+                engines_used=list(engines_used)
+            )
+            
+            # Cache the results
+            await self._cache_results(cache_key, search_response)
+            
+            logger.info("Search completed successfully",
+                       query=search_query.query,
+                       results_count=len(results),
+                       search_time=search_time)
+            
+            return search_response
+            
+        except DependencyUnavailable:
+            raise
+        
         except httpx.HTTPStatusError as e:
+            DEPENDENCY_ERRORS.labels(dependency="searxng").inc()
             logger.error("SearXNG HTTP error",
                         status_code=e.response.status_code,
                         error=str(e))
-            raise Exception(f"Search service error: {e.response.status_code}")
+            error = Exception(f"Search service error: {e.response.status_code}")
+            self.failures.add(cache_key, error)
+            raise error
         
         except httpx.RequestError as e:
+            DEPENDENCY_ERRORS.labels(dependency="searxng").inc()
             logger.error("SearXNG request error", error=str(e))
-            raise Exception(f"Search service unavailable: {str(e)}")
+            error = Exception(f"Search service unavailable: {str(e)}")
+            self.failures.add(cache_key, error)
+            raise error
         
         except Exception as e:
             logger.error("Search failed", error=str(e))
             raise Exception(f"Search failed: {str(e)}")
     
+    async def _get_search(self, params: Dict, timeout: float) -> httpx.Response:
+        """Send one search request to SearXNG, raising on error statuses"""
+        with SEARXNG_LATENCY.time():
+            response = await self.pool.get("/search", params=params, timeout=timeout)
+        response.raise_for_status()
+        return response
+    
     def _parse_date(self, date_str: Optional[str]) -> Optional[datetime]:
         """Parse published date from search result"""
         if not date_str:
@@ -187,11 +299,17 @@ class SearXNGService:
         return None
     
     async def health_check(self) -> bool:
-        """Check if SearXNG service is available"""
-        try:
-            async with httpx.AsyncClient(timeout=httpx.Timeout(10.0)) as client:
-                response = await client.get(f"{self.base_url}/stats")
-                return response.status_code == 200
-        except Exception as e:
-            logger.error("SearXNG health check failed", error=str(e))
-            return False
+        """Check if SearXNG service is available (any instance in the pool)"""
+        return await self.pool.health_check(settings.health_probe_timeout)
+
+def _is_failure(error: Exception) -> bool:
+    """Whether an error counts against SearXNG's circuit breaker (4xx other than 429 do not)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, httpx.RequestError)
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether a failed SearXNG search is worth retrying (on another instance, if pooled)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.RequestError)
@@ -0,0 +1,252 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+import structlog
+from openai import AsyncOpenAI
+from config import settings
+from resilience import CLOSED, CircuitBreaker
+from models import SearchResponse, WebSearchResponse
+from metrics import CACHE_LOOKUP_LATENCY, DEPENDENCY_ERRORS, record_cache_lookup
+
+logger = structlog.get_logger()
+
+class SemanticCache:
+    """Reuse cached web search responses for semantically similar queries
+
+    Queries are embedded through Ollama's OpenAI-compatible embeddings
+    endpoint and kept as L2-normalized rows of a preallocated NumPy matrix,
+    so a lookup is one matrix product over the whole index. Entries only
+    match within the same namespace (all request options except the query);
+    past semantic_cache_max_namespaces, the least recently used namespace
+    and its entries are dropped.
+
+    Search must not depend on Ollama: embeddings get their own short
+    timeout (semantic_cache_embed_timeout), are skipped while Ollama's
+    circuit breaker is not closed, and any failure is treated as a miss.
+    """
+
+    TIER = "semantic"
+
+    def __init__(self, client: AsyncOpenAI, breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.breaker = breaker
+        self.embed_timeout = settings.semantic_cache_embed_timeout
+        self.enabled = settings.semantic_cache_enabled
+        self.model = settings.semantic_cache_model
+        self.threshold = settings.semantic_cache_threshold
+        self.max_entries = settings.semantic_cache_max_entries
+        self.ttl = settings.cache_timeout
+        self.max_namespaces = settings.semantic_cache_max_namespaces
+
+        # Index rows are allocated on the first embedding, once the dimension is known
+        self._vectors: Optional[np.ndarray] = None
+        self._expires_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._namespace_ids = np.full(self.max_entries, -1, dtype=np.int32)
+        # namespace -> id, least recently used first
+        self._namespace_index: "OrderedDict[str, int]" = OrderedDict()
+        self._namespaces: List[Optional[str]] = [None] * self.max_entries
+        self._queries: List[Optional[str]] = [None] * self.max_entries
+        self._responses: List[Optional[WebSearchResponse]] = [None] * self.max_entries
+        self._slots: Dict[Tuple[str, str], int] = {}
+        self._next_slot = 0
+
+        self._verification_tasks: Set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.embedding_errors = 0
+        self.embeddings_skipped = 0
+        self.verifications = 0
+        self.false_positives = 0
+        self.namespace_evictions = 0
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in one batched request, returning L2-normalized rows"""
+        response = await self.client.embeddings.create(model=self.model, input=texts, timeout=self.embed_timeout)
+        vectors = np.array(
+            [item.embedding for item in sorted(response.data, key=lambda item: item.index)],
+            dtype=np.float32
+        )
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    async def lookup(self, query: str, namespace: str) -> Tuple[Optional[WebSearchResponse], Optional[np.ndarray]]:
+        """Find a cached response for a similar query
+
+        Returns the matching response (or None) and the query embedding,
+        which can be passed to store() to avoid embedding twice.
+        """
+        results = await self.lookup_many([query], namespace)
+        return results[0]
+
+    async def lookup_many(self, queries: List[str], namespace: str) -> List[Tuple[Optional[WebSearchResponse], Optional[np.ndarray]]]:
+        """Find cached responses for several queries with one embedding call"""
+        if not self.enabled or not queries:
+            return [(None, None)] * len(queries)
+
+        if self.breaker is not None and self.breaker.state != CLOSED:
+            # Ollama is failing; go straight to the search instead of waiting on it
+            self.embeddings_skipped += 1
+            return [(None, None)] * len(queries)
+
+        lookup_start = time.perf_counter()
+        try:
+            query_vectors = await self.embed(queries)
+        except Exception as e:
+            self.embedding_errors += 1
+            DEPENDENCY_ERRORS.labels(dependency="ollama").inc()
+            logger.warning("Query embedding failed, skipping semantic cache", error=str(e))
+            return [(None, None)] * len(queries)
+
+        matches = self._best_matches(query_vectors, namespace)
+        # Includes the embedding call, which dominates the lookup
+        CACHE_LOOKUP_LATENCY.labels(cache="semantic").observe(time.perf_counter() - lookup_start)
+
+        results = []
+        for query, query_vector, (slot, similarity) in zip(queries, query_vectors, matches):
+            if slot is None or similarity < self.threshold:
+                self.misses += 1
+                record_cache_lookup("semantic", None)
+                results.append((None, query_vector))
+                continue
+
+            self.hits += 1
+            record_cache_lookup("semantic", self.TIER)
+            logger.info("Semantic cache hit",
+                       query=query,
+                       matched_query=self._queries[slot],
+                       similarity=round(similarity, 4))
+            results.append((self._responses[slot], query_vector))
+
+        return results
+
+    def _best_matches(self, query_vectors: np.ndarray, namespace: str) -> List[Tuple[Optional[int], float]]:
+        """Get the most similar live slot in the namespace for each query vector"""
+        if self._vectors is None or not self._slots:
+            return [(None, 0.0)] * len(query_vectors)
+
+        namespace_id = self._namespace_index.get(namespace)
+        if namespace_id is None:
+            return [(None, 0.0)] * len(query_vectors)
+        self._namespace_index.move_to_end(namespace)
+
+        live = (self._namespace_ids == namespace_id) & (self._expires_at > time.time())
+        if not live.any():
+            return [(None, 0.0)] * len(query_vectors)
+
+        candidates = np.flatnonzero(live)
+        # Cosine similarity of every query against every candidate in one product
+        similarities = query_vectors @ self._vectors[candidates].T
+        best = similarities.argmax(axis=1)
+
+        return [
+            (int(candidates[index]), float(similarities[row, index]))
+            for row, index in enumerate(best)
+        ]
+
+    def store(self, query_vector: np.ndarray, query: str, namespace: str, response: WebSearchResponse):
+        """Add a response to the index, replacing the oldest entry when full"""
+        if not self.enabled or query_vector is None:
+            return
+
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, query_vector.shape[0]), dtype=np.float32)
+
+        # Before picking a slot, since making room for the namespace frees slots
+        namespace_id = self._namespace_id(namespace)
+        slot = self._slots.get((namespace, query))
+        if slot is None:
+            slot = self._next_slot
+            self._next_slot = (self._next_slot + 1) % self.max_entries
+            evicted = (self._namespaces[slot], self._queries[slot])
+            self._slots.pop(evicted, None)
+            self._slots[(namespace, query)] = slot
+
+        self._vectors[slot] = query_vector
+        self._expires_at[slot] = time.time() + self.ttl
+        self._namespace_ids[slot] = namespace_id
+        self._namespaces[slot] = namespace
+        self._queries[slot] = query
+        self._responses[slot] = response
+
+    def _namespace_id(self, namespace: str) -> int:
+        """Get the id of a namespace, dropping the least recently used one to make room"""
+        namespace_id = self._namespace_index.get(namespace)
+        if namespace_id is not None:
+            self._namespace_index.move_to_end(namespace)
+            return namespace_id
+
+        if len(self._namespace_index) >= self.max_namespaces:
+            # Reuse the evicted namespace's id once its entries are gone
+            _, namespace_id = self._namespace_index.popitem(last=False)
+            for slot in np.flatnonzero(self._namespace_ids == namespace_id):
+                self._slots.pop((self._namespaces[slot], self._queries[slot]), None)
+                self._namespace_ids[slot] = -1
+                self._expires_at[slot] = 0.0
+                self._namespaces[slot] = self._queries[slot] = self._responses[slot] = None
+            self.namespace_evictions += 1
+        else:
+            namespace_id = len(self._namespace_index)
+
+        self._namespace_index[namespace] = namespace_id
+        return namespace_id
+
+    def verify_in_background(self, query: str, cached: SearchResponse,
+                             fetch: Callable[[], Awaitable[SearchResponse]]):
+        """On a sampled fraction of hits, re-run the search and check the cached results still fit
+
+        A hit counts as a false positive when the URL overlap (Jaccard) between
+        the cached and fresh results is below semantic_cache_verify_min_overlap.
+        """
+        if random.random() >= settings.semantic_cache_verify_rate:
+            return
+
+        task = asyncio.create_task(self._verify(query, cached, fetch))
+        self._verification_tasks.add(task)
+        task.add_done_callback(self._verification_tasks.discard)
+
+    async def _verify(self, query: str, cached: SearchResponse,
+                      fetch: Callable[[], Awaitable[SearchResponse]]):
+        try:
+            fresh = await fetch()
+        except Exception as e:
+            logger.warning("Semantic cache verification failed", query=query, error=str(e))
+            return
+
+        cached_urls = {result.url for result in cached.results}
+        fresh_urls = {result.url for result in fresh.results}
+        union = cached_urls | fresh_urls
+        overlap = len(cached_urls & fresh_urls) / len(union) if union else 1.0
+
+        self.verifications += 1
+        if overlap < settings.semantic_cache_verify_min_overlap:
+            self.false_positives += 1
+            logger.warning("Semantic cache false positive",
+                          query=query,
+                          matched_query=cached.query,
+                          overlap=round(overlap, 3))
+
+    def stats(self) -> Dict:
+        """Get index size, hit/miss and false-positive statistics"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "model": self.model,
+            "threshold": self.threshold,
+            "entries": len(self._slots),
+            "max_entries": self.max_entries,
+            "namespaces": len(self._namespace_index),
+            "max_namespaces": self.max_namespaces,
+            "namespace_evictions": self.namespace_evictions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "embedding_errors": self.embedding_errors,
+            "embeddings_skipped": self.embeddings_skipped,
+            "verifications": self.verifications,
+            "false_positives": self.false_positives,
+            "false_positive_rate": self.false_positives / self.verifications if self.verifications else 0.0
+        }
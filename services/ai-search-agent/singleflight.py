@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+import structlog
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one shared in-flight execution"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[str, "asyncio.Task[Any]"] = {}
+
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn for key, or await the execution already in flight for it"""
+        self.calls += 1
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.debug("Coalesced in-flight request", flight=self.name, key=key)
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+
+        # Shield so one cancelled caller does not cancel the shared execution
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: "asyncio.Task[Any]"):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        """Get call, execution and coalescing counts"""
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "coalesced_ratio": self.coalesced / self.calls if self.calls else 0.0
+        }
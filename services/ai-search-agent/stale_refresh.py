@@ -0,0 +1,73 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+import structlog
+from config import settings
+
+logger = structlog.get_logger()
+
+class StaleRefresher:
+    """Refresh stale cache entries in the background
+
+    At most one refresh per key runs at a time, and refreshes are started
+    at no more than stale_refresh_rate per second (with bursts up to
+    stale_refresh_burst) so a wave of expiring entries can't stampede
+    SearXNG or the LLM. A skipped refresh is simply retried on the next
+    stale hit.
+    """
+
+    def __init__(self, name: str, rate: Optional[float] = None, burst: Optional[int] = None):
+        self.name = name
+        self.rate = rate if rate is not None else settings.stale_refresh_rate
+        self.burst = burst if burst is not None else settings.stale_refresh_burst
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._pending: Dict[str, "asyncio.Task[Any]"] = {}
+
+        self.scheduled = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def refresh(self, key: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+        """Start refreshing key with fn unless already refreshing or rate limited"""
+        if key in self._pending:
+            self.coalesced += 1
+            return False
+        if not self._take_token():
+            self.rate_limited += 1
+            return False
+
+        self.scheduled += 1
+        task = asyncio.ensure_future(fn())
+        self._pending[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return True
+
+    def _finish(self, key: str, task: "asyncio.Task[Any]"):
+        self._pending.pop(key, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.failed += 1
+            logger.warning("Stale cache refresh failed", cache=self.name, key=key, error=str(error))
+
+    def stats(self) -> Dict:
+        """Get refresh statistics"""
+        return {
+            "scheduled": self.scheduled,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+            "in_flight": len(self._pending)
+        }
@@ -0,0 +1,109 @@
+import zlib
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from cache_codec import CODEC_VERSION, HEADER, MAGIC, CacheCodec
+from models import AIAnalysisResponse, SearchResponse, SearchResult
+
+
+def make_response(count: int = 20) -> SearchResponse:
+    return SearchResponse(
+        query="python asyncio",
+        results=[
+            SearchResult(
+                title=f"Result {i}",
+                url=f"https://example.com/{i}",
+                content="asyncio event loop tutorial " * 10,
+                engine="duckduckgo",
+                engines=["duckduckgo", "bing"],
+                score=1.0 / (i + 1),
+                published_date=datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc) if i % 2 else None
+            )
+            for i in range(count)
+        ],
+        total_results=count,
+        search_time=0.123,
+        engines_used=["duckduckgo", "bing"]
+    )
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "zstd"])
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+@pytest.mark.parametrize("trusted", [True, False])
+def test_round_trip(encoding, compression, trusted):
+    if encoding == "msgpack":
+        pytest.importorskip("msgpack")
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    codec = CacheCodec(SearchResponse, encoding=encoding, compression=compression)
+    codec.trusted = trusted
+    response = make_response()
+
+    payload = codec.encode(response)
+    decoded = codec.decode(payload)
+
+    assert payload[0] == MAGIC
+    assert decoded == response
+    assert decoded.model_dump() == response.model_dump()
+    assert isinstance(decoded.results[1].published_date, datetime)
+    if encoding == "json":
+        assert CacheCodec.raw_size(payload) == len(response.model_dump_json().encode())
+    stats = codec.stats()
+    assert stats["compressed"] == (0 if compression == "none" else 1)
+    assert stats["trusted_decodes" if trusted else "validated_decodes"] == 1
+
+
+def test_small_payloads_are_not_compressed():
+    codec = CacheCodec(SearchResponse, encoding="json", compression="zlib")
+    codec.min_compress_bytes = 1 << 20
+    payload = codec.encode(make_response(1))
+    assert codec.stats()["compressed"] == 0
+    assert codec.decode(payload) == make_response(1)
+
+
+def test_unknown_version_is_a_miss():
+    codec = CacheCodec(SearchResponse, encoding="json", compression="zlib")
+    payload = bytearray(codec.encode(make_response()))
+    payload[1] = CODEC_VERSION + 1
+
+    assert codec.decode(bytes(payload)) is None
+    assert codec.stats()["version_mismatches"] == 1
+
+
+def test_legacy_plain_json_is_read():
+    codec = CacheCodec(AIAnalysisResponse, encoding="json", compression="zlib")
+    analysis = AIAnalysisResponse(query="q", summary="s", key_points=["a"], sources=["https://example.com"],
+                                  confidence_score=0.8, model_used="test-model", analysis_time=1.5)
+
+    assert codec.decode(analysis.model_dump_json()) == analysis
+    assert codec.stats()["legacy_decodes"] == 1
+
+
+def test_legacy_encoding_writes_plain_json():
+    codec = CacheCodec(SearchResponse, encoding="legacy", compression="none")
+    response = make_response(2)
+    assert codec.encode(response) == response.model_dump_json().encode()
+
+
+def test_trusted_decode_falls_back_to_validation():
+    codec = CacheCodec(SearchResponse, encoding="json", compression="none")
+    # total_results is required, so the trusted path gives up and validation reports it
+    body = b'{"query": "q", "results": [], "search_time": 0.1, "engines_used": []}'
+    payload = HEADER.pack(MAGIC, CODEC_VERSION, 1, 0, len(body)) + body
+
+    with pytest.raises(ValidationError):
+        codec.decode(payload)
+    assert codec.stats()["trusted_decodes"] == 0
+    assert codec.stats()["validated_decodes"] == 1
+
+
+def test_fields_from_a_newer_schema_are_dropped():
+    codec = CacheCodec(SearchResponse, encoding="json", compression="zlib")
+    data = make_response(1).model_dump_json().encode()[:-1] + b', "added_later": 1}'
+    payload = HEADER.pack(MAGIC, CODEC_VERSION, 1, 1, len(data)) + zlib.compress(data)
+
+    decoded = codec.decode(payload)
+    assert decoded == make_response(1)
+    assert not hasattr(decoded, "added_later")
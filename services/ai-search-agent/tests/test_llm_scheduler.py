@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import BACKGROUND, INTERACTIVE, DeadlineExceeded, LLMScheduler, SchedulerQueueFull
+
+MODEL = "test-model"
+
+
+def make_scheduler(max_queue_depth: int = 1) -> LLMScheduler:
+    scheduler = LLMScheduler()
+    scheduler.max_queue_depth = max_queue_depth
+    scheduler.batch_window = 0
+    scheduler._get_queue(MODEL).limit = 1
+    return scheduler
+
+
+async def hold_slot(scheduler: LLMScheduler, release: asyncio.Event, granted: asyncio.Event):
+    async with scheduler.slot(MODEL):
+        granted.set()
+        await release.wait()
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = make_scheduler()
+        release, granted = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold_slot(scheduler, release, granted))
+        await granted.wait()
+
+        with pytest.raises(DeadlineExceeded):
+            async with scheduler.slot(MODEL, timeout=0.01):
+                pass
+
+        stats = scheduler.stats()[MODEL]
+        assert stats["waiting"] == {INTERACTIVE: 0, BACKGROUND: 0}
+        assert stats["expired"] == 1
+
+        # The dead ticket must not count towards the depth limit
+        waiter_granted = asyncio.Event()
+        waiter = asyncio.create_task(hold_slot(scheduler, release, waiter_granted))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()[MODEL]["rejected"] == 0
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert waiter_granted.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = make_scheduler()
+        release, granted = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold_slot(scheduler, release, granted))
+        await granted.wait()
+
+        async def wait_for_slot():
+            async with scheduler.slot(MODEL, priority=BACKGROUND, timeout=10):
+                pass
+
+        waiter = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()[MODEL]["waiting"][BACKGROUND] == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()[MODEL]["waiting"][BACKGROUND] == 0
+
+        release.set()
+        await holder
+
+    asyncio.run(scenario())
+
+
+def test_live_waiters_fill_the_queue():
+    async def scenario():
+        scheduler = make_scheduler()
+        release, granted = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold_slot(scheduler, release, granted))
+        await granted.wait()
+
+        waiter = asyncio.create_task(hold_slot(scheduler, asyncio.Event(), asyncio.Event()))
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(SchedulerQueueFull):
+            async with scheduler.slot(MODEL):
+                pass
+        assert scheduler.stats()[MODEL]["rejected"] == 1
+
+        waiter.cancel()
+        release.set()
+        await holder
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.stats()[MODEL]["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_released_after_block():
+    async def scenario():
+        scheduler = make_scheduler()
+        for _ in range(3):
+            async with scheduler.slot(MODEL):
+                assert scheduler.stats()[MODEL]["active"] == 1
+        stats = scheduler.stats()[MODEL]
+        assert stats["active"] == 0
+        assert stats["granted"] == stats["completed"] == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import pytest
+
+from config import settings
+from models import AIAnalysisRequest, SearchResult
+from prompt_builder import (
+    MIN_COMPLETION_TOKENS,
+    MIN_RESULT_TOKENS,
+    PromptBuilder,
+    PromptTooLong,
+)
+
+MODEL = "test-model"
+WINDOW = 2048
+
+
+@pytest.fixture
+def builder(monkeypatch):
+    monkeypatch.setattr(settings, "llm_default_num_ctx", WINDOW)
+    monkeypatch.setattr(settings, "llm_max_tokens", 2000)
+    monkeypatch.setattr(settings, "prompt_chars_per_token", 4)
+    return PromptBuilder()
+
+
+def make_results(count: int = 5):
+    return [
+        SearchResult(
+            title=f"Result {i}",
+            url=f"https://example.com/{i}",
+            content=f"topic{i} " * 200,
+            engine="test"
+        )
+        for i in range(count)
+    ]
+
+
+def test_long_context_on_small_window_raises(builder):
+    request = AIAnalysisRequest(query="q", search_results=make_results(), context="x" * 4 * WINDOW)
+    with pytest.raises(PromptTooLong):
+        builder.build(request, MODEL)
+
+
+def test_completion_never_takes_the_last_result_slot(builder):
+    # Step the context up until the prompt no longer fits; every prompt that
+    # does fit must carry at least one result and a usable completion
+    context_chars = 0
+    while True:
+        request = AIAnalysisRequest(query="q", search_results=make_results(), context="x" * context_chars)
+        try:
+            prompt = builder.build(request, MODEL)
+        except PromptTooLong:
+            break
+        assert prompt.results_included >= 1
+        assert prompt.max_completion_tokens >= MIN_COMPLETION_TOKENS
+        assert prompt.estimated_tokens + prompt.max_completion_tokens <= WINDOW
+        context_chars += 16
+    assert context_chars > 0
+
+
+def test_query_too_long_for_completion_and_result(builder):
+    # Find the longest context that fits, then add enough to eat the result slot
+    context_chars = 0
+    while True:
+        request = AIAnalysisRequest(query="q", search_results=[], context="x" * (context_chars + 4))
+        try:
+            builder.build(request, MODEL)
+        except PromptTooLong:
+            break
+        context_chars += 4
+    request = AIAnalysisRequest(query="q", search_results=[], context="x" * context_chars)
+    prompt = builder.build(request, MODEL)
+    assert prompt.max_completion_tokens == MIN_COMPLETION_TOKENS
+    assert prompt.context_window - prompt.estimated_tokens - prompt.max_completion_tokens >= MIN_RESULT_TOKENS
+
+
+def test_roomy_window_reserves_half_for_the_completion(builder):
+    request = AIAnalysisRequest(query="what is python", search_results=make_results())
+    prompt = builder.build(request, MODEL)
+    assert prompt.max_completion_tokens == WINDOW // 2
+    assert prompt.results_included + prompt.results_dropped == 5
+    assert prompt.results_included >= 1
+
+
+def test_redundant_snippets_are_skipped(builder):
+    duplicate = SearchResult(title="Copy", url="https://example.com/copy",
+                             content="topic0 " * 200, engine="test")
+    request = AIAnalysisRequest(query="q", search_results=make_results(1) + [duplicate])
+    prompt = builder.build(request, MODEL)
+    assert prompt.results_included == 1
+    assert prompt.results_dropped == 1
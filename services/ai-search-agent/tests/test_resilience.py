@@ -0,0 +1,159 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class DependencyError(Exception):
+    pass
+
+
+class ClientError(Exception):
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the breaker's clock; asyncio keeps the real one
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    breaker = CircuitBreaker("test", is_failure=lambda e: not isinstance(e, ClientError))
+    breaker.failure_threshold = 0.5
+    breaker.min_calls = 4
+    breaker.window = 30
+    breaker.open_seconds = 10
+    breaker.half_open_max_calls = 1
+    return breaker
+
+
+async def call(breaker: CircuitBreaker, error: Exception = None, counted: bool = True):
+    try:
+        async with breaker.guard() as admission:
+            admission.counted = counted
+            if error is not None:
+                raise error
+    except (DependencyError, ClientError):
+        pass
+
+
+def run(breaker: CircuitBreaker, *errors):
+    async def calls():
+        for error in errors:
+            await call(breaker, error)
+    asyncio.run(calls())
+
+
+def test_stays_closed_below_min_calls(breaker):
+    run(breaker, DependencyError(), DependencyError(), DependencyError())
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_failure_threshold(breaker):
+    run(breaker, None, None, DependencyError(), DependencyError())
+    assert breaker.state == OPEN
+    assert breaker.opened == 1
+
+    with pytest.raises(CircuitOpen) as excinfo:
+        breaker.check()
+    assert excinfo.value.retry_after == pytest.approx(10)
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_client_errors_and_uncounted_calls_do_not_open(breaker):
+    run(breaker, None, ClientError(), ClientError(), ClientError())
+    assert breaker.state == CLOSED
+
+    async def uncounted():
+        for _ in range(10):
+            await call(breaker, DependencyError(), counted=False)
+    asyncio.run(uncounted())
+    assert breaker.state == CLOSED
+    assert breaker.stats()["recent_failures"] == 0
+
+
+def test_failures_age_out_of_the_window(breaker, clock):
+    run(breaker, DependencyError(), DependencyError(), DependencyError())
+    clock.now += 31
+    run(breaker, None, DependencyError())
+    assert breaker.stats()["recent_calls"] == 2
+    assert breaker.state == CLOSED
+
+
+def test_successful_probe_closes(breaker, clock):
+    run(breaker, *[DependencyError()] * 4)
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.available()
+
+    run(breaker, None)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["recent_calls"] == 0
+
+
+def test_failed_probe_reopens(breaker, clock):
+    run(breaker, *[DependencyError()] * 4)
+    clock.now += 10
+    run(breaker, DependencyError())
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+    assert breaker.retry_after() == pytest.approx(10)
+
+
+def test_half_open_admits_limited_probes(breaker, clock):
+    run(breaker, *[DependencyError()] * 4)
+    clock.now += 10
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def probe():
+            async with breaker.guard():
+                await release.wait()
+
+        first = asyncio.create_task(probe())
+        await asyncio.sleep(0)
+        assert not breaker.available()
+        with pytest.raises(CircuitOpen):
+            async with breaker.guard():
+                pass
+        release.set()
+        await first
+
+    asyncio.run(scenario())
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_frees_its_slot(breaker, clock):
+    run(breaker, *[DependencyError()] * 4)
+    clock.now += 10
+
+    async def scenario():
+        async def probe():
+            async with breaker.guard():
+                await asyncio.sleep(3600)
+
+        task = asyncio.create_task(probe())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert breaker.state == HALF_OPEN
+    assert breaker.available()